@@ -0,0 +1,561 @@
+"""
+- Module: It contains the benchmarks for the routing table hot paths of Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from node import Node
+from contact import Contact, ContactPool
+from routingTable import RoutingTable
+from concurrentRoutingTable import ConcurrentRoutingTable
+from bucket import Bucket
+from constants import HASH_SIZE, BUCKET_SIZE, K
+from hash import newIDs, distance, computeIntHash
+import argparse
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+
+SIZES = (100, 1000, 10000, 100000, 1000000)
+"""
+Numbers of known contacts the suite offers to the routing table
+"""
+
+MIXES = {
+    'lookupHeavy': (0.05, 0.25, 0.70),
+    'churn': (0.40, 0.30, 0.30),
+}
+"""
+Shares of insert, touch and lookup operations in the mixed workloads
+"""
+
+def linearBucketIndex(routingTable, nodeId):
+    """
+    reference linear scan over the bucket list, as the routing table
+    used to locate buckets, kept for comparison purposes
+    @param routingTable: routing table whose buckets are scanned
+    @type routingTable: Kademlia.routingTable.RoutingTable
+    @param nodeId: node id for which bucket needs to be find
+    @type nodeId: integer
+    @return: index of suitable bucket in the bucket List
+    """
+    for index, bucket in enumerate(routingTable.bucketList):
+        if bucket.minValue <= nodeId < bucket.maxValue:
+            return index
+    return -1
+
+def benchmarkBucketIndex(checkpoints=(1, 10, 40, 80, HASH_SIZE), lookups=10000):
+    """
+    grows a routing table up to the HASH_SIZE bucket limit and times
+    bucketIndexForInt at each of the requested bucket counts
+    @param checkpoints: bucket counts at which the lookup cost is measured
+    @type checkpoints: tuple of integers, at most HASH_SIZE
+    @param lookups: number of lookups timed at every checkpoint
+    @type lookups: integer
+    @return: list of (buckets, indexed seconds per lookup, linear seconds per lookup)
+    """
+    routingTable = RoutingTable(Node(0))
+    ids = [random.randrange(2**HASH_SIZE) for i in range(lookups)]
+    results = []
+    processId = 1
+    for checkpoint in checkpoints:
+        while len(routingTable.bucketList) < checkpoint:
+            routingTable.addPeer(Node(processId))
+            processId += 1
+        indexed = timeit.timeit(lambda: [routingTable.bucketIndexForInt(i) for i in ids], number=1)
+        linear = timeit.timeit(lambda: [linearBucketIndex(routingTable, i) for i in ids], number=1)
+        results.append((len(routingTable.bucketList), indexed / lookups, linear / lookups))
+    return results
+
+def measureAllocations(factory, count):
+    """
+    measures the memory held and the blocks allocated by count objects
+    @param factory: function creating one object from its index
+    @type factory: function
+    @param count: number of objects to be created
+    @type count: integer
+    @return: tuple of bytes per object and allocated blocks per object
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [factory(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del objects
+    return size / count, blocks / count
+
+def benchmarkContactMemory(count=100000):
+    """
+    compares per contact memory and allocations of Node, Contact, and
+    Contact interned through a pool for a stream where every peer is
+    learned from several responses
+    @param count: number of contacts to be created
+    @type count: integer
+    @return: list of (name, bytes per contact, blocks per contact)
+    """
+    ids = newIDs(count // 4)
+    pool = ContactPool()
+    results = []
+    for name, factory in (("Node", lambda i: Node(i)),
+                          ("Contact", lambda i: Contact(ids[i % len(ids)], "10.0.0.1", 4000)),
+                          ("Contact pool", lambda i: pool.intern(ids[i % len(ids)], "10.0.0.1", 4000))):
+        size, blocks = measureAllocations(factory, count)
+        results.append((name, size, blocks))
+    return results
+
+def timePerCall(function, calls, repeat=3):
+    """
+    times calls of a function and returns the best of repeat runs
+    @param function: function of the call index
+    @type function: function
+    @param calls: number of calls per run
+    @type calls: integer
+    @param repeat: number of runs
+    @type repeat: integer
+    @return: seconds per call
+    """
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        for i in range(calls):
+            function(i)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / calls
+
+def buildTable(contacts):
+    """
+    builds a routing table of contacts, offering it contacts peers
+    @param contacts: number of known contacts
+    @type contacts: integer
+    @return: tuple of the routing table and the offered contacts
+    """
+    routingTable = RoutingTable(Contact(newIDs(1)[0], "127.0.0.1", 4000))
+    peers = [Contact(id, "10.0.0.1", 4000) for id in newIDs(contacts)]
+    for peer in peers:
+        routingTable.addPeer(peer)
+    return routingTable, peers
+
+def benchmarkSplit(splits):
+    """
+    times splitBucket on full buckets of fresh tables
+    @param splits: number of splits timed
+    @type splits: integer
+    @return: seconds per split
+    """
+    elapsed = 0.0
+    for i in range(splits):
+        routingTable = RoutingTable(Contact(newIDs(1)[0], "127.0.0.1", 4000))
+        bucket = routingTable.bucketList[0]
+        for id in newIDs(BUCKET_SIZE):
+            bucket.addPeer(Contact(id, "10.0.0.1", 4000))
+        start = time.perf_counter()
+        routingTable.splitBucket(bucket)
+        elapsed += time.perf_counter() - start
+    return elapsed / splits
+
+def benchmarkMix(routingTable, peers, shares, operations):
+    """
+    times a random mix of inserts of new contacts, touches of known
+    contacts and findNodes lookups on the routing table
+    @param routingTable: routing table the mix runs on
+    @type routingTable: Kademlia.routingTable.RoutingTable
+    @param peers: contacts the table was built from
+    @type peers: list of Kademlia.contact.Contact
+    @param shares: shares of insert, touch and lookup operations
+    @type shares: tuple of floats
+    @param operations: number of operations timed
+    @type operations: integer
+    @return: seconds per operation
+    """
+    fresh = [Contact(id, "10.0.0.2", 4000) for id in newIDs(operations)]
+    known = routingTable.allPeers() or peers
+    targets = [computeIntHash(id) for id in newIDs(operations)]
+    insert, touch, lookup = shares
+    mix = []
+    for i in range(operations):
+        draw = random.random()
+        if draw < insert:
+            mix.append((routingTable.addPeer, fresh[i]))
+        elif draw < insert + touch:
+            mix.append((routingTable.addPeer, random.choice(known)))
+        else:
+            mix.append((routingTable.findNodes, targets[i]))
+    start = time.perf_counter()
+    for operation, argument in mix:
+        operation(argument)
+    return (time.perf_counter() - start) / operations
+
+def runSuite(sizes=SIZES, calls=2000):
+    """
+    runs the hot path benchmarks at every table size
+    @param sizes: numbers of known contacts offered to the tables
+    @type sizes: tuple of integers
+    @param calls: number of calls timed per operation
+    @type calls: integer
+    @return: dictionary with the environment and seconds per call of every benchmark
+    """
+    results = {}
+    ids = newIDs(calls + 1)
+    ints = [computeIntHash(id) for id in ids]
+    results['hash.distance'] = timePerCall(lambda i: distance(ids[i], ids[i + 1]), calls)
+    results['hash.computeIntHash'] = timePerCall(lambda i: computeIntHash(ids[i]), calls)
+    results['RoutingTable.splitBucket'] = benchmarkSplit(calls // 10 or 1)
+    for size in sizes:
+        start = time.perf_counter()
+        routingTable, peers = buildTable(size)
+        results['RoutingTable.addPeer@%d' % size] = (time.perf_counter() - start) / size
+        start = time.perf_counter()
+        RoutingTable(routingTable.node).bulkLoad(peers)
+        results['RoutingTable.bulkLoad@%d' % size] = (time.perf_counter() - start) / size
+        known = routingTable.allPeers()
+        bucket = max(routingTable.bucketList, key=len)
+        members = bucket.peerList
+        results['RoutingTable.findNodes@%d' % size] = timePerCall(lambda i: routingTable.findNodes(ints[i]), calls)
+        results['RoutingTable.randomPeer@%d' % size] = timePerCall(lambda i: routingTable.randomPeer(), calls)
+        results['Bucket.addPeer@%d' % size] = timePerCall(lambda i: bucket.addPeer(members[i % len(members)]), calls)
+        results['Bucket.getPeer@%d' % size] = timePerCall(lambda i: bucket.getPeer(members[i % len(members)].nodeId), calls)
+        for name, shares in sorted(MIXES.items()):
+            results['mix.%s@%d' % (name, size)] = benchmarkMix(routingTable, known, shares, calls)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'created': time.time(),
+        'results': results,
+    }
+
+class LockedRoutingTable:
+    """
+    reference routing table guarded by one lock for readers and writers
+    alike, kept for comparison with the copy-on-write table
+    """
+    def __init__(self, node):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param node: node owning the routing table
+        @type node: Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        self.table = RoutingTable(node)
+        self.lock = threading.Lock()
+
+    def addPeer(self, peer):
+        """
+        adds a peer to the routing table while holding the lock
+        @param peer: peer to be added
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        with self.lock:
+            self.table.addPeer(peer)
+
+    def findNodes(self, value):
+        """
+        returns the peers closest to the value while holding the lock
+        @param value: node id for which nearest peers to find
+        @type value: integer
+        @return: list of peers
+        """
+        with self.lock:
+            return self.table.findNodes(value)
+
+def benchmarkConcurrentReads(threads=(1, 2, 4, 8), duration=1.0, contacts=5000, writeInterval=0.0005):
+    """
+    measures findNodes throughput of reader threads while a writer thread
+    adds a steady stream of new contacts, for the copy-on-write table and
+    for a table behind a single lock
+    @param threads: numbers of reader threads
+    @type threads: tuple of integers
+    @param duration: seconds every measurement runs
+    @type duration: float
+    @param contacts: number of contacts offered before measuring
+    @type contacts: integer
+    @param writeInterval: seconds between two writes
+    @type writeInterval: float
+    @return: list of (name, reader threads, reads per second, writes per second)
+    """
+    results = []
+    for name, factory in (("copy-on-write", ConcurrentRoutingTable), ("locked", LockedRoutingTable)):
+        for readers in threads:
+            table = factory(Contact(newIDs(1)[0], "127.0.0.1", 4000))
+            for id in newIDs(contacts):
+                table.addPeer(Contact(id, "10.0.0.1", 4000))
+            targets = [computeIntHash(id) for id in newIDs(1024)]
+            stop = threading.Event()
+            reads = [0] * readers
+            writes = [0]
+            def read(slot):
+                count = 0
+                while not stop.is_set():
+                    table.findNodes(targets[count & 1023])
+                    count += 1
+                reads[slot] = count
+            fresh = newIDs(int(duration / writeInterval) + 1)
+            def write():
+                for id in fresh:
+                    if stop.is_set():
+                        return
+                    table.addPeer(Contact(id, "10.0.0.2", 4000))
+                    writes[0] += 1
+                    time.sleep(writeInterval)
+            workers = [threading.Thread(target=read, args=(slot,)) for slot in range(readers)]
+            workers.append(threading.Thread(target=write))
+            for worker in workers:
+                worker.start()
+            time.sleep(duration)
+            stop.set()
+            for worker in workers:
+                worker.join()
+            results.append((name, readers, sum(reads) / duration, writes[0] / duration))
+    return results
+
+def lookupHops(tables, source, target, count=K):
+    """
+    runs an iterative lookup on a static network in lock step rounds,
+    every round asking all unasked peers of the count closest known
+    @param tables: routing table of every node by node id
+    @type tables: dictionary
+    @param source: node id of the node looking up
+    @type source: integer
+    @param target: node id looked up
+    @type target: integer
+    @param count: number of closest peers kept
+    @type count: integer, default to K
+    @return: tuple of the referral depth and the node id of the closest peer found
+    """
+    shortlist = tables[source].findNodes(target, count)
+    depth = dict((peer.nodeId, 1) for peer in shortlist)
+    asked = set()
+    while True:
+        batch = [peer for peer in shortlist if peer.nodeId not in asked]
+        if not batch:
+            break
+        learned = []
+        for peer in batch:
+            asked.add(peer.nodeId)
+            for other in tables[peer.nodeId].findNodes(target, count):
+                if other.nodeId not in depth:
+                    depth[other.nodeId] = depth[peer.nodeId] + 1
+                    learned.append(other)
+        shortlist = sorted(shortlist + learned, key=lambda peer: peer.nodeId ^ target)[:count]
+    if not shortlist:
+        return 0, None
+    return depth[shortlist[0].nodeId], shortlist[0].nodeId
+
+def benchmarkDigitBits(size=2000, layouts=(None, 1, 2, 3, 4), offered=300, lookups=200, measured=50, seed=1):
+    """
+    compares the median split layout with the accelerated layouts of
+    b-bit digits on a static network, every node being offered the same
+    random sample of contacts and its closest neighbours in every layout
+    @param size: number of nodes
+    @type size: integer
+    @param layouts: digitBits of every layout, None for median splits
+    @type layouts: tuple
+    @param offered: random contacts offered to every node
+    @type offered: integer
+    @param lookups: number of lookups per layout
+    @type lookups: integer
+    @param measured: number of tables whose memory is measured
+    @type measured: integer
+    @param seed: seed of the random choices
+    @type seed: integer
+    @return: list of (digitBits, mean hops, success rate, peers per table, buckets per table, bytes per table)
+    """
+    rng = random.Random(seed)
+    contacts = sorted((Contact(id, "10.0.0.1", 4000) for id in newIDs(size)), key=lambda contact: contact.nodeId)
+    ids = [contact.nodeId for contact in contacts]
+    offers = [rng.sample(contacts, min(offered, size)) + contacts[max(0, i - K):i + K + 1] for i in range(size)]
+    queries = [(rng.choice(ids), rng.getrandbits(HASH_SIZE)) for i in range(lookups)]
+    results = []
+    for digitBits in layouts:
+        def build(index):
+            routingTable = RoutingTable(contacts[index], digitBits)
+            for peer in offers[index]:
+                routingTable.addPeer(peer)
+            return routingTable
+        tables = dict((contact.nodeId, build(i)) for i, contact in enumerate(contacts))
+        memory, blocks = measureAllocations(build, min(measured, size))
+        hops = 0
+        found = 0
+        for source, target in queries:
+            depth, closest = lookupHops(tables, source, target)
+            expected = min((nodeId for nodeId in ids if nodeId != source), key=lambda nodeId: nodeId ^ target)
+            hops += depth
+            found += closest == expected
+        peers = sum(len(table.allPeers()) for table in tables.values()) / len(tables)
+        buckets = sum(len(table.bucketList) for table in tables.values()) / len(tables)
+        results.append((digitBits, hops / lookups, found / lookups, peers, buckets, memory))
+    return results
+
+def compareResults(baseline, current, tolerance=0.1):
+    """
+    finds the benchmarks that became slower than the baseline by more than
+    the tolerance, and those of the baseline missing from the current run,
+    which are reported with None seconds and an infinite ratio
+    @param baseline: saved suite output
+    @type baseline: dictionary
+    @param current: new suite output
+    @type current: dictionary
+    @param tolerance: allowed relative slowdown
+    @type tolerance: float, default to 0.1
+    @return: list of (name, baseline seconds, current seconds, ratio), slowest first
+    """
+    regressions = []
+    for name, seconds in current['results'].items():
+        base = baseline['results'].get(name)
+        if base and seconds > base * (1 + tolerance):
+            regressions.append((name, base, seconds, seconds / base))
+    for name, base in baseline['results'].items():
+        if name not in current['results']:
+            regressions.append((name, base, None, float('inf')))
+    regressions.sort(key=lambda regression: -regression[3])
+    return regressions
+
+def printResults(results):
+    """
+    prints the bucket lookup benchmark results
+    @param results: output of benchmarkBucketIndex
+    @type results: list of tuples
+    """
+    print("Buckets  Indexed (us)  Linear (us)")
+    for buckets, indexed, linear in results:
+        print("%7d  %12.3f  %11.3f" % (buckets, indexed * 1e6, linear * 1e6))
+
+### Test Scenarios ###
+import unittest
+
+class TestBenchmark(unittest.TestCase):
+    """
+    It represents the test class to test the benchmark module
+    for consistent results with the reference implementation
+    """
+    def test_bucketIndex(self):
+        """
+        tests that indexed lookups agree with the linear scan at every table size
+        """
+        routingTable = RoutingTable(Node(0))
+        for i in range(1, 400):
+            routingTable.addPeer(Node(i))
+            nodeId = random.randrange(2**HASH_SIZE)
+            self.assertEqual(routingTable.bucketIndexForInt(nodeId), linearBucketIndex(routingTable, nodeId))
+        self.assertEqual(routingTable.bucketIndexForInt(2**HASH_SIZE), -1)
+
+    def test_benchmark(self):
+        """
+        tests that the benchmark reaches the requested bucket counts
+        """
+        results = benchmarkBucketIndex((1, 10), 100)
+        self.assertEqual([buckets for buckets, indexed, linear in results], [1, 10])
+
+    def test_contactMemory(self):
+        """
+        tests that slotted and interned contacts take less memory than nodes
+        """
+        node, contact, pooled = benchmarkContactMemory(2000)
+        self.assertTrue(contact[1] < node[1])
+        self.assertTrue(pooled[1] < contact[1])
+
+    def test_suite(self):
+        """
+        tests that the suite covers every hot path in JSON serializable form
+        """
+        output = json.loads(json.dumps(runSuite((100, 1000), 50)))
+        for name in ('hash.distance', 'hash.computeIntHash', 'RoutingTable.splitBucket',
+                     'RoutingTable.addPeer@1000', 'RoutingTable.bulkLoad@1000', 'RoutingTable.findNodes@100', 'RoutingTable.randomPeer@1000',
+                     'Bucket.addPeer@100', 'Bucket.getPeer@1000', 'mix.churn@1000', 'mix.lookupHeavy@100'):
+            self.assertTrue(output['results'][name] > 0)
+
+    def test_concurrentReads(self):
+        """
+        tests that readers and the writer both make progress on both tables
+        """
+        results = benchmarkConcurrentReads((1, 2), 0.05, 200)
+        self.assertEqual([(name, readers) for name, readers, reads, writes in results],
+                         [("copy-on-write", 1), ("copy-on-write", 2), ("locked", 1), ("locked", 2)])
+        for name, readers, reads, writes in results:
+            self.assertTrue(reads > 0 and writes > 0)
+
+    def test_digitBits(self):
+        """
+        tests that lookups over every layout find the closest node and digit tables stay bounded
+        """
+        results = benchmarkDigitBits(300, (None, 1, 3), 60, 30, 5)
+        self.assertEqual([digitBits for digitBits, hops, success, peers, buckets, size in results], [None, 1, 3])
+        for digitBits, hops, success, peers, buckets, size in results:
+            self.assertTrue(success >= 0.9)
+            self.assertTrue(hops >= 1 and size > 0)
+        # the median layout keeps every offered contact, one bit digits the fewest
+        self.assertTrue(results[1][3] < results[2][3] <= results[0][3])
+
+    def test_compare(self):
+        """
+        tests that only slowdowns beyond the tolerance and missing benchmarks are flagged
+        """
+        baseline = {'results': {'a': 1.0, 'b': 1.0, 'c': 1.0}}
+        current = {'results': {'a': 1.05, 'b': 1.5, 'c': 0.5, 'd': 9.0}}
+        self.assertEqual(compareResults(baseline, current), [('b', 1.0, 1.5, 1.5)])
+        self.assertEqual(compareResults(baseline, current, 0.01)[1][0], 'a')
+        del current['results']['c']
+        self.assertEqual(compareResults(baseline, current), [('c', 1.0, None, float('inf')), ('b', 1.0, 1.5, 1.5)])
+
+def main(arguments):
+    """
+    runs the benchmark suite and writes its JSON output, compares two
+    outputs, or without a command prints the bucket index and contact
+    memory benchmarks
+    @param arguments: command line arguments
+    @type arguments: list of strings
+    @return: exit status, 1 if a regression was found
+    """
+    parser = argparse.ArgumentParser(description="Kademlia hot path benchmarks")
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('run', help="run the suite and write JSON results")
+    run.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    run.add_argument('--calls', type=int, default=2000)
+    run.add_argument('--output', default='-')
+    compare = commands.add_parser('compare', help="flag regressions against a baseline")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--tolerance', type=float, default=0.1)
+    options = parser.parse_args(arguments)
+    if options.command == 'run':
+        output = json.dumps(runSuite(tuple(options.sizes), options.calls), indent=2, sort_keys=True)
+        if options.output == '-':
+            print(output)
+        else:
+            with open(options.output, 'w') as results:
+                results.write(output)
+        return 0
+    if options.command == 'compare':
+        with open(options.baseline) as baseline, open(options.current) as current:
+            regressions = compareResults(json.load(baseline), json.load(current), options.tolerance)
+        for name, base, seconds, ratio in regressions:
+            if seconds is None:
+                print("REGRESSION %s: %.3f us -> missing from the current run" % (name, base * 1e6))
+                continue
+            print("REGRESSION %s: %.3f us -> %.3f us (x%.2f)" % (name, base * 1e6, seconds * 1e6, ratio))
+        return 1 if regressions else 0
+    printResults(benchmarkBucketIndex())
+    print("Contact  Bytes  Blocks")
+    for name, size, blocks in benchmarkContactMemory():
+        print("%s  %.1f  %.2f" % (name, size, blocks))
+    print("Table  Readers  Reads/s  Writes/s")
+    for name, readers, reads, writes in benchmarkConcurrentReads():
+        print("%s  %d  %.0f  %.0f" % (name, readers, reads, writes))
+    print("Digits  Hops  Found  Peers  Buckets  Bytes")
+    for digitBits, hops, success, peers, buckets, size in benchmarkDigitBits():
+        print("%6s  %.2f  %.3f  %.1f  %.1f  %.0f" % (digitBits or '-', hops, success, peers, buckets, size))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -7,13 +7,15 @@
 
 # Import the required modules
 from node import Node
-from constants import BUCKET_SIZE,HASH_SIZE
+from constants import BUCKET_SIZE,HASH_SIZE,REPLACEMENT_CACHE_SIZE
 from hash import computeIntHash
+from collections import OrderedDict
 
 class Bucket:
     """
     It represents the bucket, which contains peers information,
-    and is part of the Routing table.
+    and is part of the Routing table. Peers are kept in an insertion
+    ordered map keyed by node id, least recently seen first
     """
     def __init__(self, minValue, maxValue):
         """ 
@@ -24,24 +26,51 @@ class Bucket:
         @param maxValue: the end value for the range of the bucket
         @type maxValue: integer which varies from 0 to 2**HASH_SIZE    
         """  
-        self.peerList = list()
+        self.peers = OrderedDict()
+        self.replacementCache = OrderedDict()
         self.minValue = minValue
         self.maxValue = maxValue
+        # time a peer of the bucket was last added or seen
+        self.lastAccessed = 0.0
+        # bumped whenever peers join or leave the bucket or its range changes
+        self.generation = 0
         
     def __len__(self):
         """ 
         returns the length of the peers list in the bucket  
         """  
-        return len(self.peerList)
+        return len(self.peers)
+    
+    def __contains__(self, peer):
+        """ 
+        checks whether the peer is in the bucket's peers
+        @param peer: peer object or its node id
+        @type peer: Kademlia.node.Node or integer
+        """  
+        return getattr(peer, 'nodeId', peer) in self.peers
+    
+    @property
+    def peerList(self):
+        """ 
+        returns the list of peers in the bucket, least recently seen first  
+        """  
+        return list(self.peers.values())
+    
+    def isFull(self):
+        """ 
+        checks whether the bucket has reached BUCKET_SIZE peers
+        @return: boolean value true or false
+        """  
+        return len(self.peers) >= BUCKET_SIZE
     
     def hashInRange(self, hashValue):
         """ 
         checks whether the provided hashValue is within range of the bucket
         @param hashValue: 160-bit identifier computed through sha
-        @type hashValue: string or integer representation
+        @type hashValue: byte string, string or integer representation
         @return: boolean value true or false
         """  
-        if isinstance(hashValue, str):
+        if not isinstance(hashValue, int):
             hashValue = computeIntHash(hashValue)
         return self.minValue <= hashValue < self.maxValue
        
@@ -49,32 +78,75 @@ class Bucket:
         """
         returns the peer object for the corresponding peer id
         @param peerId: 160-bit identifier computed through sha
-        @type peerId: string or integer representation
-        @return: Node object from the bucket's peerList
+        @type peerId: Kademlia.node.Node or integer representation
+        @return: Node object from the bucket's peers
+        @raise ValueError: if peer is not in the bucket
         """
-        index = self.peerList.index(peerId)
-        return self.peerList[index]
+        try:
+            return self.peers[getattr(peerId, 'nodeId', peerId)]
+        except KeyError:
+            raise ValueError("Peer not in bucket")
     
     def addPeer(self, peer):
         """
         add the peer object to the bucket. 
         Different Scenarios:
-            - If already in the list, move to the end
+            - If already in the list, move to the end, taking the new
+              peer object in its place if it is another one
             - If not in the list, and list has space, add it to the end
-        @param peer: peer to be added to the bucket's peerList
+            - If not in the list, and list is full, leave the bucket as is
+        @param peer: peer to be added to the bucket's peers
         @type peer: Kademlia.node.Node
-        @raise Exception: if bucket is full
+        @return: boolean value, false if bucket is full
         """
+        peers = self.peers
+        key = peer.nodeId
         # Case 1
-        if peer in self.peerList:
-            self.peerList.remove(peer)
-            self.peerList.append(peer)
+        if key in peers:
+            if peers[key] is not peer:
+                # a new contact of a known peer, results holding the old one are stale
+                peers[key] = peer
+                self.generation += 1
+            peers.move_to_end(key)
         # Case 2
-        elif len(self.peerList) < BUCKET_SIZE:
-            self.peerList.append(peer)
+        elif len(peers) < BUCKET_SIZE:
+            peers[key] = peer
+            self.replacementCache.pop(key, None)
+            self.generation += 1
         # Case 3
         else:
-            raise Exception("No space in bucket to insert new peer")
+            return False
+        return True
+    
+    def addReplacement(self, peer):
+        """
+        remember a peer seen while the bucket was full, as a candidate
+        to take the place of a dead peer. Only the REPLACEMENT_CACHE_SIZE
+        most recently seen candidates are kept
+        @param peer: peer to be cached
+        @type peer: Kademlia.node.Node
+        """
+        key = peer.nodeId
+        if key in self.peers:
+            return
+        cache = self.replacementCache
+        cache[key] = peer
+        cache.move_to_end(key)
+        if len(cache) > REPLACEMENT_CACHE_SIZE:
+            cache.popitem(last=False)
+    
+    def promoteReplacement(self):
+        """
+        move the most recently seen replacement candidate into the bucket,
+        if the bucket has space
+        @return: the promoted peer, None if there is no candidate or space
+        """
+        if not self.replacementCache or len(self.peers) >= BUCKET_SIZE:
+            return None
+        key, peer = self.replacementCache.popitem()
+        self.peers[key] = peer
+        self.generation += 1
+        return peer
     
     def getPeers(self, count=-1,smallest=True):
         """
@@ -112,13 +184,33 @@ class Bucket:
         
         return listPeers
 
+    def transferPeers(self, bucket):
+        """
+        move the peers and replacement candidates that fall in the range of
+        the provided bucket into it, keeping their least recently seen order
+        @param bucket: bucket taking over part of this bucket's range
+        @type bucket: Kademlia.bucket.Bucket
+        """
+        for source, target in ((self.peers, bucket.peers), (self.replacementCache, bucket.replacementCache)):
+            for key in [key for key in source if bucket.minValue <= key < bucket.maxValue]:
+                target[key] = source.pop(key)
+        self.generation += 1
+        bucket.generation += 1
+
     def removePeer(self, peer):
         """
-        remove the node from the bucket's peerList 
+        remove the node from the bucket's peers and replacement candidates
         @param peer: node object to be removed from the bucket
         @type peer: Kademlia.node.Node
+        @raise ValueError: if peer is not in the bucket
         """
-        self.peerList.remove(peer)
+        key = getattr(peer, 'nodeId', peer)
+        self.replacementCache.pop(key, None)
+        try:
+            del self.peers[key]
+        except KeyError:
+            raise ValueError("Peer not in bucket")
+        self.generation += 1
     
     def printBucket(self):
         """
@@ -126,7 +218,7 @@ class Bucket:
         along with the range information of the bucket 
         """
         print("Bucket: MinValue: "+str(self.minValue)+" MaxValue: "+str(self.maxValue))
-        for peer in self.peerList:
+        for peer in self.peers.values():
             print(peer.processId)
         
 ### Test Scenarios ###
@@ -164,4 +256,41 @@ class TestBucket(unittest.TestCase):
         for peer in nodes:
             print(peer.processId)
         print("bucket")
-        bucket.printBucket()
\ No newline at end of file
+        bucket.printBucket()
+
+    def test_lru(self):
+        """
+        tests bucket module for least recently seen ordering and full buckets
+        """
+        bucket = Bucket(0, 2**HASH_SIZE)
+        nodes = [Node(i) for i in range(BUCKET_SIZE)]
+        for node in nodes:
+            self.assertTrue(bucket.addPeer(node))
+        self.assertTrue(bucket.addPeer(nodes[0]))
+        self.assertEqual(bucket.peerList, nodes[1:] + nodes[:1])
+        self.assertTrue(bucket.isFull())
+        extra = Node(BUCKET_SIZE)
+        self.assertFalse(bucket.addPeer(extra))
+        self.assertFalse(extra in bucket)
+        self.assertTrue(nodes[3] in bucket)
+        self.assertEqual(bucket.getPeer(nodes[3].nodeId), nodes[3])
+        bucket.removePeer(nodes[3])
+        self.assertRaises(ValueError, bucket.getPeer, nodes[3])
+        self.assertRaises(ValueError, bucket.removePeer, nodes[3])
+
+    def test_replacement(self):
+        """
+        tests bucket module for bounded replacement candidates and their promotion
+        """
+        bucket = Bucket(0, 2**HASH_SIZE)
+        for i in range(BUCKET_SIZE):
+            bucket.addPeer(Node(i))
+        candidates = [Node(i) for i in range(REPLACEMENT_CACHE_SIZE + 3)]
+        for candidate in candidates:
+            bucket.addReplacement(candidate)
+        self.assertEqual(len(bucket.replacementCache), REPLACEMENT_CACHE_SIZE)
+        self.assertEqual(bucket.promoteReplacement(), None)
+        bucket.removePeer(bucket.peerList[0])
+        self.assertEqual(bucket.promoteReplacement(), candidates[-1])
+        self.assertEqual(bucket.peerList[-1], candidates[-1])
+        self.assertEqual(len(bucket.replacementCache), REPLACEMENT_CACHE_SIZE - 1)
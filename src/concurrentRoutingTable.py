@@ -0,0 +1,264 @@
+"""
+- Module: It contains the concurrent routing table with copy-on-write bucket snapshots for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import K
+from routingTable import RoutingTable, closestInBuckets
+from bisect import bisect_right
+import random
+import threading
+
+class BucketView:
+    """
+    It represents an immutable snapshot of one bucket. Its peers are a
+    private copy that is never changed once the view is published
+    """
+    __slots__ = ('minValue', 'maxValue', 'peers', 'generation')
+
+    def __init__(self, bucket):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param bucket: bucket to be copied
+        @type bucket: Kademlia.bucket.Bucket
+        """
+        self.minValue = bucket.minValue
+        self.maxValue = bucket.maxValue
+        self.peers = dict(bucket.peers)
+        self.generation = bucket.generation
+
+    def __len__(self):
+        """
+        returns the number of peers in the bucket
+        """
+        return len(self.peers)
+
+    @property
+    def peerList(self):
+        """
+        returns the list of peers in the bucket
+        """
+        return list(self.peers.values())
+
+class TableView:
+    """
+    It represents an immutable snapshot of the whole routing table, the
+    bucket views in order of range and their lower bounds
+    """
+    __slots__ = ('buckets', 'boundaries')
+
+    def __init__(self, buckets, boundaries):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param buckets: bucket views in increasing order of range
+        @type buckets: tuple of Kademlia.concurrentRoutingTable.BucketView
+        @param boundaries: lower bound of every bucket
+        @type boundaries: tuple of integers
+        """
+        self.buckets = buckets
+        self.boundaries = boundaries
+
+class ConcurrentRoutingTable:
+    """
+    It represents a routing table shared by threads. Writers serialize on
+    a lock, apply the change to a private routing table and then publish
+    a new table view, copying only the buckets whose generation changed.
+    Publishing is a single attribute assignment, so readers take the
+    current view without any lock and always see a consistent table,
+    never a bucket half way through a split
+    """
+    def __init__(self, node, digitBits=None):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param node: the node routing table belongs to
+        @type node: Kademlia.node.Node or Kademlia.contact.Contact
+        @param digitBits: bits per digit of the table's layout, see RoutingTable
+        @type digitBits: integer, default to None
+        """
+        self.node = node
+        self.table = RoutingTable(node, digitBits)
+        self.lock = threading.Lock()
+        self.view = TableView((), ())
+        self.publish()
+
+    intValue = RoutingTable.intValue
+    printBucketList = RoutingTable.printBucketList
+
+    @property
+    def bucketList(self):
+        """
+        returns the bucket views of the current snapshot
+        """
+        return list(self.view.buckets)
+
+    def publish(self):
+        """
+        publishes a view of the private table, reusing the views of the
+        buckets that did not change. It is called with the lock held
+        """
+        previous = dict((view.minValue, view) for view in self.view.buckets)
+        views = []
+        for bucket in self.table.bucketList:
+            view = previous.get(bucket.minValue)
+            if view is None or view.generation != bucket.generation or view.maxValue != bucket.maxValue:
+                view = BucketView(bucket)
+            views.append(view)
+        self.view = TableView(tuple(views), tuple(self.table.bucketBoundaries))
+
+    def addPeer(self, peer):
+        """
+        adds the peer and publishes the change, a peer that was only seen
+        again does not change any view
+        @param peer: peer to be added
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        with self.lock:
+            table = self.table
+            index = table.bucketIndexForInt(peer.nodeId)
+            if index < 0:
+                table.addPeer(peer)
+                return
+            buckets = len(table.bucketList)
+            generation = table.bucketList[index].generation
+            table.addPeer(peer)
+            if len(table.bucketList) != buckets or table.bucketList[index].generation != generation:
+                self.publish()
+
+    def removePeer(self, peer):
+        """
+        removes the peer and publishes the change
+        @param peer: peer to be removed
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        with self.lock:
+            self.table.removePeer(peer)
+            self.publish()
+
+    def replaceDeadNode(self, dead, new=None):
+        """
+        replaces the dead peer, see RoutingTable.replaceDeadNode, and publishes the change
+        @param dead: peer to be removed
+        @type dead: Kademlia.node.Node or Kademlia.contact.Contact
+        @param new: peer to be added
+        @type new: Kademlia.node.Node or Kademlia.contact.Contact, default to None
+        """
+        with self.lock:
+            self.table.replaceDeadNode(dead, new)
+            self.publish()
+
+    def findNodes(self, value, count=K):
+        """
+        returns the count peers of the current snapshot closest to the
+        provided node id, without taking any lock
+            @param value: node id for which nearest nodes to find
+            @type value: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation
+            @param count: number of nearest nodes to be returned
+            @type count: integer, default to K
+            @return: list of nearest peers, closest first
+        """
+        view = self.view
+        num = self.intValue(value)
+        buckets = view.buckets
+        index = bisect_right(view.boundaries, num) - 1
+        if index < 0 or num >= buckets[index].maxValue:
+            index = -1
+        return closestInBuckets(buckets, index, num, count)
+
+    def findNodesMany(self, targets, count=K):
+        """
+        returns the count closest peers for every target, all from one snapshot
+        """
+        view = self.view
+        results = []
+        for value in targets:
+            num = self.intValue(value)
+            index = bisect_right(view.boundaries, num) - 1
+            if index < 0 or num >= view.buckets[index].maxValue:
+                index = -1
+            results.append(closestInBuckets(view.buckets, index, num, count))
+        return results
+
+    def allPeers(self):
+        """
+        returns the list of all peers of the current snapshot
+        """
+        return [peer for bucket in self.view.buckets for peer in bucket.peers.values()]
+
+    def randomPeer(self):
+        """
+        returns randomly any peer of the current snapshot
+        """
+        return random.choice(self.allPeers())
+
+### Test Scenarios ###
+import unittest
+from node import Node
+
+class TestConcurrentRoutingTable(unittest.TestCase):
+    """
+    It represents the test class to test the concurrentRoutingTable module
+    for consistent snapshots under concurrent writes
+    """
+    def test_equal(self):
+        """
+        tests that the snapshot answers as the plain routing table does
+        """
+        concurrent = ConcurrentRoutingTable(Node(0))
+        plain = RoutingTable(concurrent.node)
+        peers = [Node(i) for i in range(1, 300)]
+        for peer in peers:
+            concurrent.addPeer(peer)
+            plain.addPeer(peer)
+        for peer in peers[::5]:
+            concurrent.removePeer(peer)
+            plain.removePeer(peer)
+        concurrent.replaceDeadNode(peers[1])
+        plain.replaceDeadNode(peers[1])
+        for i in range(30):
+            target = Node(1000 + i)
+            self.assertEqual(concurrent.findNodes(target, 20), plain.findNodes(target, 20))
+        self.assertEqual(sorted(concurrent.allPeers()), sorted(plain.allPeers()))
+        self.assertEqual([len(bucket) for bucket in concurrent.bucketList], [len(bucket) for bucket in plain.bucketList])
+
+    def test_readers(self):
+        """
+        tests that readers never see missing or duplicated peers while a writer splits buckets
+        """
+        concurrent = ConcurrentRoutingTable(Node(0))
+        for i in range(1, 20):
+            concurrent.addPeer(Node(i))
+        errors = []
+        done = threading.Event()
+        def read():
+            while not done.is_set():
+                view = concurrent.view
+                peers = [peer for bucket in view.buckets for peer in bucket.peers.values()]
+                if len(peers) != len(set(peers)):
+                    errors.append("duplicated peers")
+                for bucket in view.buckets:
+                    if any(not bucket.minValue <= peer.nodeId < bucket.maxValue for peer in bucket.peers.values()):
+                        errors.append("peer outside its bucket")
+                result = concurrent.findNodes(Node(-1), 10)
+                if len(result) != 10 or len(set(result)) != len(result):
+                    errors.append("incomplete result")
+        readers = [threading.Thread(target=read) for i in range(4)]
+        for reader in readers:
+            reader.start()
+        peers = [Node(i) for i in range(20, 2000)]
+        for i, peer in enumerate(peers):
+            concurrent.addPeer(peer)
+            if i % 3 == 0:
+                concurrent.removePeer(peers[i // 2])
+        done.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+
+if __name__ == '__main__':
+    unittest.main()
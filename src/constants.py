@@ -20,6 +20,21 @@ BUCKET_SIZE = 15
 Size of the bucket - maximum peers whose information is stored in the bucket
 """
 
+REPLACEMENT_CACHE_SIZE = 15
+"""
+Maximum replacement candidates remembered by a full bucket
+"""
+
+VECTOR_THRESHOLD = 256
+"""
+Number of peers from which distance ranking switches to NumPy, when installed
+"""
+
+VECTOR_WINDOW = 20
+"""
+Number of requested nodes from which the routing table ranks all its peers with NumPy
+"""
+
 TIMEOUT = 1
 """
 Wait time for response from other process
@@ -38,4 +53,93 @@ Interval at which routing tables are refreshed
 KVUPDATE = 40
 """
 Interval at which key-value pairs are republished
-"""
\ No newline at end of file
+"""
+EXPIRE = 86400
+"""
+Time after which a key-value pair expires unless its publisher republishes it
+"""
+
+STORE_CAPACITY = 64 * 2**20
+"""
+Maximum bytes of keys and values held by the storage of a node
+"""
+
+SNAPSHOT_INTERVAL = 300
+"""
+Interval at which a node saves a snapshot of its routing table
+"""
+
+WHEEL_RESOLUTION = 0.25
+"""
+Seconds per tick of the maintenance timer wheel
+"""
+
+JITTER = 0.1
+"""
+Largest random delay added to maintenance events, as a fraction of their interval
+"""
+
+FIND_CACHE_SIZE = 1024
+"""
+Maximum findNodes results kept by the routing table cache, when enabled
+"""
+
+RTO_MIN = 0.2
+"""
+Smallest per peer timeout derived from round trip time estimates
+"""
+
+RTO_MAX = 4 * TIMEOUT
+"""
+Largest per peer timeout, reached by backing off after missed timeouts
+"""
+
+FAILURE_LIMIT = 3
+"""
+Consecutive missed timeouts after which a peer is replaced as dead
+"""
+
+PEER_STATS_SIZE = 4096
+"""
+Maximum number of peers whose round trip time estimates are kept
+"""
+
+HOT_READS = 32
+"""
+Reads of a stored key after which it is replicated beyond its closest nodes
+"""
+
+HOT_REPLICAS = K
+"""
+Number of peers further out than the K closest a hot key is replicated to
+"""
+
+LOOKUP_LIMIT = 8
+"""
+Maximum number of iterative lookups a node runs at once
+"""
+
+LOOKUP_QUEUE = 256
+"""
+Maximum number of lookups waiting for one of the LOOKUP_LIMIT slots before callers are turned away
+"""
+
+LOOKUP_CACHE_TTL = 5
+"""
+Seconds the result of a lookup is shared with later callers asking for the same target
+"""
+
+LOOKUP_CACHE_SIZE = 1024
+"""
+Maximum number of lookup results kept for sharing
+"""
+
+HOST_BATCH = 256
+"""
+Routing table updates a virtual node host queues before sending them to its workers
+"""
+
+HOST_FLUSH_INTERVAL = 0.5
+"""
+Seconds after which a virtual node host sends its queued routing table updates
+"""
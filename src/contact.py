@@ -0,0 +1,179 @@
+"""
+- Module: It contains the compact contact data structure and the contact pool used for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+import weakref
+
+class Contact:
+    """
+    It is the compact class for storing a peer's contact information.
+    The node id is held as its 20 raw bytes for the wire, and as the
+    integer the routing table works with, computed once as the contact
+    is created. The id of a contact is not to be changed
+    """
+    __slots__ = ('id', 'nodeId', 'address', 'port', 'lastSeen', '__weakref__')
+
+    def __init__(self, id, address, port, lastSeen=0.0):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param id: 160-bit identifier of the peer
+        @type id: 20 byte string
+        @param address: network address of the peer
+        @type address: string
+        @param port: network port of the peer
+        @type port: integer
+        @param lastSeen: time the peer was last heard from
+        @type lastSeen: float, default to 0.0
+        """
+        self.id = id
+        self.nodeId = int.from_bytes(id, 'big')
+        self.address = address
+        self.port = port
+        self.lastSeen = lastSeen
+
+    @property
+    def processId(self):
+        """
+        returns the network address and port, which identify the peer's process
+        """
+        return (self.address, self.port)
+
+    def __eq__(self, a):
+        """
+        overridden for comparison operations
+        """
+        if isinstance(a, Contact):
+            return self.id == a.id
+        return NotImplemented
+
+    def __ne__(self, a):
+        """
+        overridden for comparison operations
+        """
+        if isinstance(a, Contact):
+            return self.id != a.id
+        return NotImplemented
+
+    def __lt__(self, a):
+        """
+        overridden for comparison operations, big-endian ids of equal
+        length order the same way as their integer views
+        """
+        if isinstance(a, Contact):
+            return self.id < a.id
+        return NotImplemented
+
+    def __hash__(self):
+        """
+        overridden hash function to use set for Contact Objects
+        """
+        return hash(self.id)
+
+    def __repr__(self):
+        """
+        overridden repr function to print the address for the Contact Objects
+        """
+        return str([self.address, self.port])
+
+class ContactPool:
+    """
+    It interns contacts by node id, so a peer learned from many
+    responses is stored once. The pool only holds weak references,
+    contacts no longer used by any table or shortlist are released
+    """
+    def __init__(self):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        """
+        self.contacts = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        """
+        returns the number of live contacts in the pool
+        """
+        return len(self.contacts)
+
+    def intern(self, id, address, port, move=True):
+        """
+        returns the pooled contact for the node id, creating it if needed.
+        A known contact takes over the latest address and port, unless
+        the endpoint is only hearsay
+        @param id: 160-bit identifier of the peer
+        @type id: 20 byte string
+        @param address: network address of the peer
+        @type address: string
+        @param port: network port of the peer
+        @type port: integer
+        @param move: whether a known contact takes over the address and port
+        @type move: boolean, default to True
+        @return: the shared Contact object
+        """
+        contact = self.contacts.get(id)
+        if contact is None:
+            contact = Contact(id, address, port)
+            self.contacts[id] = contact
+        elif move and (contact.port != port or contact.address != address):
+            contact.address = address
+            contact.port = port
+        return contact
+
+### Test Scenarios ###
+import unittest
+from hash import newID
+from constants import K
+
+class TestContact(unittest.TestCase):
+    """
+    It represents the test class to test the contact module
+    for different functionalities
+    """
+    def testContact(self):
+        """
+        tests contact module for id views and comparison operations
+        """
+        id = newID()
+        contact = Contact(id, "127.0.0.1", 4000)
+        self.assertEqual(contact.nodeId, int.from_bytes(id, 'big'))
+        self.assertEqual(contact, Contact(id, "10.0.0.1", 4001))
+        self.assertEqual(len(set([contact, Contact(id, "10.0.0.1", 4001)])), 1)
+        other = Contact(newID(), "127.0.0.1", 4000)
+        self.assertEqual(contact < other, contact.nodeId < other.nodeId)
+        self.assertFalse(hasattr(contact, '__dict__'))
+
+    def testPool(self):
+        """
+        tests contact module for interning and releasing contacts
+        """
+        pool = ContactPool()
+        id = newID()
+        contact = pool.intern(id, "127.0.0.1", 4000)
+        self.assertTrue(pool.intern(id, "127.0.0.1", 4002) is contact)
+        self.assertEqual(contact.port, 4002)
+        self.assertEqual(len(pool), 1)
+        del contact
+        self.assertEqual(len(pool), 0)
+
+    def testRoutingTable(self):
+        """
+        tests contact module for use as routing table peers
+        """
+        from routingTable import RoutingTable
+        pool = ContactPool()
+        routingTable = RoutingTable(Contact(newID(), "127.0.0.1", 4000))
+        contacts = [pool.intern(newID(), "127.0.0.1", 5000 + i) for i in range(100)]
+        for contact in contacts:
+            routingTable.addPeer(contact)
+            routingTable.addPeer(pool.intern(contact.id, "127.0.0.1", contact.port))
+        target = contacts[0]
+        expected = sorted(contacts, key=lambda contact: contact.nodeId ^ target.nodeId)
+        self.assertEqual(routingTable.findNodes(target)[0], target)
+        self.assertEqual(routingTable.findNodes(target.id), expected[:K])
+
+if __name__ == '__main__':
+    unittest.main()
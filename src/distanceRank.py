@@ -0,0 +1,249 @@
+"""
+- Module: It contains the distance ranking backend used to select the closest peers for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import VECTOR_THRESHOLD
+import heapq
+
+# largest (targets, N) array of distances ranked at once by closestIndicesMany
+BATCH_ELEMENTS = 2 ** 22
+
+# NumPy is optional, without it every ranking runs in pure Python
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def idBytes(peer):
+    """
+    returns the 20 byte big-endian node id of a peer
+    @param peer: peer whose id is needed
+    @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+    @return: 20 byte string
+    """
+    id = getattr(peer, 'id', None)
+    if id is None:
+        id = peer.nodeId.to_bytes(20, 'big')
+    return id
+
+class PackedIds:
+    """
+    It holds the node ids of a list of peers as a packed (N, 5) array of
+    32-bit words. The top 64 bits of every id are also kept as a single
+    word, so the coarse distances to a target take one vectorized XOR, the
+    candidates are picked with a partial partition instead of a full sort,
+    and only those are compared on all 160 bits. It requires NumPy
+    """
+    def __init__(self, peers):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param peers: peers to be ranked
+        @type peers: list of Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        self.peers = list(peers)
+        try:
+            ids = [peer.id for peer in self.peers]
+        except AttributeError:
+            ids = [idBytes(peer) for peer in self.peers]
+        self.words = self.pack(ids)
+        self.high = (self.words[:, 0].astype(numpy.uint64) << numpy.uint64(32)) | self.words[:, 1]
+
+    def __len__(self):
+        """
+        returns the number of packed peers
+        """
+        return len(self.peers)
+
+    @staticmethod
+    def pack(ids):
+        """
+        packs 20 byte ids into a (N, 5) array of native 32-bit words
+        @param ids: ids to be packed
+        @type ids: list of 20 byte strings
+        @return: numpy array
+        """
+        return numpy.frombuffer(b''.join(ids), dtype='>u4').reshape(-1, 5).astype(numpy.uint32)
+
+    def closestIndices(self, target, count):
+        """
+        returns the indices of the count peers closest to the target,
+        closest first. Ties on the top 64 bits are settled on all 160 bits
+        @param target: node id for which nearest peers to find
+        @type target: integer
+        @param count: number of indices to be returned
+        @type count: integer
+        @return: numpy array of indices
+        """
+        if count <= 0 or not self.peers:
+            return numpy.arange(0)
+        keys = self.high ^ numpy.uint64(target >> 96)
+        if count < len(keys):
+            kth = numpy.partition(keys, count - 1)[count - 1]
+            candidates = numpy.nonzero(keys <= kth)[0]
+        else:
+            candidates = numpy.arange(len(keys))
+        xor = self.words[candidates] ^ self.pack([target.to_bytes(20, 'big')])
+        order = numpy.lexsort((xor[:, 4], xor[:, 3], xor[:, 2], xor[:, 1], xor[:, 0]))
+        return candidates[order[:count]]
+
+    def closest(self, target, count):
+        """
+        returns the count peers closest to the target, closest first
+        @param target: node id for which nearest peers to find
+        @type target: integer
+        @param count: number of peers to be returned
+        @type count: integer
+        @return: list of peers
+        """
+        peers = self.peers
+        return [peers[index] for index in self.closestIndices(target, count)]
+
+    def closestIndicesMany(self, targets, count):
+        """
+        returns the indices of the count peers closest to every target,
+        closest first, ranking a batch of targets at once. The coarse
+        distances of the batch are one broadcast XOR of a (targets, N)
+        array, the candidates of all targets one partition along its rows,
+        and their order one lexsort over all 160 bits. Batches are cut so
+        the array stays within BATCH_ELEMENTS, and the rare target with
+        ties on the top 64 bits at its cut off is ranked on its own
+        @param targets: node ids for which nearest peers to find
+        @type targets: list of integers
+        @param count: number of indices to be returned per target
+        @type count: integer
+        @return: numpy array of indices, one row per target
+        """
+        size = len(self.peers)
+        count = max(0, min(count, size))
+        results = numpy.empty((len(targets), count), dtype=numpy.intp)
+        if count == 0 or not len(targets):
+            return results
+        targetWords = self.pack([target.to_bytes(20, 'big') for target in targets])
+        targetHigh = (targetWords[:, 0].astype(numpy.uint64) << numpy.uint64(32)) | targetWords[:, 1]
+        step = max(1, BATCH_ELEMENTS // size)
+        for start in range(0, len(targets), step):
+            stop = min(start + step, len(targets))
+            keys = self.high[numpy.newaxis, :] ^ targetHigh[start:stop, numpy.newaxis]
+            if count < size:
+                candidates = numpy.argpartition(keys, count - 1, axis=1)[:, :count]
+                kth = numpy.take_along_axis(keys, candidates, 1).max(axis=1)
+                ties = numpy.nonzero(numpy.count_nonzero(keys <= kth[:, numpy.newaxis], axis=1) > count)[0]
+            else:
+                candidates = numpy.broadcast_to(numpy.arange(size), keys.shape)
+                ties = ()
+            xor = self.words[candidates] ^ targetWords[start:stop, numpy.newaxis, :]
+            order = numpy.lexsort((xor[..., 4], xor[..., 3], xor[..., 2], xor[..., 1], xor[..., 0]), axis=-1)
+            results[start:stop] = numpy.take_along_axis(candidates, order, 1)
+            for row in ties:
+                results[start + row] = self.closestIndices(targets[start + row], count)
+        return results
+
+    def closestMany(self, targets, count):
+        """
+        returns the count peers closest to every target, ranked in batches
+        of targets, see closestIndicesMany
+        @param targets: node ids for which nearest peers to find
+        @type targets: list of integers
+        @param count: number of peers to be returned per target
+        @type count: integer
+        @return: list with the list of nearest peers for each target
+        """
+        peers = self.peers
+        return [[peers[index] for index in row] for row in self.closestIndicesMany(targets, count).tolist()]
+
+def selectClosest(peers, target, count):
+    """
+    returns the count peers closest to the target by XOR distance,
+    closest first. Large lists of contacts, which already hold their ids
+    as bytes, are ranked through PackedIds when NumPy is installed,
+    anything else through a heap based partial selection
+    @param peers: peers to be ranked
+    @type peers: list of Kademlia.node.Node or Kademlia.contact.Contact
+    @param target: node id for which nearest peers to find
+    @type target: integer
+    @param count: number of peers to be returned
+    @type count: integer
+    @return: list of peers
+    """
+    if numpy is not None and len(peers) >= VECTOR_THRESHOLD and hasattr(peers[0], 'id'):
+        return PackedIds(peers).closest(target, count)
+    return heapq.nsmallest(count, peers, key=lambda peer: peer.nodeId ^ target)
+
+def selectClosestMany(peers, targets, count):
+    """
+    returns the count peers closest to every target by XOR distance
+    @param peers: peers to be ranked
+    @type peers: list of Kademlia.node.Node or Kademlia.contact.Contact
+    @param targets: node ids for which nearest peers to find
+    @type targets: list of integers
+    @param count: number of peers to be returned per target
+    @type count: integer
+    @return: list with the list of nearest peers for each target
+    """
+    if numpy is not None and len(peers) >= VECTOR_THRESHOLD and hasattr(peers[0], 'id'):
+        return PackedIds(peers).closestMany(targets, count)
+    return [heapq.nsmallest(count, peers, key=lambda peer: peer.nodeId ^ target) for target in targets]
+
+### Test Scenarios ###
+import unittest
+from contact import Contact
+from node import Node
+from hash import newID
+
+class TestDistanceRank(unittest.TestCase):
+    """
+    It represents the test class to test the distanceRank module
+    for results equal to a full sort on distance
+    """
+    def test_select(self):
+        """
+        tests the selection of closest peers against a full sort
+        """
+        peers = [Contact(newID(), "10.0.0.1", i) for i in range(VECTOR_THRESHOLD + 50)] + [Node(i) for i in range(50)]
+        targets = [Node(i).nodeId for i in range(10)] + [peers[3].nodeId]
+        for target in targets:
+            expected = sorted(peers, key=lambda peer: peer.nodeId ^ target)
+            self.assertEqual(selectClosest(peers, target, 20), expected[:20])
+            self.assertEqual(selectClosest(peers[:10], target, 20), sorted(peers[:10], key=lambda peer: peer.nodeId ^ target))
+        self.assertEqual(selectClosestMany(peers, targets, 7), [selectClosest(peers, target, 7) for target in targets])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_batch(self):
+        """
+        tests that batches of targets rank as single targets do, across batch cuts and ties
+        """
+        global BATCH_ELEMENTS
+        prefix = newID()[:8]
+        peers = [Contact(newID(), "10.0.0.1", i) for i in range(300)] + [Contact(prefix + newID()[:12], "10.0.0.1", i) for i in range(50)]
+        packed = PackedIds(peers)
+        targets = [Node(i).nodeId for i in range(40)] + [int.from_bytes(prefix + newID()[:12], 'big') for i in range(5)]
+        expected = [packed.closest(target, 10) for target in targets]
+        self.assertEqual(packed.closestMany(targets, 10), expected)
+        self.assertEqual(packed.closestMany(targets, 1000), [packed.closest(target, 1000) for target in targets])
+        self.assertEqual(packed.closestMany([], 10), [])
+        limit = BATCH_ELEMENTS
+        try:
+            BATCH_ELEMENTS = 7 * len(peers)
+            self.assertEqual(packed.closestMany(targets, 10), expected)
+        finally:
+            BATCH_ELEMENTS = limit
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_ties(self):
+        """
+        tests that peers sharing the top 64 bits of distance are ranked on all bits
+        """
+        prefix = newID()[:8]
+        peers = [Contact(prefix + newID()[:12], "10.0.0.1", i) for i in range(100)] + [Node(i) for i in range(100)]
+        target = int.from_bytes(prefix + newID()[:12], 'big')
+        expected = sorted(peers, key=lambda peer: peer.nodeId ^ target)
+        self.assertEqual(PackedIds(peers).closest(target, 10), expected[:10])
+        self.assertEqual(PackedIds(peers).closest(target, 500), expected)
+
+if __name__ == '__main__':
+    unittest.main()
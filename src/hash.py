@@ -5,76 +5,177 @@
 - Kademlia - A peer-to-peer network DHT
 """
 
+from constants import HASH_SIZE
 from hashlib import sha1
+import os
 import random
+import secrets
+
+ID_BYTES = HASH_SIZE // 8
+
+# random.Random drawing all new ids once seeded, the secure source is used while None
+idSource = None
+
+def seedIDs(seed=None):
+    """
+    makes the new ids of this process repeat from run to run, for
+    recording and replaying workloads. Seeded ids are predictable, so
+    they are only meant for tests, simulations and traces
+    @param seed: seed of the ids, None to go back to the secure random source
+    @type seed: integer
+    """
+    global idSource
+    idSource = random.Random(seed) if seed is not None else None
    
 def generateRandom(length):
     """
-    it generates a random string of characters of a particular length
-    @param length:  length of the character string to be generated
+    it generates a random string of bytes of a particular length,
+    drawn from the operating system's secure random source
+    @param length:  length of the byte string to be generated
     @type length: integer
-    @return: utf-8 format randomly generated string of characters 
-    """
-    randStr = ''
-    i = 0
-    while i < length:
-        randStr += chr(random.randint(0,255))
-        i = i + 1
-    return randStr.encode(encoding='utf_8', errors='strict')
+    @return: randomly generated byte string
+    """
+    return os.urandom(length)
 
 def computeIntHash(strHash):
     """
     it generates an integer representation for the 20 byte string of characters
-    @param strHash:  character string which needs to be converted into integer
-    @type strHash: string
+    @param strHash:  byte string, or string of byte characters, which needs to be converted into integer
+    @type strHash: bytes or string
     @return: integer representation for string of characters 
     """
-    assert len(strHash) == 20
-    return int.from_bytes(bytes(strHash),'big')
+    if isinstance(strHash, str):
+        strHash = strHash.encode('latin_1')
+    assert len(strHash) == ID_BYTES
+    return int.from_bytes(strHash, 'big')
 
 def computeStringHash(intHash):
     """
-    it generates a string representation for the integer hash
+    it generates a byte string representation for the integer hash,
+    the inverse of computeIntHash
     @param intHash:  integer which needs to be converted into string of byte characters
     @type intHash: integer
-    @return: byte string representation for the integer hash 
+    @return: 20 byte string representation for the integer hash 
     """
-    strValue = hex(intHash)[2:]
-    if len(strValue) % 2 != 0:
-        strValue = '0' + strValue
-    strValue = strValue.decode('hex')
-    return (20 - len(strValue)) *'\x00' + strValue
+    return intHash.to_bytes(ID_BYTES, 'big')
     
 def distance(a, b):
     """
-    computes distance between 160-bit hash values expressed as 20-character strings
-    @param a:  string of byte characters
-    @type a: string
-    @param b:  string of byte characters
-    @type b: string
+    computes distance between 160-bit hash values expressed as 20 byte strings
+    @param a:  string of bytes
+    @type a: bytes
+    @param b:  string of bytes
+    @type b: bytes
     @return: distance in integer representation between two strings 
     """
-    return computeIntHash(a) ^ computeIntHash(b)
+    return int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')
+
+def commonPrefixLength(a, b):
+    """
+    computes the number of leading bits shared by two hash values
+    expressed as byte strings of equal length
+    @param a:  string of bytes
+    @type a: bytes
+    @param b:  string of bytes
+    @type b: bytes
+    @return: number of equal leading bits, 8 times the length for equal strings
+    """
+    return len(a) * 8 - distance(a, b).bit_length()
+
+def logDistance(a, b):
+    """
+    computes the logarithmic distance between two hash values, the bit
+    length of their XOR distance, so 0 for equal values and HASH_SIZE
+    for values differing in the first bit
+    @param a: 160-bit identifier
+    @type a: bytes or integer
+    @param b: 160-bit identifier
+    @type b: bytes or integer
+    @return: integer from 0 to HASH_SIZE
+    """
+    if isinstance(a, bytes):
+        return distance(a, b).bit_length()
+    return (a ^ b).bit_length()
+
+def minDistanceInRange(intHash, minValue, maxValue):
+    """
+    computes the smallest distance between the integer hash and any
+    identifier in the range [minValue, maxValue). While the hash lies
+    outside the range, the highest bit on which it differs from the
+    nearest range end is part of every distance, so it is kept and the
+    search continues on the lower bits only
+    @param intHash: integer representation of the 160-bit identifier
+    @type intHash: integer
+    @param minValue: the starting value for the range
+    @type minValue: integer which varies from 0 to 2**HASH_SIZE
+    @param maxValue: the end value for the range, excluded
+    @type maxValue: integer which varies from 0 to 2**HASH_SIZE
+    @return: smallest distance in integer representation, None for an empty range
+    """
+    if minValue >= maxValue:
+        return None
+    maxValue -= 1
+    dist = 0
+    while True:
+        if intHash < minValue:
+            bit = (intHash ^ minValue).bit_length() - 1
+            mask = (1 << bit) - 1
+            maxValue = min(maxValue, minValue | mask) & mask
+            minValue &= mask
+        elif intHash > maxValue:
+            bit = (intHash ^ maxValue).bit_length() - 1
+            mask = (1 << bit) - 1
+            minValue = max(minValue, maxValue & ~mask) & mask
+            maxValue &= mask
+        else:
+            return dist
+        dist |= 1 << bit
+        intHash &= mask
 
 def newID():
     """
-    returns a new pseudo-random globally unique ID string generated through sha
-    @return: byte string representation
+    returns a new random globally unique ID string
+    @return: 20 byte string representation
+    """
+    if idSource is not None:
+        return idSource.getrandbits(HASH_SIZE).to_bytes(ID_BYTES, 'big')
+    return os.urandom(ID_BYTES)
+
+def newIDs(count):
+    """
+    returns count new random ID strings, all sliced from a single read
+    of the secure random source
+    @param count: number of ids to be generated
+    @type count: integer
+    @return: list of 20 byte strings
+    """
+    if idSource is not None:
+        return [idSource.getrandbits(HASH_SIZE).to_bytes(ID_BYTES, 'big') for i in range(count)]
+    data = os.urandom(ID_BYTES * count)
+    return [data[i:i + ID_BYTES] for i in range(0, len(data), ID_BYTES)]
+
+def newIntID():
+    """
+    returns a new random globally unique ID, generated directly as an integer
+    @return: integer representation of the 160-bit identifier
     """
-    h = sha1()
-    h.update(generateRandom(20))
-    return h.digest()
+    if idSource is not None:
+        return idSource.getrandbits(HASH_SIZE)
+    return secrets.randbits(HASH_SIZE)
 
 def newIDInRange(minValue, maxValue):
     """
-    method to generate a within range randomId
+    method to generate a within range randomId, every id of the range
+    being equally likely
     @param minValue: the starting value for the range
     @type minValue: integer which varies from 0 to 2**HASH_SIZE
-    @param maxValue: the end value for the range
+    @param maxValue: the end value for the range, excluded
     @type maxValue: integer which varies from 0 to 2**HASH_SIZE    
-    @return: byte string representation of an id within the range 
+    @return: integer representation of an id within the range 
     """
-    return minValue + computeIntHash(newID()) % (maxValue - minValue)
+    if idSource is not None:
+        return minValue + idSource.randrange(maxValue - minValue)
+    return minValue + secrets.randbelow(maxValue - minValue)
     
 ### Test Scenarios ###
 import unittest
@@ -99,16 +200,38 @@ class TestHash(unittest.TestCase):
         """
         tests the module for generating random id's within range
         """
-        a = computeIntHash(newID())
-        b = computeIntHash(newID())
+        a, b = sorted(computeIntHash(id) for id in newIDs(2))
         c = newIDInRange(a, b)
-        assert(a <= c <= b)
+        assert(a <= c < b)
+        self.assertEqual(newIDInRange(a, a + 1), a)
     def testDist(self):
         """
         tests the module for distance metric already known
         """
         for pair, dist in self.test:
             self.assertEqual(distance(pair[0], pair[1]), dist)
+    def testConversion(self):
+        """
+        tests the module for round trips between byte and integer ids
+        """
+        ids = newIDs(50)
+        self.assertEqual(len(set(ids)), 50)
+        for id in ids:
+            self.assertEqual(len(id), 20)
+            self.assertEqual(computeStringHash(computeIntHash(id)), id)
+        self.assertEqual(computeStringHash(1), bytes(19) + b'\x01')
+        self.assertEqual(computeIntHash(computeStringHash(newIntID()).decode('latin_1')) < 2**HASH_SIZE, True)
+    def testPrefix(self):
+        """
+        tests the module for common prefix lengths
+        """
+        id = newID()
+        self.assertEqual(commonPrefixLength(id, id), HASH_SIZE)
+        self.assertEqual(commonPrefixLength(bytes(20), b'\x80' + bytes(19)), 0)
+        self.assertEqual(commonPrefixLength(bytes(20), bytes(19) + b'\x01'), HASH_SIZE - 1)
+        self.assertEqual(logDistance(id, id), 0)
+        self.assertEqual(logDistance(bytes(20), b'\x80' + bytes(19)), HASH_SIZE)
+        self.assertEqual(logDistance(6, 5), 2)
     def testCommutitive(self):
         """
         tests the module for commutative property of distances
@@ -116,6 +239,28 @@ class TestHash(unittest.TestCase):
         for i in range(100):
             x, y, z = newID(), newID(), newID()
             self.assertEqual(distance(x,y) ^ distance(y, z), distance(x, z))
+    def testRangeDist(self):
+        """
+        tests the module for smallest distance to a range against a full scan
+        """
+        for i in range(200):
+            a, b = sorted(random.sample(range(300), 2))
+            target = random.randrange(512)
+            self.assertEqual(minDistanceInRange(target, a, b), min(x ^ target for x in range(a, b)))
+        self.assertEqual(minDistanceInRange(5, 3, 3), None)
+    def testSeeded(self):
+        """
+        tests the module for repeating ids once seeded
+        """
+        try:
+            seedIDs(7)
+            first = (newID(), newIDs(3), newIntID(), newIDInRange(10, 1000))
+            seedIDs(7)
+            self.assertEqual((newID(), newIDs(3), newIntID(), newIDInRange(10, 1000)), first)
+            self.assertEqual(len(first[0]), ID_BYTES)
+        finally:
+            seedIDs()
+        self.assertEqual(idSource, None)
 
 if __name__ == '__main__':
     unittest.main()   
@@ -0,0 +1,253 @@
+"""
+- Module: It contains the round trip time estimates, adaptive timeouts and failure counts of peers for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import TIMEOUT, RTO_MIN, RTO_MAX, FAILURE_LIMIT, PEER_STATS_SIZE
+from collections import OrderedDict
+
+class PeerStats:
+    """
+    It represents what is known about the responsiveness of one peer, its
+    smoothed round trip time, the variance of it, the timeout derived from
+    both and the number of timeouts missed in a row
+    """
+    __slots__ = ('srtt', 'rttvar', 'rto', 'failures')
+
+    def __init__(self):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        """
+        self.srtt = None
+        self.rttvar = None
+        self.rto = TIMEOUT
+        self.failures = 0
+
+    def sample(self, rtt):
+        """
+        takes a measured round trip time into the estimates, as TCP does
+        (RFC 6298), and forgets the missed timeouts
+        @param rtt: seconds the peer took to answer
+        @type rtt: float
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, RTO_MIN), RTO_MAX)
+        self.failures = 0
+
+    def timedOut(self):
+        """
+        counts a missed timeout and backs the timeout off
+        @return: number of timeouts missed in a row
+        """
+        self.failures += 1
+        self.rto = min(2 * self.rto, RTO_MAX)
+        return self.failures
+
+    def cost(self):
+        """
+        returns the expected price of asking the peer, its timeout doubled
+        for every timeout it missed in a row
+        """
+        return self.rto * 2 ** self.failures
+
+class PeerHealth:
+    """
+    It holds the statistics of the most recently used peers by node id. It
+    gives every peer its own timeout and prefers, among peers at the same
+    logarithmic distance to a target, the ones answering fast and reliably
+    """
+    def __init__(self, size=PEER_STATS_SIZE, limit=FAILURE_LIMIT):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param size: maximum number of peers with statistics
+        @type size: integer, default to PEER_STATS_SIZE
+        @param limit: missed timeouts in a row after which a peer is dead
+        @type limit: integer, default to FAILURE_LIMIT
+        """
+        self.size = size
+        self.limit = limit
+        self.stats = OrderedDict()
+
+    def __len__(self):
+        """
+        returns the number of peers with statistics
+        """
+        return len(self.stats)
+
+    def get(self, peer):
+        """
+        returns the statistics of the peer, None if nothing is known
+        @param peer: peer or its node id
+        @type peer: Kademlia.node.Node, Kademlia.contact.Contact or integer
+        @return: Kademlia.health.PeerStats
+        """
+        return self.stats.get(getattr(peer, 'nodeId', peer))
+
+    def entry(self, peer):
+        """
+        returns the statistics of the peer, creating them if needed
+        """
+        key = peer.nodeId
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = PeerStats()
+            if len(self.stats) > self.size:
+                self.stats.popitem(last=False)
+        else:
+            self.stats.move_to_end(key)
+        return stats
+
+    def success(self, peer, rtt):
+        """
+        records an answer of the peer
+        @param peer: peer that answered
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @param rtt: seconds the peer took to answer
+        @type rtt: float
+        """
+        self.entry(peer).sample(rtt)
+
+    def failure(self, peer):
+        """
+        records a missed timeout of the peer
+        @param peer: peer that did not answer
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @return: boolean value, true once the peer missed limit timeouts in a row
+        """
+        return self.entry(peer).timedOut() >= self.limit
+
+    def forget(self, peer):
+        """
+        drops the statistics of a peer that left the routing table
+        """
+        self.stats.pop(getattr(peer, 'nodeId', peer), None)
+
+    def timeout(self, peer):
+        """
+        returns the seconds to wait for the peer, TIMEOUT for an unknown peer
+        """
+        stats = self.stats.get(peer.nodeId)
+        return TIMEOUT if stats is None else stats.rto
+
+    def cost(self, peer):
+        """
+        returns the expected price of asking the peer, see PeerStats.cost
+        """
+        stats = self.stats.get(peer.nodeId)
+        return TIMEOUT if stats is None else stats.cost()
+
+    def order(self, peers, num):
+        """
+        returns the peers by logarithmic distance to num, the cheaper
+        peers first among those at the same one and then by distance
+        @param peers: peers to be ordered
+        @type peers: list of peers
+        @param num: node id the distance is measured to
+        @type num: integer
+        @return: list of peers
+        """
+        stats = self.stats
+        def key(peer):
+            nodeId = peer.nodeId
+            entry = stats.get(nodeId)
+            dist = nodeId ^ num
+            return (dist.bit_length(), TIMEOUT if entry is None else entry.cost(), dist)
+        return sorted(peers, key=key)
+
+### Test Scenarios ###
+import unittest
+from node import Node
+from constants import K
+
+class TestHealth(unittest.TestCase):
+    """
+    It represents the test class to test the health module
+    for timeouts, failure counts and ordering
+    """
+    def test_rto(self):
+        """
+        tests the timeout estimates and their back off
+        """
+        stats = PeerStats()
+        self.assertEqual(stats.rto, TIMEOUT)
+        stats.sample(0.1)
+        self.assertAlmostEqual(stats.srtt, 0.1)
+        self.assertAlmostEqual(stats.rto, 0.3)
+        for i in range(50):
+            stats.sample(0.01)
+        self.assertEqual(stats.rto, RTO_MIN)
+        stats.sample(0.9)
+        self.assertTrue(stats.rto > 0.9)
+        self.assertEqual(stats.timedOut(), 1)
+        self.assertTrue(stats.rto > 1.8)
+        for i in range(10):
+            stats.timedOut()
+        self.assertEqual(stats.rto, RTO_MAX)
+        stats.sample(0.9)
+        self.assertEqual(stats.failures, 0)
+
+    def test_health(self):
+        """
+        tests failure limits, ordering and the bound on tracked peers
+        """
+        health = PeerHealth(size=3, limit=2)
+        peers = [Node(i) for i in range(4)]
+        health.success(peers[0], 0.05)
+        self.assertFalse(health.failure(peers[1]))
+        self.assertTrue(health.failure(peers[1]))
+        self.assertEqual(health.timeout(peers[2]), TIMEOUT)
+        health.success(peers[2], 0.1)
+        health.success(peers[3], 0.01)
+        self.assertEqual(len(health), 3)
+        self.assertEqual(health.get(peers[0]), None)
+        # at one logarithmic distance the fast peer comes first, whatever its distance
+        num = peers[2].nodeId ^ 2
+        near = Node(9)
+        near.nodeId = peers[2].nodeId ^ 1
+        health.success(near, 0.01)
+        self.assertEqual(health.order([peers[2], near], num), [near, peers[2]])
+        health.forget(near)
+        self.assertEqual(health.order([near, peers[2]], num), [peers[2], near])
+
+    def test_routingTable(self):
+        """
+        tests ranking by health in findNodes and replacement after repeated timeouts
+        """
+        from routingTable import RoutingTable
+        routingTable = RoutingTable(Node(0))
+        plain = RoutingTable(routingTable.node)
+        health = routingTable.enableHealth(PeerHealth(limit=FAILURE_LIMIT))
+        peers = [Node(i) for i in range(1, 200)]
+        for i, peer in enumerate(peers):
+            routingTable.addPeer(peer)
+            plain.addPeer(peer)
+            health.success(peer, 0.9 if i % 2 else 0.01)
+        for i in range(20):
+            target = Node(1000 + i).nodeId
+            expected = plain.findNodes(target)
+            result = routingTable.findNodes(target)
+            self.assertEqual(result, health.order(plain.findNodes(target, 2 * K), target)[:K])
+            # only peers at the same log distance trade places
+            self.assertEqual([(peer.nodeId ^ target).bit_length() for peer in result],
+                             [(peer.nodeId ^ target).bit_length() for peer in expected])
+        dead = routingTable.randomPeer()
+        for i in range(FAILURE_LIMIT - 1):
+            routingTable.replaceDeadNode(dead)
+            self.assertTrue(dead in routingTable.allPeers())
+        self.assertEqual(health.get(dead).failures, FAILURE_LIMIT - 1)
+        routingTable.replaceDeadNode(dead)
+        self.assertFalse(dead in routingTable.allPeers())
+        self.assertEqual(health.get(dead), None)
+
+if __name__ == '__main__':
+    unittest.main()
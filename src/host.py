@@ -0,0 +1,624 @@
+"""
+- Module: It contains the multi-process host of virtual nodes sharing their routing state through shared memory for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import HASH_SIZE, K, BUCKET_SIZE, HOST_BATCH, HOST_FLUSH_INTERVAL
+from bucket import Bucket
+from contact import Contact, ContactPool
+from routingTable import RoutingTable, closestInBuckets
+from lookup import Transport
+from bisect import bisect_right
+from multiprocessing import shared_memory
+import multiprocessing
+import os
+import random
+import socket
+import struct
+import time
+
+SLOT_HEADER = struct.Struct('=QHH20s')
+"""
+Header of the shared routing table of one identity - sequence number,
+bucket count, contact count and node id
+"""
+
+BUCKET = struct.Struct('=20sH')
+"""
+Shared bucket record - lower bound of its range and number of its contacts
+"""
+
+CONTACT = struct.Struct('=20s4sH')
+"""
+Shared contact record - node id, IPv4 address and port
+"""
+
+SLOT_CONTACTS = HASH_SIZE * BUCKET_SIZE
+SLOT_SIZE = SLOT_HEADER.size + HASH_SIZE * BUCKET.size + SLOT_CONTACTS * CONTACT.size
+"""
+A routing table holds at most HASH_SIZE buckets of BUCKET_SIZE contacts,
+so every identity gets a fixed size slot of the shared memory
+"""
+
+class SharedTables:
+    """
+    It represents the routing tables of all identities of a host in one
+    shared memory block, one fixed slot per identity. Every slot is
+    guarded by a sequence lock - its single writer makes the sequence
+    number odd while it writes and even again after, and readers retry
+    until they read the same even number before and after copying. Readers
+    keep the decoded buckets of every slot until its sequence number
+    changes, so a query only decodes a table after it was written
+    """
+    def __init__(self, memory, count):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param memory: shared memory block of count slots
+        @type memory: multiprocessing.shared_memory.SharedMemory
+        @param count: number of slots
+        @type count: integer
+        """
+        self.memory = memory
+        self.buffer = memory.buf
+        self.count = count
+        self.pool = ContactPool()
+        self.views = {}
+
+    intValue = RoutingTable.intValue
+
+    def publish(self, slot, routingTable):
+        """
+        writes the buckets and contacts of the routing table into the slot
+        @param slot: slot of the identity
+        @type slot: integer
+        @param routingTable: routing table of the identity, its peers are contacts
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        """
+        buffer = self.buffer
+        base = slot * SLOT_SIZE
+        sequence = SLOT_HEADER.unpack_from(buffer, base)[0]
+        struct.pack_into('=Q', buffer, base, sequence + 1)
+        buckets = routingTable.bucketList
+        offset = base + SLOT_HEADER.size
+        contact = base + SLOT_HEADER.size + HASH_SIZE * BUCKET.size
+        contacts = 0
+        for bucket in buckets:
+            BUCKET.pack_into(buffer, offset, bucket.minValue.to_bytes(20, 'big'), len(bucket))
+            offset += BUCKET.size
+            for peer in bucket.peers.values():
+                CONTACT.pack_into(buffer, contact, peer.id, socket.inet_aton(peer.address), peer.port)
+                contact += CONTACT.size
+                contacts += 1
+        SLOT_HEADER.pack_into(buffer, base, sequence + 1, len(buckets), contacts, routingTable.node.id)
+        struct.pack_into('=Q', buffer, base, sequence + 2)
+
+    def view(self, slot):
+        """
+        returns the decoded buckets and boundaries of the slot, consistent
+        with one complete write
+        @param slot: slot of the identity
+        @type slot: integer
+        @return: tuple of list of Kademlia.bucket.Bucket and list of lower bounds
+        """
+        buffer = self.buffer
+        base = slot * SLOT_SIZE
+        while True:
+            sequence, bucketCount, contactCount, nodeId = SLOT_HEADER.unpack_from(buffer, base)
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            cached = self.views.get(slot)
+            if cached is not None and cached[0] == sequence:
+                return cached[1]
+            records = list(BUCKET.iter_unpack(buffer[base + SLOT_HEADER.size:base + SLOT_HEADER.size + bucketCount * BUCKET.size]))
+            start = base + SLOT_HEADER.size + HASH_SIZE * BUCKET.size
+            contacts = bytes(buffer[start:start + contactCount * CONTACT.size])
+            if struct.unpack_from('=Q', buffer, base)[0] != sequence:
+                continue
+            break
+        buckets = []
+        for minValue, size in records:
+            minValue = int.from_bytes(minValue, 'big')
+            if buckets:
+                buckets[-1].maxValue = minValue
+            buckets.append(Bucket(minValue, pow(2, HASH_SIZE)))
+        contacts = CONTACT.iter_unpack(contacts)
+        intern = self.pool.intern
+        for bucket, (minValue, size) in zip(buckets, records):
+            peers = bucket.peers
+            for i in range(size):
+                id, address, port = next(contacts)
+                contact = intern(id, socket.inet_ntoa(address), port)
+                peers[contact.nodeId] = contact
+        view = (buckets, [bucket.minValue for bucket in buckets])
+        self.views[slot] = (sequence, view)
+        return view
+
+    def findNodes(self, slot, value, count=K):
+        """
+        returns the count peers of the identity's table closest to the value
+        @param slot: slot of the identity
+        @type slot: integer
+        @param value: node id for which nearest nodes to find
+        @type value: Kademlia.contact.Contact or integer, string representation
+        @param count: number of nearest nodes to be returned
+        @type count: integer, default to K
+        @return: list of Kademlia.contact.Contact, closest first
+        """
+        buckets, boundaries = self.view(slot)
+        if not buckets:
+            return []
+        num = self.intValue(value)
+        index = bisect_right(boundaries, num) - 1
+        if index < 0 or num >= buckets[index].maxValue:
+            index = -1
+        return closestInBuckets(buckets, index, num, count)
+
+def serve(name, nodes, owned, commands, replies):
+    """
+    runs a worker process of the host. It owns the routing tables of some
+    identities, applies the updates sent to them and publishes every table
+    that changed into the shared memory. Queries run against any table
+    of the host, owned or not, straight from the shared memory
+    @param name: name of the shared memory block
+    @type name: string
+    @param nodes: contacts of all identities, in slot order
+    @type nodes: list of tuples of id, address and port
+    @param owned: slots owned by the worker
+    @type owned: list of integers
+    @param commands: queue of commands for the worker
+    @type commands: multiprocessing.Queue
+    @param replies: queue of replies of all workers
+    @type replies: multiprocessing.Queue
+    """
+    # the worker shares the resource tracker of the host, which unlinks the block
+    memory = shared_memory.SharedMemory(name)
+    tables = SharedTables(memory, len(nodes))
+    routingTables = {}
+    for slot in owned:
+        routingTables[slot] = RoutingTable(Contact(*nodes[slot]))
+        tables.publish(slot, routingTables[slot])
+    try:
+        while True:
+            command = commands.get()
+            kind = command[0]
+            if kind == 'update':
+                changed = set()
+                for slot, add, id, address, port in command[1]:
+                    routingTable = routingTables[slot]
+                    peer = tables.pool.intern(id, address, port)
+                    generations = [bucket.generation for bucket in routingTable.bucketList]
+                    if add:
+                        routingTable.addPeer(peer)
+                    else:
+                        routingTable.replaceDeadNode(peer)
+                    if [bucket.generation for bucket in routingTable.bucketList] != generations:
+                        changed.add(slot)
+                for slot in changed:
+                    tables.publish(slot, routingTables[slot])
+            elif kind == 'sync':
+                replies.put(('sync', command[1]))
+            elif kind == 'query':
+                duration, count = command[1], command[2]
+                rng = random.Random(os.getpid())
+                slots = len(nodes)
+                queries = 0
+                end = time.perf_counter() + duration
+                while time.perf_counter() < end:
+                    for i in range(100):
+                        tables.findNodes(rng.randrange(slots), rng.getrandbits(HASH_SIZE), count)
+                    queries += 100
+                replies.put(('query', queries))
+            elif kind == 'stop':
+                return
+    finally:
+        del tables
+        memory.close()
+
+class VirtualNodeHost:
+    """
+    It represents a host running many identities, sharded across worker
+    processes. Every worker owns the routing tables of its identities and
+    is their only writer, while the tables themselves live in one shared
+    memory block, so every process of the host answers findNodes for any
+    local identity without pickling or messages. Updates to the tables
+    are queued and sent to the workers once batch of them are waiting or
+    interval seconds passed since the last were sent
+    """
+    def __init__(self, nodes, processes=None, batch=HOST_BATCH, interval=HOST_FLUSH_INTERVAL):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param nodes: contacts of the identities
+        @type nodes: list of Kademlia.contact.Contact
+        @param processes: number of worker processes
+        @type processes: integer, default to the number of cores
+        @param batch: queued updates that are sent at once
+        @type batch: integer, default to HOST_BATCH
+        @param interval: seconds after which queued updates are sent
+        @type interval: float, default to HOST_FLUSH_INTERVAL
+        """
+        self.nodes = list(nodes)
+        self.processes = processes or os.cpu_count() or 1
+        self.batch = batch
+        self.interval = interval
+        self.slots = dict((node.id, slot) for slot, node in enumerate(self.nodes))
+        self.memory = None
+        self.tables = None
+        self.workers = []
+        self.commands = []
+        self.replies = None
+        self.updates = None
+        # number of queued updates and the time they were last sent
+        self.queued = 0
+        self.sent = 0.0
+        self.syncs = 0
+
+    def owner(self, slot):
+        """
+        returns the index of the worker owning the identity of the slot
+        """
+        return slot % self.processes
+
+    def start(self):
+        """
+        creates the shared memory and starts the worker processes
+        """
+        context = multiprocessing.get_context()
+        self.memory = shared_memory.SharedMemory(create=True, size=SLOT_SIZE * len(self.nodes))
+        self.memory.buf[:SLOT_SIZE * len(self.nodes)] = bytes(SLOT_SIZE * len(self.nodes))
+        self.tables = SharedTables(self.memory, len(self.nodes))
+        self.replies = context.Queue()
+        self.updates = [[] for i in range(self.processes)]
+        nodes = [(node.id, node.address, node.port) for node in self.nodes]
+        for worker in range(self.processes):
+            commands = context.Queue()
+            owned = [slot for slot in range(len(self.nodes)) if self.owner(slot) == worker]
+            process = context.Process(target=serve, args=(self.memory.name, nodes, owned, commands, self.replies), daemon=True)
+            process.start()
+            self.commands.append(commands)
+            self.workers.append(process)
+        self.flush()
+
+    def close(self):
+        """
+        stops the workers and releases the shared memory
+        """
+        for commands in self.commands:
+            commands.put(('stop',))
+        for process in self.workers:
+            process.join()
+        self.workers = []
+        self.commands = []
+        self.tables = None
+        self.memory.close()
+        self.memory.unlink()
+
+    def addPeer(self, slot, peer):
+        """
+        queues the peer to be added to the routing table of the identity
+        @param slot: slot of the identity
+        @type slot: integer
+        @param peer: peer to be added
+        @type peer: Kademlia.contact.Contact
+        """
+        self.queue(slot, True, peer)
+
+    def removePeer(self, slot, peer):
+        """
+        queues the peer to be replaced as dead in the routing table of the identity
+        """
+        self.queue(slot, False, peer)
+
+    def queue(self, slot, add, peer):
+        """
+        queues one update for the owner of the identity, and sends all
+        queued updates once there are batch of them or interval passed
+        """
+        self.updates[self.owner(slot)].append((slot, add, peer.id, peer.address, peer.port))
+        self.queued += 1
+        if self.queued >= self.batch or time.monotonic() - self.sent >= self.interval:
+            self.send()
+
+    def send(self):
+        """
+        sends the queued updates, one message per worker, without waiting
+        for the workers to apply them
+        """
+        for worker, commands in enumerate(self.commands):
+            if self.updates[worker]:
+                commands.put(('update', self.updates[worker]))
+                self.updates[worker] = []
+        self.queued = 0
+        self.sent = time.monotonic()
+
+    def flush(self):
+        """
+        sends the queued updates and waits until every worker applied and
+        published them
+        """
+        self.send()
+        for commands in self.commands:
+            self.syncs += 1
+            commands.put(('sync', self.syncs))
+        for commands in self.commands:
+            self.replies.get()
+
+    def findNodes(self, slot, value, count=K):
+        """
+        returns the count peers of the identity's table closest to the
+        value, read from the shared memory
+        """
+        return self.tables.findNodes(slot, value, count)
+
+    def routingTable(self, slot):
+        """
+        returns the routing table of the identity, for a lookup engine
+        @param slot: slot of the identity
+        @type slot: integer
+        @return: Kademlia.host.SharedRoutingTable
+        """
+        return SharedRoutingTable(self, slot)
+
+    def transport(self, slot, fallback=None):
+        """
+        returns the transport of the identity
+        @param slot: slot of the identity
+        @type slot: integer
+        @param fallback: transport for peers that are not local
+        @type fallback: Kademlia.lookup.Transport
+        @return: Kademlia.host.HostTransport
+        """
+        return HostTransport(self, slot, fallback)
+
+    def benchmark(self, duration=1.0, count=K):
+        """
+        runs findNodes queries against random identities in all workers at once
+        @param duration: seconds the queries run
+        @type duration: float
+        @param count: number of nearest nodes per query
+        @type count: integer
+        @return: queries per second of all workers together
+        """
+        for commands in self.commands:
+            commands.put(('query', duration, count))
+        return sum(self.replies.get()[1] for commands in self.commands) / duration
+
+class SharedRoutingTable:
+    """
+    It represents the routing table of one identity of a host as a lookup
+    engine uses it. Queries read the shared memory slot of the identity,
+    and changes are queued to the worker owning it, so they show once the
+    worker applied them
+    """
+    # peer health and metrics are kept by the workers, not tracked here
+    health = None
+    metrics = None
+    intValue = RoutingTable.intValue
+
+    def __init__(self, host, slot):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param host: host of the identity
+        @type host: Kademlia.host.VirtualNodeHost
+        @param slot: slot of the identity
+        @type slot: integer
+        """
+        self.host = host
+        self.slot = slot
+        self.node = host.nodes[slot]
+
+    @property
+    def bucketList(self):
+        """
+        returns the buckets of the identity as last published
+        """
+        return self.host.tables.view(self.slot)[0]
+
+    def allPeers(self):
+        """
+        returns the list of all peers of the identity as last published
+        """
+        return [peer for bucket in self.bucketList for peer in bucket.peers.values()]
+
+    def findNodes(self, value, count=K):
+        """
+        returns the count peers closest to the value, see RoutingTable.findNodes
+        """
+        return self.host.tables.findNodes(self.slot, value, count)
+
+    def addPeer(self, peer):
+        """
+        queues the peer to be added, see RoutingTable.addPeer
+        """
+        if peer.id != self.node.id:
+            self.host.addPeer(self.slot, peer)
+
+    def replaceDeadNode(self, dead, new=None):
+        """
+        queues the dead node to be replaced by its bucket's replacement
+        candidate, then the new node to be added if one is given
+        """
+        self.host.removePeer(self.slot, dead)
+        if new:
+            self.addPeer(new)
+
+class HostTransport(Transport):
+    """
+    It represents the transport of one identity of a host. Requests to
+    another identity of the same host are answered from the shared memory
+    without touching a socket, the callee learning about the caller as it
+    would from a datagram. Other requests go through the fallback transport
+    """
+    def __init__(self, host, slot, fallback=None):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param host: host of the identity
+        @type host: Kademlia.host.VirtualNodeHost
+        @param slot: slot of the identity
+        @type slot: integer
+        @param fallback: transport for peers that are not local
+        @type fallback: Kademlia.lookup.Transport
+        """
+        self.host = host
+        self.slot = slot
+        self.fallback = fallback
+        self.node = host.nodes[slot]
+
+    def local(self, peer):
+        """
+        returns the slot of the peer if it is an identity of the host
+        """
+        slot = self.host.slots.get(getattr(peer, 'id', None))
+        if slot is not None:
+            self.host.addPeer(slot, self.node)
+        return slot
+
+    def remote(self):
+        """
+        returns the fallback transport
+        @raise ConnectionError: if there is none
+        """
+        if self.fallback is None:
+            raise ConnectionError("peer is not local and no fallback transport is set")
+        return self.fallback
+
+    async def ping(self, peer):
+        """
+        answers at once for a local peer
+        """
+        if self.local(peer) is not None:
+            return True
+        return await self.remote().ping(peer)
+
+    async def findNode(self, peer, target):
+        """
+        answers from the shared table of a local peer
+        """
+        slot = self.local(peer)
+        if slot is not None:
+            return self.host.findNodes(slot, target)
+        return await self.remote().findNode(peer, target)
+
+    async def findValue(self, peer, key):
+        """
+        values stay with their owner process, so they are always asked for through the fallback
+        """
+        return await self.remote().findValue(peer, key)
+
+    async def store(self, peer, key, value, ttl=None):
+        """
+        values stay with their owner process, so they are always stored through the fallback
+        """
+        return await self.remote().store(peer, key, value, ttl)
+
+### Test Scenarios ###
+import unittest
+import asyncio
+from hash import newIDs
+from lookup import LookupEngine
+
+class TestHost(unittest.TestCase):
+    """
+    It represents the test class to test the host module
+    for shared tables equal to private ones and local lookups
+    """
+    def test_host(self):
+        """
+        tests that the shared tables answer as private routing tables do
+        """
+        nodes = [Contact(id, "127.0.0.1", 4000 + i) for i, id in enumerate(newIDs(6))]
+        host = VirtualNodeHost(nodes, 2)
+        host.start()
+        try:
+            peers = [Contact(id, "10.0.0.1", 5000) for id in newIDs(300)]
+            private = [RoutingTable(node) for node in nodes]
+            for slot in range(len(nodes)):
+                for peer in peers[slot::2]:
+                    host.addPeer(slot, peer)
+                    private[slot].addPeer(peer)
+                host.removePeer(slot, peers[slot])
+                private[slot].replaceDeadNode(peers[slot])
+            host.flush()
+            for slot in range(len(nodes)):
+                for id in newIDs(10):
+                    self.assertEqual(host.findNodes(slot, id, 8), private[slot].findNodes(id, 8))
+            self.assertTrue(host.benchmark(0.1) > 0)
+        finally:
+            host.close()
+
+    def test_local(self):
+        """
+        tests lookups between identities of one host without sockets
+        """
+        nodes = [Contact(id, "127.0.0.1", 4000 + i) for i, id in enumerate(newIDs(40))]
+        host = VirtualNodeHost(nodes, 2)
+        host.start()
+        try:
+            for slot in range(len(nodes)):
+                for other in random.sample(nodes, 8):
+                    if other is not nodes[slot]:
+                        host.addPeer(slot, other)
+            host.flush()
+            async def join():
+                # identities join as in Kademlia, by a lookup of their own id
+                for slot in range(len(nodes)):
+                    await LookupEngine(host.routingTable(slot), host.transport(slot)).findNode(nodes[slot])
+                    host.flush()
+            asyncio.run(join())
+            engine = LookupEngine(host.routingTable(0), host.transport(0))
+            target = nodes[17]
+            result = asyncio.run(engine.lookup(target))
+            expected = sorted(nodes[1:], key=lambda node: node.nodeId ^ target.nodeId)
+            self.assertEqual(result.peers[0], expected[0])
+            host.flush()
+            # the peers asked learned about the caller
+            for peer in result.peers:
+                self.assertTrue(nodes[0] in host.routingTable(host.slots[peer.id]).allPeers())
+            with self.assertRaises(ConnectionError):
+                asyncio.run(host.transport(0).ping(Contact(newIDs(1)[0], "10.0.0.1", 1)))
+        finally:
+            host.close()
+
+    def test_batch(self):
+        """
+        tests that queued updates are sent once a batch is full, without a flush
+        """
+        nodes = [Contact(id, "127.0.0.1", 4000 + i) for i, id in enumerate(newIDs(4))]
+        host = VirtualNodeHost(nodes, 2, batch=10, interval=3600)
+        host.start()
+        try:
+            peers = [Contact(id, "10.0.0.1", 5000) for id in newIDs(25)]
+            for peer in peers:
+                host.addPeer(0, peer)
+            self.assertEqual(host.queued, 5)
+            self.assertEqual(sum(len(updates) for updates in host.updates), 5)
+            deadline = time.monotonic() + 10
+            while len(host.routingTable(0).allPeers()) < 20 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(host.routingTable(0).allPeers()), 20)
+        finally:
+            host.close()
+
+if __name__ == '__main__':
+    import sys
+    identities = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    nodes = [Contact(id, "127.0.0.1", 4000 + i) for i, id in enumerate(newIDs(identities))]
+    peers = [Contact(id, "10.0.0.1", 5000) for id in newIDs(2000)]
+    for processes in sorted(set([1, 2, 4, os.cpu_count() or 1])):
+        host = VirtualNodeHost(nodes, processes)
+        host.start()
+        try:
+            for slot in range(identities):
+                for peer in random.sample(peers, 200):
+                    host.addPeer(slot, peer)
+            host.flush()
+            print("%d processes  %.0f findNodes/s" % (processes, host.benchmark(2.0)))
+        finally:
+            host.close()
@@ -0,0 +1,777 @@
+"""
+- Module: It contains the iterative node and value lookup engine with its transport interface for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import K, TIMEOUT, EXPIRE, LOOKUP_LIMIT, LOOKUP_QUEUE, LOOKUP_CACHE_TTL, LOOKUP_CACHE_SIZE
+from distanceRank import selectClosest
+from storage import Storage, cacheTTL
+from hash import logDistance
+from collections import OrderedDict
+import asyncio
+
+class Transport:
+    """
+    It represents the interface the lookup engine uses to reach peers.
+    Every call is a coroutine that returns the peer's answer, a peer that
+    never answers is left to the caller's timeout. A call may also raise,
+    such as ConnectionError for an unreachable peer or ValueError for a
+    malformed answer, which fails only that request
+    """
+    async def ping(self, peer):
+        """
+        checks whether the peer is alive
+        @param peer: peer to be contacted
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @return: boolean value true once the peer answers
+        """
+        raise NotImplementedError
+
+    async def findNode(self, peer, target):
+        """
+        asks the peer for the nodes it knows closest to the target
+        @param peer: peer to be contacted
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @param target: node id for which nearest nodes to find
+        @type target: integer
+        @return: list of peers
+        """
+        raise NotImplementedError
+
+    async def findValue(self, peer, key):
+        """
+        asks the peer for the value of the key, or the nodes it knows closest to it
+        @param peer: peer to be contacted
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @param key: key whose value to find
+        @type key: integer
+        @return: tuple of value, None if not stored, and list of peers
+        """
+        raise NotImplementedError
+
+    async def store(self, peer, key, value, ttl=None):
+        """
+        asks the peer to store the key value pair
+        @param peer: peer to be contacted
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @param key: key to be stored
+        @type key: integer
+        @param value: value to be stored
+        @type value: bytes
+        @param ttl: seconds the pair lives, for cached copies
+        @type ttl: float, default to the expiry of the peer's storage
+        @return: boolean value true once the peer stored the pair
+        """
+        raise NotImplementedError
+
+class LoopbackNetwork:
+    """
+    It represents an in-process network, connecting loopback transports by node id
+    """
+    def __init__(self, delay=0):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param delay: seconds every request takes to be answered
+        @type delay: float, default to 0
+        """
+        self.delay = delay
+        self.endpoints = {}
+
+class LoopbackTransport(Transport):
+    """
+    It represents the transport of one node on a loopback network. It
+    answers the requests of other nodes from its own routing table and
+    values, and learns about every node that contacts it
+    """
+    def __init__(self, network, routingTable):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param network: network the node joins
+        @type network: Kademlia.lookup.LoopbackNetwork
+        @param routingTable: routing table of the node
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        """
+        self.network = network
+        self.routingTable = routingTable
+        self.values = Storage()
+        self.online = True
+        # FIND_VALUE requests answered, the load of the node
+        self.served = 0
+        self.replicating = None
+        network.endpoints[routingTable.node.nodeId] = self
+
+    async def remote(self, peer):
+        """
+        returns the transport of the peer once the network delay passed,
+        a peer that is offline or unknown never answers
+        @param peer: peer to be contacted
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @return: Kademlia.lookup.LoopbackTransport
+        """
+        endpoint = self.network.endpoints.get(peer.nodeId)
+        if self.network.delay:
+            await asyncio.sleep(self.network.delay)
+        if endpoint is None or not endpoint.online:
+            await asyncio.get_running_loop().create_future()
+        endpoint.routingTable.addPeer(self.routingTable.node)
+        return endpoint
+
+    async def ping(self, peer):
+        """
+        answers the ping once the peer is reached
+        """
+        await self.remote(peer)
+        return True
+
+    async def findNode(self, peer, target):
+        """
+        answers from the routing table of the peer
+        """
+        endpoint = await self.remote(peer)
+        return endpoint.routingTable.findNodes(target)
+
+    async def findValue(self, peer, key):
+        """
+        answers from the values, or else the routing table, of the peer
+        """
+        endpoint = await self.remote(peer)
+        endpoint.served += 1
+        value = endpoint.values.get(key)
+        if value is not None:
+            if endpoint.values.hot:
+                endpoint.replicateHot()
+            return value, []
+        return None, endpoint.routingTable.findNodes(key)
+
+    async def store(self, peer, key, value, ttl=None):
+        """
+        stores the pair in the values of the peer
+        """
+        endpoint = await self.remote(peer)
+        endpoint.values.store(key, value, ttl=ttl)
+        return True
+
+    def replicateHot(self):
+        """
+        starts the replication of the popular values of the node, unless
+        one is running already
+        """
+        if self.replicating is None or self.replicating.done():
+            self.replicating = asyncio.ensure_future(self.values.replicateHot(self.routingTable, self))
+
+class LookupResult:
+    """
+    It holds the outcome of one iterative lookup
+    """
+    __slots__ = ('peers', 'value', 'hops', 'queried', 'failed')
+
+    def __init__(self, peers, value, hops, queried, failed):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param peers: closest peers that answered, closest first
+        @type peers: list of peers
+        @param value: value found, None for node lookups or if not found
+        @type value: bytes
+        @param hops: longest chain of referrals that led to a result peer,
+        or to the peer holding the value once found
+        @type hops: integer
+        @param queried: number of requests sent
+        @type queried: integer
+        @param failed: number of requests that timed out
+        @type failed: integer
+        """
+        self.peers = peers
+        self.value = value
+        self.hops = hops
+        self.queried = queried
+        self.failed = failed
+
+class LookupEngine:
+    """
+    It runs iterative node and value lookups over a transport. At most
+    alpha requests are in flight, their answers are merged into a bounded
+    shortlist ordered on distance to the target, and peers that miss the
+    timeout are dropped as stale instead of holding the lookup up. When the
+    routing table tracks peer health, every peer gets its own timeout and
+    the fast peers are asked first among those at the same log distance.
+    With path caching a value found is also stored at the closest peer
+    asked that did not have it, as in the Kademlia paper
+    """
+    def __init__(self, routingTable, transport, alpha=K, count=K, timeout=TIMEOUT, cachePath=False):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param routingTable: routing table of the node running the lookups
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param transport: transport used to reach peers
+        @type transport: Kademlia.lookup.Transport
+        @param alpha: maximum number of requests in flight
+        @type alpha: integer, default to K
+        @param count: number of closest peers a lookup returns
+        @type count: integer, default to K
+        @param timeout: seconds after which a peer is considered stale, when peer health is not tracked
+        @type timeout: float, default to TIMEOUT
+        @param cachePath: whether values found are cached along the lookup path
+        @type cachePath: boolean, default to False
+        """
+        self.routingTable = routingTable
+        self.transport = transport
+        self.alpha = alpha
+        self.count = count
+        self.timeout = timeout
+        self.cachePath = cachePath
+        # cache stores still in flight
+        self.caching = set()
+
+    async def findNode(self, target):
+        """
+        returns the closest peers to the target found in the network
+        @param target: node id for which nearest nodes to find
+        @type target: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation
+        @return: list of peers, closest first
+        """
+        return (await self.lookup(target)).peers
+
+    async def findValue(self, key):
+        """
+        returns the value of the key found in the network
+        @param key: key whose value to find
+        @type key: integer, string representation
+        @return: value, None if not found
+        """
+        return (await self.lookup(key, True)).value
+
+    async def request(self, peer, num, findValue):
+        """
+        sends one request and waits for its answer at most timeout seconds
+        @param peer: peer to be contacted
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        @param num: node id or key to look up
+        @type num: integer
+        @param findValue: whether to ask for a value instead of nodes
+        @type findValue: boolean
+        @return: tuple of value and list of peers
+        @raise asyncio.TimeoutError: if the peer does not answer in time
+        """
+        health = getattr(self.routingTable, 'health', None)
+        if health is None:
+            if findValue:
+                return await asyncio.wait_for(self.transport.findValue(peer, num), self.timeout)
+            return None, await asyncio.wait_for(self.transport.findNode(peer, num), self.timeout)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if findValue:
+            answer = await asyncio.wait_for(self.transport.findValue(peer, num), health.timeout(peer))
+        else:
+            answer = None, await asyncio.wait_for(self.transport.findNode(peer, num), health.timeout(peer))
+        health.success(peer, loop.time() - start)
+        return answer
+
+    def stale(self, peer):
+        """
+        handles a peer that missed the timeout, it is replaced in the routing
+        table, or has one more missed timeout counted when peer health is tracked
+        @param peer: peer that did not answer
+        @type peer: Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        self.routingTable.replaceDeadNode(peer)
+
+    def cache(self, num, value, holder, asked):
+        """
+        stores a value found at the closest peer asked that did not have
+        it, with a lifetime halved for every bit it is farther from the key
+        than the peer holding the value
+        @param num: key of the value
+        @type num: integer
+        @param value: value found
+        @type value: bytes
+        @param holder: peer that answered with the value
+        @type holder: Kademlia.node.Node or Kademlia.contact.Contact
+        @param asked: peers that answered without the value
+        @type asked: list of peers
+        """
+        if not asked:
+            return
+        peer = min(asked, key=lambda peer: peer.nodeId ^ num)
+        ttl = cacheTTL(EXPIRE, logDistance(holder.nodeId, num), logDistance(peer.nodeId, num))
+        task = asyncio.ensure_future(asyncio.wait_for(self.transport.store(peer, num, value, ttl), self.timeout))
+        self.caching.add(task)
+        task.add_done_callback(self.cached)
+
+    def cached(self, task):
+        """
+        forgets a finished cache store, a peer that missed it is of no concern
+        """
+        self.caching.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    async def lookup(self, target, findValue=False):
+        """
+        runs one iterative lookup. It ends when the count closest peers
+        known have all answered or failed, or as soon as a value is found.
+        A peer whose request raises is dropped like one missing the timeout.
+        Once a round of alpha answers brings no closer peer, peers learned
+        later are not queried any more, which ends the lookup early
+        @param target: node id or key to look up
+        @type target: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation
+        @param findValue: whether to look for a value instead of nodes
+        @type findValue: boolean, default to False
+        @return: Kademlia.lookup.LookupResult
+        """
+        start = asyncio.get_running_loop().time()
+        num = self.routingTable.intValue(target)
+        ownId = self.routingTable.node.nodeId
+        bound = 2 * self.count
+        shortlist = self.routingTable.findNodes(num, bound)
+        hops = dict((peer.nodeId, 1) for peer in shortlist)
+        queried = set()
+        answered = set()
+        failed = 0
+        value = None
+        holder = None
+        holders = set()
+        pending = {}
+        best = shortlist[0].nodeId ^ num if shortlist else None
+        idle = 0
+        final = None
+        health = getattr(self.routingTable, 'health', None)
+        try:
+            while True:
+                if final is None and idle >= self.alpha:
+                    # a round brought no closer peer, only the current closest are still queried
+                    final = set(peer.nodeId for peer in shortlist[:self.count])
+                candidates = shortlist[:self.count]
+                if health is not None:
+                    candidates = health.order(candidates, num)
+                for peer in candidates:
+                    if len(pending) >= self.alpha:
+                        break
+                    if peer.nodeId not in queried and (final is None or peer.nodeId in final):
+                        queried.add(peer.nodeId)
+                        pending[asyncio.ensure_future(self.request(peer, num, findValue))] = peer
+                if not pending:
+                    break
+                done = (await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))[0]
+                for task in done:
+                    peer = pending.pop(task)
+                    try:
+                        found, peers = task.result()
+                    except Exception:
+                        # a peer answering garbage or unreachable counts as one that timed out
+                        failed += 1
+                        shortlist = [p for p in shortlist if p.nodeId != peer.nodeId]
+                        self.stale(peer)
+                        continue
+                    answered.add(peer.nodeId)
+                    self.routingTable.addPeer(peer)
+                    if found is not None:
+                        value = found
+                        holder = peer
+                        holders.add(peer.nodeId)
+                        continue
+                    known = set(p.nodeId for p in shortlist)
+                    fresh = [p for p in peers if p.nodeId not in known and p.nodeId not in queried and p.nodeId != ownId]
+                    for p in fresh:
+                        hops[p.nodeId] = hops[peer.nodeId] + 1
+                    # shortlist merging goes through the ranking backend
+                    shortlist = selectClosest(shortlist + fresh, num, bound)
+                    if shortlist and (best is None or shortlist[0].nodeId ^ num < best):
+                        best = shortlist[0].nodeId ^ num
+                        idle = 0
+                    else:
+                        idle += 1
+                if value is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+        if value is not None:
+            depth = hops[holder.nodeId]
+            if self.cachePath:
+                self.cache(num, value, holder, [peer for peer in shortlist if peer.nodeId in answered and peer.nodeId not in holders])
+        peers = [peer for peer in shortlist if peer.nodeId in answered][:self.count]
+        if value is None:
+            depth = max([hops[peer.nodeId] for peer in peers] or [0])
+        metrics = getattr(self.routingTable, 'metrics', None)
+        if metrics is not None:
+            metrics.lookups.observe(asyncio.get_running_loop().time() - start)
+            metrics.shortlist.observe(len(shortlist))
+            metrics.hops.observe(depth)
+            metrics.timeouts.inc(failed)
+        return LookupResult(peers, value, depth, len(queried), failed)
+
+class LookupOverloaded(Exception):
+    """
+    It is raised to a caller when all lookup slots are busy and the queue
+    of waiting lookups is full, the caller should back off and retry later
+    """
+
+class LookupCoordinator:
+    """
+    It stands between the local callers and a lookup engine. Callers
+    asking for a target already being looked up wait for that lookup
+    instead of starting their own, and a result stays shared for ttl
+    seconds after it arrived. At most limit lookups run at once, the
+    others wait in a queue of at most queue lookups, and callers beyond
+    it are turned away with LookupOverloaded, so a burst of callers
+    never floods the peers with duplicate requests
+    """
+    def __init__(self, engine, limit=LOOKUP_LIMIT, queue=LOOKUP_QUEUE, ttl=LOOKUP_CACHE_TTL, size=LOOKUP_CACHE_SIZE):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param engine: engine running the lookups
+        @type engine: Kademlia.lookup.LookupEngine
+        @param limit: maximum number of lookups running at once
+        @type limit: integer, default to LOOKUP_LIMIT
+        @param queue: maximum number of lookups waiting for a slot
+        @type queue: integer, default to LOOKUP_QUEUE
+        @param ttl: seconds a result is shared with later callers, 0 to only share lookups in flight
+        @type ttl: float, default to LOOKUP_CACHE_TTL
+        @param size: maximum number of results kept
+        @type size: integer, default to LOOKUP_CACHE_SIZE
+        """
+        self.engine = engine
+        self.limit = limit
+        self.queue = queue
+        self.ttl = ttl
+        self.size = size
+        self.slots = asyncio.Semaphore(limit)
+        # lookup tasks by target and kind, shared by all their callers
+        self.inflight = {}
+        # results by target and kind with their expiry time, least recently used first
+        self.results = OrderedDict()
+        # lookups admitted and not finished yet, running or waiting for a slot
+        self.admitted = 0
+        self.started = 0
+        self.coalesced = 0
+        self.hits = 0
+        self.rejected = 0
+        self.queried = 0
+
+    async def findNode(self, target):
+        """
+        returns the closest peers to the target found in the network
+        @param target: node id for which nearest nodes to find
+        @type target: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation
+        @return: list of peers, closest first
+        @raise LookupOverloaded: if no more lookups can be admitted
+        """
+        return (await self.lookup(target)).peers
+
+    async def findValue(self, key):
+        """
+        returns the value of the key found in the network
+        @param key: key whose value to find
+        @type key: integer, string representation
+        @return: value, None if not found
+        @raise LookupOverloaded: if no more lookups can be admitted
+        """
+        return (await self.lookup(key, True)).value
+
+    async def lookup(self, target, findValue=False):
+        """
+        returns the result of a lookup of the target, shared with every
+        other caller asking for it at the same time or within ttl seconds.
+        The result is shared, it must not be changed. A caller cancelled
+        while waiting leaves the lookup running for the others
+        @param target: node id or key to look up
+        @type target: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation
+        @param findValue: whether to look for a value instead of nodes
+        @type findValue: boolean, default to False
+        @return: Kademlia.lookup.LookupResult
+        @raise LookupOverloaded: if all slots are busy and the queue is full
+        """
+        key = (self.engine.routingTable.intValue(target), findValue)
+        entry = self.results.get(key)
+        if entry is not None:
+            if entry[0] > asyncio.get_running_loop().time():
+                self.results.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self.results[key]
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            if self.admitted >= self.limit + self.queue:
+                self.rejected += 1
+                raise LookupOverloaded("%d lookups running and waiting" % self.admitted)
+            self.admitted += 1
+            task = self.inflight[key] = asyncio.ensure_future(self.run(key))
+        return await asyncio.shield(task)
+
+    async def run(self, key):
+        """
+        runs one admitted lookup once a slot is free and keeps its result
+        @param key: target and whether to look for a value
+        @type key: tuple
+        @return: Kademlia.lookup.LookupResult
+        """
+        try:
+            async with self.slots:
+                self.started += 1
+                result = await self.engine.lookup(*key)
+            self.queried += result.queried
+            if self.ttl > 0:
+                self.results[key] = (asyncio.get_running_loop().time() + self.ttl, result)
+                if len(self.results) > self.size:
+                    self.results.popitem(last=False)
+            return result
+        finally:
+            self.admitted -= 1
+            del self.inflight[key]
+
+    def forget(self, target):
+        """
+        drops the shared results of the target, such as after storing a
+        new value for it
+        @param target: node id or key
+        @type target: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation
+        """
+        num = self.engine.routingTable.intValue(target)
+        self.results.pop((num, False), None)
+        self.results.pop((num, True), None)
+
+    def stats(self):
+        """
+        returns the lookups started, the callers that joined one in flight,
+        were answered from a shared result or turned away, the requests
+        sent by the lookups started and the lookups running or waiting
+        """
+        return {
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'hits': self.hits,
+            'rejected': self.rejected,
+            'requests': self.queried,
+            'admitted': self.admitted,
+            'size': len(self.results),
+        }
+
+### Test Scenarios ###
+import unittest
+import random
+from node import Node
+from routingTable import RoutingTable
+
+def buildNetwork(size, delay=0):
+    """
+    builds a loopback network where nodes join one after another through
+    a lookup of their own id, starting from the first node, and then all
+    look their own id up once more to learn about later neighbours
+    @param size: number of nodes
+    @type size: integer
+    @param delay: seconds every request takes to be answered
+    @type delay: float
+    @return: tuple of network and list of engines
+    """
+    network = LoopbackNetwork(delay)
+    engines = []
+    async def join():
+        for i in range(size):
+            routingTable = RoutingTable(Node(i))
+            engine = LookupEngine(routingTable, LoopbackTransport(network, routingTable), timeout=0.2)
+            if engines:
+                routingTable.addPeer(engines[0].routingTable.node)
+                await engine.findNode(routingTable.node)
+            engines.append(engine)
+        for engine in engines:
+            await engine.findNode(engine.routingTable.node)
+    asyncio.run(join())
+    return network, engines
+
+class TestLookup(unittest.TestCase):
+    """
+    It represents the test class to test the lookup module
+    for iterative lookups over a loopback network
+    """
+    def test_findNode(self):
+        """
+        tests that node lookups find the closest nodes of the network
+        """
+        network, engines = buildNetwork(80)
+        nodes = [engine.routingTable.node for engine in engines]
+        async def run():
+            found = 0
+            for i in range(20):
+                target = Node(1000 + i).nodeId
+                engine = random.choice(engines)
+                expected = sorted([node for node in nodes if node != engine.routingTable.node], key=lambda node: node.nodeId ^ target)
+                result = await engine.lookup(target)
+                found += result.peers[0] == expected[0]
+                self.assertEqual(len(result.peers), K)
+                self.assertTrue(result.queried <= len(nodes))
+                self.assertTrue(result.hops >= 1)
+            # lookups may end early, but nearly all of them reach the closest node
+            self.assertTrue(found >= 15)
+        asyncio.run(run())
+
+    def test_findValue(self):
+        """
+        tests that value lookups stop at a node storing the value
+        """
+        network, engines = buildNetwork(40)
+        key = Node(999).nodeId
+        async def run():
+            for peer in await engines[5].findNode(key):
+                await engines[5].transport.store(peer, key, b"nitin")
+            self.assertEqual(await engines[20].findValue(key), b"nitin")
+            self.assertEqual(await engines[20].findValue(Node(998).nodeId), None)
+        asyncio.run(run())
+
+    def test_cachePath(self):
+        """
+        tests that a value found is cached at the closest peer asked that did not have it,
+        and never at another peer that also answered with it
+        """
+        network, engines = buildNetwork(40)
+        key = Node(999).nodeId
+        async def run():
+            engine = engines[20]
+            holders = (await engine.findNode(key))[:2]
+            for holder in holders:
+                await engine.transport.store(holder, key, b"nitin")
+            engine.cachePath = True
+            result = await engine.lookup(key, True)
+            self.assertEqual(result.value, b"nitin")
+            await asyncio.gather(*engine.caching)
+            caches = [endpoint for endpoint in network.endpoints.values() if key in endpoint.values and endpoint.routingTable.node not in holders]
+            if result.queried > len(holders):
+                self.assertEqual(len(caches), 1)
+                entry = caches[0].values.entries[key]
+                self.assertTrue(entry.expireTime - caches[0].values.clock() <= EXPIRE)
+        asyncio.run(run())
+
+    def test_timeout(self):
+        """
+        tests that peers missing the timeout are dropped without blocking the lookup
+        """
+        network, engines = buildNetwork(30)
+        for engine in engines[1:20]:
+            engine.transport.online = False
+        engine = engines[25]
+        async def run():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            result = await engine.lookup(Node(999).nodeId)
+            self.assertTrue(loop.time() - start < 20 * engine.timeout)
+            for peer in result.peers:
+                self.assertTrue(network.endpoints[peer.nodeId].online)
+            return result
+        result = asyncio.run(run())
+        self.assertTrue(result.failed > 0)
+
+    def test_errors(self):
+        """
+        tests that peers failing with errors are dropped like those missing the timeout
+        """
+        network, engines = buildNetwork(30)
+        engine = engines[25]
+        broken = set(peer.nodeId for peer in engine.routingTable.allPeers()[::2])
+        findNode = engine.transport.findNode
+        async def failing(peer, target):
+            if peer.nodeId in broken:
+                raise ConnectionError("unreachable")
+            return await findNode(peer, target)
+        engine.transport.findNode = failing
+        async def run():
+            result = await engine.lookup(Node(999).nodeId)
+            self.assertEqual(len(asyncio.all_tasks()), 1)
+            return result
+        result = asyncio.run(run())
+        self.assertTrue(result.failed > 0)
+        self.assertFalse(set(peer.nodeId for peer in result.peers) & broken)
+
+    def test_health(self):
+        """
+        tests that tracked peers get their own timeouts and survive a single miss
+        """
+        network, engines = buildNetwork(30)
+        engine = engines[25]
+        engine.timeout = 10
+        health = engine.routingTable.enableHealth()
+        async def run():
+            await engine.lookup(Node(999).nodeId)
+            peer = next(peer for peer in engine.routingTable.allPeers() if health.get(peer) is not None)
+            self.assertTrue(health.get(peer).rto < engine.timeout)
+            network.endpoints[peer.nodeId].online = False
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            with self.assertRaises(asyncio.TimeoutError):
+                await engine.request(peer, 0, False)
+            self.assertTrue(loop.time() - start < 1)
+            engine.stale(peer)
+            self.assertTrue(peer in engine.routingTable.allPeers())
+            self.assertEqual(health.get(peer).failures, 1)
+        asyncio.run(run())
+
+    def test_coalesce(self):
+        """
+        tests that callers asking for one target at once share a single lookup
+        """
+        network, engines = buildNetwork(40, delay=0.01)
+        engine = engines[10]
+        coordinator = LookupCoordinator(engine)
+        targets = [Node(900 + i).nodeId for i in range(3)]
+        async def run():
+            plain = await asyncio.gather(*[engine.lookup(targets[i % 3]) for i in range(30)])
+            results = await asyncio.gather(*[coordinator.lookup(targets[i % 3]) for i in range(30)])
+            for i, result in enumerate(results):
+                self.assertTrue(result is results[i % 3])
+            self.assertEqual((coordinator.started, coordinator.coalesced), (3, 27))
+            # each target is looked up once instead of ten times
+            self.assertTrue(coordinator.stats()['requests'] * 5 <= sum(result.queried for result in plain))
+            self.assertTrue(await coordinator.lookup(targets[0]) is results[0])
+            self.assertEqual(coordinator.hits, 1)
+            coordinator.forget(targets[0])
+            self.assertFalse(await coordinator.lookup(targets[0]) is results[0])
+            self.assertEqual(coordinator.started, 4)
+            self.assertEqual(coordinator.stats()['admitted'], 0)
+        asyncio.run(run())
+
+    def test_admission(self):
+        """
+        tests the bound on running lookups, the queue and turning callers away
+        """
+        network, engines = buildNetwork(30, delay=0.02)
+        engine = engines[5]
+        coordinator = LookupCoordinator(engine, limit=2, queue=3, ttl=0)
+        lookup = engine.lookup
+        running = [0, 0]
+        async def counted(target, findValue=False):
+            running[0] += 1
+            running[1] = max(running)
+            try:
+                return await lookup(target, findValue)
+            finally:
+                running[0] -= 1
+        engine.lookup = counted
+        targets = [Node(900 + i).nodeId for i in range(6)]
+        async def run():
+            callers = [asyncio.ensure_future(coordinator.lookup(target)) for target in targets[:5]]
+            await asyncio.sleep(0)
+            self.assertEqual(coordinator.admitted, 5)
+            with self.assertRaises(LookupOverloaded):
+                await coordinator.lookup(targets[5])
+            # a caller joining a waiting lookup takes no room in the queue
+            joined = asyncio.ensure_future(coordinator.lookup(targets[4]))
+            callers[4].cancel()
+            results = await asyncio.gather(*callers[:4])
+            self.assertEqual(len(results[0].peers), K)
+            self.assertEqual(len((await joined).peers), K)
+            self.assertEqual(running[1], 2)
+            self.assertEqual(coordinator.stats()['rejected'], 1)
+            self.assertEqual((coordinator.started, coordinator.admitted, len(coordinator.inflight)), (5, 0, 0))
+            self.assertEqual(len(coordinator.results), 0)
+        asyncio.run(run())
+
+if __name__ == '__main__':
+    unittest.main()
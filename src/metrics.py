@@ -0,0 +1,327 @@
+"""
+- Module: It contains the metrics registry and the instrumentation of the routing components for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import BUCKET_SIZE
+from bisect import bisect_left
+import weakref
+
+LATENCY_BOUNDS = tuple(1e-6 * 2 ** i for i in range(24))
+"""
+Upper bounds in seconds of the latency histogram buckets, from 1us to about 8s
+"""
+
+SIZE_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+"""
+Upper bounds of the size histogram buckets
+"""
+
+class Counter:
+    """
+    It represents a monotonically increasing count
+    """
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name, help):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param name: metric name
+        @type name: string
+        @param help: description of the metric
+        @type help: string
+        """
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        increases the count
+        @param amount: increment
+        @type amount: integer, default to 1
+        """
+        self.value += amount
+
+class Histogram:
+    """
+    It represents the distribution of observed values over fixed buckets,
+    each observation costing one binary search
+    """
+    __slots__ = ('name', 'help', 'bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, name, help, bounds):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param name: metric name
+        @type name: string
+        @param help: description of the metric
+        @type help: string
+        @param bounds: increasing upper bounds of the buckets
+        @type bounds: tuple of numbers
+        """
+        self.name = name
+        self.help = help
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        """
+        forgets all observations
+        """
+        # the last count holds values above every bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        records one value
+        @param value: observed value
+        @type value: number
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """
+    It holds named counters and histograms. Collectors registered with it
+    refresh values that are computed from state, such as bucket fill
+    levels, right before a snapshot or an export
+    """
+    def __init__(self, prefix='kademlia_'):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param prefix: prefix of every exported metric name
+        @type prefix: string
+        """
+        self.prefix = prefix
+        self.metrics = {}
+        self.collectors = []
+        # routing tables instrumented with the registry, held weakly so they can be released
+        self.tables = weakref.WeakSet()
+
+    def counter(self, name, help=''):
+        """
+        returns the counter of the name, creating it if needed
+        @return: Kademlia.metrics.Counter
+        """
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help)
+        return self.metrics[name]
+
+    def histogram(self, name, help='', bounds=LATENCY_BOUNDS):
+        """
+        returns the histogram of the name, creating it if needed
+        @return: Kademlia.metrics.Histogram
+        """
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help, bounds)
+        return self.metrics[name]
+
+    def collector(self, function):
+        """
+        registers a function called before every snapshot or export
+        @param function: function without arguments
+        @type function: function
+        """
+        self.collectors.append(function)
+
+    def collect(self):
+        """
+        runs all collectors
+        """
+        for function in self.collectors:
+            function()
+
+    def snapshot(self):
+        """
+        returns the current values, a number for every counter and for
+        every histogram its count, sum and bucket counts by upper bound
+        @return: dictionary
+        """
+        self.collect()
+        values = {}
+        for name, metric in sorted(self.metrics.items()):
+            if isinstance(metric, Counter):
+                values[name] = metric.value
+            else:
+                values[name] = {
+                    'count': metric.count,
+                    'sum': metric.sum,
+                    'buckets': dict(zip(metric.bounds + (float('inf'),), metric.counts)),
+                }
+        return values
+
+    def prometheus(self):
+        """
+        returns the current values in the Prometheus text exposition format
+        @return: string
+        """
+        self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            name = self.prefix + name
+            if isinstance(metric, Counter):
+                lines.append("# HELP %s %s" % (name, metric.help))
+                lines.append("# TYPE %s counter" % name)
+                lines.append("%s %d" % (name, metric.value))
+                continue
+            lines.append("# HELP %s %s" % (name, metric.help))
+            lines.append("# TYPE %s histogram" % name)
+            cumulative = 0
+            for bound, count in zip(metric.bounds, metric.counts):
+                cumulative += count
+                lines.append('%s_bucket{le="%r"} %d' % (name, bound, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (name, metric.count))
+            lines.append("%s_sum %r" % (name, metric.sum))
+            lines.append("%s_count %d" % (name, metric.count))
+        return "\n".join(lines) + "\n"
+
+def collectFill(fill, tables):
+    """
+    refreshes the bucket fill histogram from all routing tables of a registry
+    @param fill: bucket fill histogram
+    @type fill: Kademlia.metrics.Histogram
+    @param tables: instrumented routing tables
+    @type tables: weakref.WeakSet
+    """
+    fill.reset()
+    for routingTable in list(tables):
+        for bucket in routingTable.bucketList:
+            fill.observe(len(bucket))
+
+class RoutingMetrics:
+    """
+    It holds the metrics of one routing table and its lookups, bound
+    once so that every hook is a single attribute access. All tables of
+    a registry share its metrics, their counts add up and the bucket fill
+    histogram covers the buckets of every table still alive
+    """
+    def __init__(self, registry, routingTable):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param registry: registry the metrics belong to
+        @type registry: Kademlia.metrics.MetricsRegistry
+        @param routingTable: instrumented routing table
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        """
+        self.inserts = registry.counter('peers_inserted_total', "Peers added to a bucket")
+        self.touches = registry.counter('peers_touched_total', "Known peers seen again and moved to the tail of their bucket")
+        self.splits = registry.counter('bucket_splits_total', "Buckets split in two")
+        self.rejections = registry.counter('full_bucket_rejections_total', "Peers kept out of a full bucket that could not split")
+        self.evictions = registry.counter('replacement_evictions_total', "Replacement candidates dropped from a full replacement cache")
+        self.replacements = registry.counter('dead_node_replacements_total', "Dead peers removed from the routing table")
+        self.invalid = registry.counter('invalid_peers_total', "Peers with an id outside the hash range")
+        self.timeouts = registry.counter('lookup_timeouts_total', "Lookup requests that missed the timeout")
+        self.findNodes = registry.histogram('find_nodes_seconds', "Time spent in findNodes")
+        self.lookups = registry.histogram('lookup_seconds', "Time taken by iterative lookups")
+        self.hops = registry.histogram('lookup_hops', "Referral depth of the results of a lookup", SIZE_BOUNDS)
+        self.shortlist = registry.histogram('lookup_shortlist_size', "Shortlist size at the end of a lookup", SIZE_BOUNDS)
+        first = 'bucket_fill' not in registry.metrics
+        self.fill = fill = registry.histogram('bucket_fill', "Peers per bucket", tuple(range(BUCKET_SIZE + 1)))
+        tables = registry.tables
+        tables.add(routingTable)
+        if first:
+            registry.collector(lambda: collectFill(fill, tables))
+
+### Test Scenarios ###
+import unittest
+import asyncio
+from node import Node
+from routingTable import RoutingTable
+from lookup import LookupEngine
+
+class TestMetrics(unittest.TestCase):
+    """
+    It represents the test class to test the metrics module
+    for registry exports and routing table hooks
+    """
+    def test_registry(self):
+        """
+        tests metrics module for snapshot and Prometheus export
+        """
+        registry = MetricsRegistry()
+        registry.counter('a_total', "A").inc(3)
+        histogram = registry.histogram('b', "B", (1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['a_total'], 3)
+        self.assertEqual(snapshot['b']['buckets'], {1: 2, 10: 1, float('inf'): 1})
+        text = registry.prometheus()
+        self.assertTrue("kademlia_a_total 3\n" in text)
+        self.assertTrue('kademlia_b_bucket{le="10"} 3\n' in text)
+        self.assertTrue('kademlia_b_bucket{le="+Inf"} 4\n' in text)
+        self.assertTrue("kademlia_b_count 4\n" in text)
+
+    def test_routingTable(self):
+        """
+        tests metrics module for the counts of an instrumented routing table
+        """
+        registry = MetricsRegistry()
+        routingTable = RoutingTable(Node(0))
+        routingTable.instrument(registry)
+        peers = [Node(i) for i in range(1, 100)]
+        for peer in peers:
+            routingTable.addPeer(peer)
+        routingTable.addPeer(peers[0])
+        routingTable.findNodes(peers[5])
+        routingTable.replaceDeadNode(peers[0])
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['peers_inserted_total'], 99)
+        self.assertEqual(snapshot['peers_touched_total'], 1)
+        self.assertEqual(snapshot['bucket_splits_total'], len(routingTable.bucketList) - 1)
+        self.assertEqual(snapshot['dead_node_replacements_total'], 1)
+        self.assertEqual(snapshot['find_nodes_seconds']['count'], 1)
+        self.assertEqual(snapshot['bucket_fill']['count'], len(routingTable.bucketList))
+
+    def test_tables(self):
+        """
+        tests metrics module for the bucket fill of several tables and their release
+        """
+        import gc
+        registry = MetricsRegistry()
+        tables = [RoutingTable(Node(0)) for i in range(2)]
+        for i, routingTable in enumerate(tables):
+            routingTable.instrument(registry)
+            for j in range(1, 40 * (i + 1)):
+                routingTable.addPeer(Node(j))
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['bucket_fill']['count'], sum(len(table.bucketList) for table in tables))
+        self.assertEqual(snapshot['peers_inserted_total'], 39 + 79)
+        self.assertEqual(len(registry.collectors), 1)
+        remaining = len(tables[0].bucketList)
+        del tables[1], routingTable
+        gc.collect()
+        self.assertEqual(len(registry.tables), 1)
+        self.assertEqual(registry.snapshot()['bucket_fill']['count'], remaining)
+
+    def test_lookup(self):
+        """
+        tests metrics module for the lookup histograms
+        """
+        class Silent:
+            async def findNode(self, peer, target):
+                await asyncio.sleep(10)
+        registry = MetricsRegistry()
+        routingTable = RoutingTable(Node(0))
+        routingTable.instrument(registry)
+        for i in range(1, 10):
+            routingTable.addPeer(Node(i))
+        asyncio.run(LookupEngine(routingTable, Silent(), timeout=0.01).lookup(Node(99)))
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['lookup_seconds']['count'], 1)
+        self.assertEqual(snapshot['lookup_shortlist_size']['count'], 1)
+        self.assertTrue(snapshot['lookup_timeouts_total'] > 0)
+
+if __name__ == '__main__':
+    unittest.main()
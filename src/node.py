@@ -6,7 +6,7 @@
 """
 
 # Import the required modules
-from hash import newID,computeIntHash
+from hash import newIntID
 
 class Node:
     """
@@ -20,7 +20,7 @@ class Node:
         @type processId: integer 
         """
         self.processId = processId
-        self.nodeId = computeIntHash(newID())
+        self.nodeId = newIntID()
     
     def __lt__(self, a):
         """
@@ -0,0 +1,600 @@
+"""
+- Module: It contains the binary datagram RPC protocol (PING, STORE, FIND_NODE, FIND_VALUE) for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import K, TIMEOUT
+from contact import Contact, ContactPool
+from lookup import Transport
+from storage import Storage
+import asyncio
+import secrets
+import socket
+import struct
+import time
+
+PING = 1
+STORE = 2
+FIND_NODE = 3
+FIND_VALUE = 4
+CACHE = 5
+RESPONSE = 0x80
+"""
+Message types, a response carries the type of its request with the RESPONSE bit set
+"""
+
+HEADER = struct.Struct('!BI20sH')
+"""
+Message header - type, transaction id, sender id and sender listening port
+"""
+
+CONTACT = struct.Struct('!20s4sH')
+"""
+Packed contact triple - node id, IPv4 address and port
+"""
+
+TTL = struct.Struct('!I')
+"""
+Remaining lifetime in seconds of a cached copy or a republished value, following the key of a CACHE request
+"""
+
+FOUND = 1
+"""
+Flag opening a FIND_VALUE response that carries the value instead of contacts
+"""
+
+def encodeId(value):
+    """
+    returns the 20 byte representation of a node id or key
+    @param value: node id or key
+    @type value: integer or 20 byte string
+    @return: 20 byte string
+    """
+    if isinstance(value, int):
+        return value.to_bytes(20, 'big')
+    return bytes(value)
+
+def encodeContacts(contacts):
+    """
+    packs a list of contacts as a count followed by contact triples
+    @param contacts: contacts to be packed, at most 255
+    @type contacts: list of Kademlia.contact.Contact
+    @return: byte string
+    """
+    parts = [bytes([len(contacts)])]
+    for contact in contacts:
+        parts.append(CONTACT.pack(contact.id, socket.inet_aton(contact.address), contact.port))
+    return b''.join(parts)
+
+def decodeContacts(view, pool):
+    """
+    unpacks a count followed by contact triples, straight from the datagram
+    @param view: buffer starting at the count
+    @type view: memoryview
+    @param pool: pool the contacts are interned in, known contacts keep their endpoint
+    @type pool: Kademlia.contact.ContactPool
+    @return: list of Kademlia.contact.Contact
+    @raise ValueError: if the count is missing or the contacts are cut short
+    """
+    if len(view) < 1:
+        raise ValueError("contact count is missing")
+    end = 1 + view[0] * CONTACT.size
+    if len(view) < end:
+        raise ValueError("contacts are cut short")
+    contacts = []
+    for id, address, port in CONTACT.iter_unpack(view[1:end]):
+        contacts.append(pool.intern(id, socket.inet_ntoa(address), port, False))
+    return contacts
+
+class KademliaProtocol(asyncio.DatagramProtocol, Transport):
+    """
+    It represents the RPC endpoint of a node on a UDP socket. Requests
+    from other nodes are answered from the routing table and values, and
+    the node's own requests are matched to their responses by a random
+    transaction id, so any number of them share the socket. A response is
+    only taken when its type, sender id and address match the request.
+    The sender is refreshed in the routing table once its request was
+    answered or its response matched, other datagrams leave the table alone.
+    Only a matched response moves a known peer to another endpoint, a
+    request claiming its id from elsewhere has the old endpoint pinged first
+    """
+    def __init__(self, routingTable, pool=None, timeout=TIMEOUT):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param routingTable: routing table of the node, its node is a Contact
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param pool: pool the contacts received are interned in
+        @type pool: Kademlia.contact.ContactPool
+        @param timeout: seconds to wait for a response
+        @type timeout: float, default to TIMEOUT
+        """
+        self.routingTable = routingTable
+        self.pool = pool if pool is not None else ContactPool()
+        self.timeout = timeout
+        self.values = Storage()
+        self.replicating = None
+        # outstanding requests by transaction id, each the future, message type, address and node id expected
+        self.pending = {}
+        # endpoint checks running by node id, for requests claiming a known id from another endpoint
+        self.moving = {}
+        self.endpoint = None
+
+    def connection_made(self, endpoint):
+        """
+        keeps the datagram transport once the socket is ready
+        """
+        self.endpoint = endpoint
+
+    def connection_lost(self, exc):
+        """
+        fails all outstanding requests once the socket is closed
+        """
+        for future, kind, address, id in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("socket closed"))
+        self.pending.clear()
+
+    def close(self):
+        """
+        closes the socket of the endpoint
+        """
+        self.endpoint.close()
+
+    def send(self, kind, transaction, payload, address):
+        """
+        sends one message with the node's own header
+        @param kind: message type
+        @type kind: integer
+        @param transaction: transaction id
+        @type transaction: integer
+        @param payload: message body
+        @type payload: byte string
+        @param address: destination address and port
+        @type address: tuple
+        """
+        node = self.routingTable.node
+        self.endpoint.sendto(HEADER.pack(kind, transaction, node.id, node.port) + payload, address)
+
+    def datagram_received(self, data, address):
+        """
+        dispatches a datagram to the waiting request or the request handler.
+        Malformed datagrams and responses matching no request are ignored
+        """
+        view = memoryview(data)
+        try:
+            kind, transaction, senderId, senderPort = HEADER.unpack_from(view)
+            body = view[HEADER.size:]
+            if kind & RESPONSE:
+                request = self.pending.get(transaction)
+                if request is None:
+                    return
+                future, expected, destination, id = request
+                if kind & ~RESPONSE != expected or tuple(address[:2]) != destination or senderId != id:
+                    return
+                del self.pending[transaction]
+                if future.done():
+                    return
+                future.set_result(body)
+            else:
+                if not self.handleRequest(kind, transaction, body, address):
+                    return
+                known = self.pool.contacts.get(senderId)
+                if known is not None and (known.address != address[0] or known.port != senderPort):
+                    self.checkMove(known, address[0], senderPort)
+                    return
+            sender = self.pool.intern(senderId, address[0], senderPort)
+            sender.lastSeen = time.time()
+            self.routingTable.addPeer(sender)
+        except (struct.error, ValueError, IndexError, OSError):
+            return
+
+    def checkMove(self, known, address, port):
+        """
+        starts the check of a known peer after a request claimed its id
+        from another endpoint, unless one is running already
+        @param known: contact of the peer at its current endpoint
+        @type known: Kademlia.contact.Contact
+        @param address: network address the request came from
+        @type address: string
+        @param port: network port the request claimed
+        @type port: integer
+        """
+        if known.id not in self.moving:
+            self.moving[known.id] = asyncio.ensure_future(self.verifyMove(known, address, port))
+
+    async def verifyMove(self, known, address, port):
+        """
+        pings the peer at its current endpoint, and only when it is dead
+        at the new one, whose matched response then moves the contact
+        @param known: contact of the peer at its current endpoint
+        @type known: Kademlia.contact.Contact
+        @param address: network address the request came from
+        @type address: string
+        @param port: network port the request claimed
+        @type port: integer
+        """
+        try:
+            try:
+                await self.ping(known)
+                return
+            except (asyncio.TimeoutError, OSError):
+                pass
+            await self.ping(Contact(known.id, address, port))
+        except (asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            self.moving.pop(known.id, None)
+
+    def handleRequest(self, kind, transaction, body, address):
+        """
+        answers one request of another node
+        @param kind: message type
+        @type kind: integer
+        @param transaction: transaction id to be echoed
+        @type transaction: integer
+        @param body: message body after the header
+        @type body: memoryview
+        @param address: address and port of the requesting node
+        @type address: tuple
+        @return: boolean value, true if the request was valid and answered
+        """
+        if kind == PING:
+            payload = b''
+        elif kind == STORE:
+            key = bytes(body[:20])
+            if len(key) != 20:
+                return False
+            self.values.store(key, bytes(body[20:]))
+            payload = b''
+        elif kind == CACHE:
+            key = bytes(body[:20])
+            if len(key) != 20:
+                return False
+            self.values.store(key, bytes(body[20 + TTL.size:]), ttl=TTL.unpack_from(body, 20)[0])
+            payload = b''
+        elif kind == FIND_NODE or kind == FIND_VALUE:
+            key = bytes(body[:20])
+            if len(key) != 20:
+                return False
+            value = self.values.get(key) if kind == FIND_VALUE else None
+            if value is not None:
+                payload = bytes([FOUND]) + value
+                if self.values.hot:
+                    self.replicateHot()
+            else:
+                payload = encodeContacts(self.routingTable.findNodes(key))
+                if kind == FIND_VALUE:
+                    payload = bytes([0]) + payload
+        else:
+            return False
+        self.send(kind | RESPONSE, transaction, payload, address)
+        return True
+
+    async def request(self, peer, kind, payload):
+        """
+        sends a request to the peer and waits for the matching response
+        @param peer: peer to be contacted
+        @type peer: Kademlia.contact.Contact
+        @param kind: message type
+        @type kind: integer
+        @param payload: message body
+        @type payload: byte string
+        @return: body of the response
+        @raise asyncio.TimeoutError: if the peer does not answer in time
+        """
+        loop = asyncio.get_running_loop()
+        # unpredictable ids, so an off-path sender cannot guess a response in
+        transaction = secrets.randbits(32)
+        while transaction in self.pending:
+            transaction = secrets.randbits(32)
+        future = loop.create_future()
+        address = (peer.address, peer.port)
+        self.pending[transaction] = (future, kind, address, peer.id)
+        # a timer per request is cheaper than wrapping it into a task
+        timer = loop.call_later(self.timeout, self.expire, transaction)
+        try:
+            self.send(kind, transaction, payload, address)
+            body = await future
+        finally:
+            timer.cancel()
+            self.pending.pop(transaction, None)
+        return body
+
+    def expire(self, transaction):
+        """
+        fails a request whose response did not arrive in time
+        @param transaction: transaction id of the request
+        @type transaction: integer
+        """
+        request = self.pending.pop(transaction, None)
+        if request is not None and not request[0].done():
+            request[0].set_exception(asyncio.TimeoutError())
+
+    async def ping(self, peer):
+        """
+        checks whether the peer is alive
+        """
+        await self.request(peer, PING, b'')
+        return True
+
+    async def findNode(self, peer, target):
+        """
+        asks the peer for the nodes it knows closest to the target
+        @raise ValueError: if the response is malformed
+        """
+        body = await self.request(peer, FIND_NODE, encodeId(target))
+        return decodeContacts(body, self.pool)
+
+    async def findValue(self, peer, key):
+        """
+        asks the peer for the value of the key, or the nodes it knows closest to it
+        @raise ValueError: if the response is malformed
+        """
+        body = await self.request(peer, FIND_VALUE, encodeId(key))
+        if len(body) < 1:
+            raise ValueError("FIND_VALUE response is empty")
+        if body[0] == FOUND:
+            return bytes(body[1:]), []
+        return None, decodeContacts(body[1:], self.pool)
+
+    async def store(self, peer, key, value, ttl=None):
+        """
+        asks the peer to store the key value pair, for at most the lifetime
+        when one is given, as for cached copies and republished values
+        """
+        if ttl is None:
+            await self.request(peer, STORE, encodeId(key) + bytes(value))
+        else:
+            await self.request(peer, CACHE, encodeId(key) + TTL.pack(max(1, int(ttl))) + bytes(value))
+        return True
+
+    def replicateHot(self):
+        """
+        starts the replication of the popular values of the node, unless
+        one is running already
+        """
+        if self.replicating is None or self.replicating.done():
+            self.replicating = asyncio.ensure_future(self.values.replicateHot(self.routingTable, self))
+
+async def listen(routingTable, host='127.0.0.1', port=0, pool=None, timeout=TIMEOUT):
+    """
+    opens the UDP endpoint of a node. With port 0 the system picks a
+    free port, which is then recorded in the node's contact
+    @param routingTable: routing table of the node, its node is a Contact
+    @type routingTable: Kademlia.routingTable.RoutingTable
+    @param host: address to listen on
+    @type host: string
+    @param port: port to listen on
+    @type port: integer
+    @param pool: pool the contacts received are interned in
+    @type pool: Kademlia.contact.ContactPool
+    @param timeout: seconds to wait for a response
+    @type timeout: float, default to TIMEOUT
+    @return: Kademlia.protocol.KademliaProtocol
+    """
+    loop = asyncio.get_running_loop()
+    endpoint, protocol = await loop.create_datagram_endpoint(
+        lambda: KademliaProtocol(routingTable, pool, timeout), local_addr=(host, port))
+    routingTable.node.address, routingTable.node.port = endpoint.get_extra_info('sockname')[:2]
+    return protocol
+
+### Test Scenarios ###
+import unittest
+from routingTable import RoutingTable
+from lookup import LookupEngine
+from hash import newID
+
+class HostileResponder(asyncio.DatagramProtocol):
+    """
+    It represents a peer answering every request with a well formed
+    header but a useless response: an empty body, the wrong message type,
+    or a correct response sent from another socket
+    """
+    def __init__(self, id, mode, spoofer=None):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param id: node id the responder claims
+        @type id: 20 byte string
+        @param mode: 'empty', 'kind' or 'spoof'
+        @type mode: string
+        @param spoofer: socket the spoofed responses are sent from
+        @type spoofer: asyncio.DatagramTransport
+        """
+        self.id = id
+        self.mode = mode
+        self.spoofer = spoofer
+        self.endpoint = None
+
+    def connection_made(self, endpoint):
+        """
+        keeps the datagram transport once the socket is ready
+        """
+        self.endpoint = endpoint
+
+    def datagram_received(self, data, address):
+        """
+        answers a request in the hostile way of the responder
+        """
+        kind, transaction = HEADER.unpack_from(data)[:2]
+        if kind & RESPONSE:
+            return
+        port = self.endpoint.get_extra_info('sockname')[1]
+        if self.mode == 'empty':
+            self.endpoint.sendto(HEADER.pack(kind | RESPONSE, transaction, self.id, port), address)
+        elif self.mode == 'kind':
+            self.endpoint.sendto(HEADER.pack(PING | RESPONSE, transaction, self.id, port) + b'\x00', address)
+        else:
+            self.spoofer.sendto(HEADER.pack(kind | RESPONSE, transaction, self.id, port) + b'\x00', address)
+
+class TestProtocol(unittest.TestCase):
+    """
+    It represents the test class to test the protocol module
+    for RPCs between nodes over localhost sockets
+    """
+    def test_encoding(self):
+        """
+        tests protocol module for packing and unpacking contacts
+        """
+        pool = ContactPool()
+        contacts = [Contact(newID(), "10.0.%d.1" % i, 4000 + i) for i in range(K)]
+        data = memoryview(b'\x00' + encodeContacts(contacts))
+        decoded = decodeContacts(data[1:], pool)
+        self.assertEqual(decoded, contacts)
+        self.assertEqual([contact.port for contact in decoded], [contact.port for contact in contacts])
+        self.assertEqual(decoded[2].address, "10.0.2.1")
+
+    def test_rpc(self):
+        """
+        tests protocol module for all RPCs between two nodes
+        """
+        async def run():
+            first = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)))
+            second = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)))
+            try:
+                peer = second.routingTable.node
+                self.assertTrue(await first.ping(peer))
+                self.assertTrue(first.routingTable.node in second.routingTable.allPeers())
+                self.assertTrue(peer in first.routingTable.allPeers())
+                key = newID()
+                self.assertTrue(await first.store(peer, key, b"nitin"))
+                self.assertEqual(await first.findValue(peer, key), (b"nitin", []))
+                cached = newID()
+                self.assertTrue(await first.store(peer, cached, b"copy", 60))
+                self.assertEqual(second.values.entries[cached].value, b"copy")
+                self.assertTrue(second.values.entries[cached].expireTime <= time.monotonic() + 60)
+                value, nodes = await first.findValue(peer, newID())
+                self.assertEqual((value, nodes), (None, [first.routingTable.node]))
+                self.assertEqual(await first.findNode(peer, newID()), [first.routingTable.node])
+                answers = await asyncio.gather(*[first.ping(peer) for i in range(100)])
+                self.assertEqual(answers, [True] * 100)
+                self.assertEqual(first.pending, {})
+                first.timeout = 0.1
+                second.close()
+                with self.assertRaises(asyncio.TimeoutError):
+                    await first.ping(peer)
+            finally:
+                first.close()
+                second.close()
+        asyncio.run(run())
+
+    def test_hostile(self):
+        """
+        tests protocol module against peers answering with malformed or mismatched responses
+        """
+        async def run():
+            loop = asyncio.get_running_loop()
+            node = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)), timeout=0.2)
+            spoofer = (await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=("127.0.0.1", 0)))[0]
+            hostile = {}
+            for mode in ('empty', 'kind', 'spoof'):
+                id = newID()
+                endpoint = (await loop.create_datagram_endpoint(
+                    lambda: HostileResponder(id, mode, spoofer), local_addr=("127.0.0.1", 0)))[0]
+                hostile[mode] = (endpoint, Contact(id, "127.0.0.1", endpoint.get_extra_info('sockname')[1]))
+            try:
+                peer = hostile['empty'][1]
+                with self.assertRaises(ValueError):
+                    await node.findValue(peer, newID())
+                with self.assertRaises(ValueError):
+                    await node.findNode(peer, newID())
+                for mode in ('kind', 'spoof'):
+                    with self.assertRaises(asyncio.TimeoutError):
+                        await node.findNode(hostile[mode][1], newID())
+                    self.assertFalse(hostile[mode][1] in node.routingTable.allPeers())
+                self.assertEqual(node.pending, {})
+                # a lookup through a hostile peer fails it instead of dying
+                other = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)), timeout=0.2)
+                try:
+                    await node.ping(other.routingTable.node)
+                    node.routingTable.addPeer(peer)
+                    result = await LookupEngine(node.routingTable, node, timeout=0.5).lookup(newID(), True)
+                    self.assertEqual(result.failed, 1)
+                    self.assertEqual(result.peers, [other.routingTable.node])
+                finally:
+                    other.close()
+                # unsolicited datagrams do not make it into the routing table
+                stranger = newID()
+                address = ("127.0.0.1", node.routingTable.node.port)
+                spoofer.sendto(HEADER.pack(PING | RESPONSE, 7, stranger, 1), address)
+                spoofer.sendto(HEADER.pack(99, 7, stranger, 1), address)
+                spoofer.sendto(HEADER.pack(FIND_NODE, 7, stranger, 1) + b'short', address)
+                await asyncio.sleep(0.05)
+                self.assertFalse(any(contact.id == stranger for contact in node.routingTable.allPeers()))
+            finally:
+                node.close()
+                spoofer.close()
+                for endpoint, contact in hostile.values():
+                    endpoint.close()
+        asyncio.run(run())
+
+    def test_forgedSender(self):
+        """
+        tests that a request claiming a known id from another endpoint only
+        moves the peer once its old endpoint is dead and the new one answers
+        """
+        async def run():
+            loop = asyncio.get_running_loop()
+            first = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)), timeout=0.2)
+            second = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)), timeout=0.2)
+            forger = (await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=("127.0.0.1", 0)))[0]
+            moved = None
+            try:
+                node = first.routingTable.node
+                await first.ping(second.routingTable.node)
+                known = second.pool.contacts[node.id]
+                port = known.port
+                address = ("127.0.0.1", second.routingTable.node.port)
+                forger.sendto(HEADER.pack(PING, 7, node.id, forger.get_extra_info('sockname')[1]), address)
+                await asyncio.sleep(0.1)
+                self.assertEqual(second.moving, {})
+                self.assertEqual(known.port, port)
+                self.assertEqual([peer.port for peer in second.routingTable.allPeers()], [port])
+                # hearsay of another endpoint does not move it either
+                decodeContacts(memoryview(bytes([1]) + encodeContacts([Contact(node.id, "127.0.0.1", 1)])), second.pool)
+                self.assertEqual(known.port, port)
+                # the node restarted on another port is taken once the old one is dead
+                first.close()
+                moved = await listen(RoutingTable(Contact(node.id, "127.0.0.1", 0)), timeout=0.2)
+                await moved.ping(second.routingTable.node)
+                await asyncio.gather(*second.moving.values())
+                self.assertEqual(known.port, moved.routingTable.node.port)
+                self.assertEqual([peer.port for peer in second.routingTable.allPeers()], [known.port])
+            finally:
+                first.close()
+                second.close()
+                forger.close()
+                if moved is not None:
+                    moved.close()
+        asyncio.run(run())
+
+    def test_lookup(self):
+        """
+        tests protocol module as the transport of iterative lookups
+        """
+        async def run():
+            nodes = []
+            for i in range(20):
+                protocol = await listen(RoutingTable(Contact(newID(), "127.0.0.1", 0)), timeout=0.5)
+                if nodes:
+                    await protocol.ping(nodes[0].routingTable.node)
+                    await LookupEngine(protocol.routingTable, protocol).findNode(protocol.routingTable.node)
+                nodes.append(protocol)
+            try:
+                key = newID()
+                engine = LookupEngine(nodes[3].routingTable, nodes[3])
+                for peer in await engine.findNode(key):
+                    await nodes[3].store(peer, key, b"value")
+                engine = LookupEngine(nodes[17].routingTable, nodes[17])
+                self.assertEqual(await engine.findValue(key), b"value")
+            finally:
+                for protocol in nodes:
+                    protocol.close()
+        asyncio.run(run())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,79 +6,381 @@
 """
 
 # Import the required modules
-from constants import HASH_SIZE,K, BUCKET_SIZE
+from constants import HASH_SIZE,K, BUCKET_SIZE, VECTOR_THRESHOLD, VECTOR_WINDOW, REPLACEMENT_CACHE_SIZE, FIND_CACHE_SIZE
 from bucket import Bucket
 from node import Node
-from hash import computeIntHash
+from contact import Contact
+from hash import computeIntHash, minDistanceInRange
+from distanceRank import numpy, PackedIds
+from bisect import bisect_right
+from collections import OrderedDict
+import heapq
 import random
+import time
+
+def closestInBuckets(bucketList, bucketIndex, num, count, visited=None):
+    """
+    selects the count peers closest to num by XOR distance from a sorted
+    list of buckets. Buckets are walked outward from the bucket of num,
+    always on the side that could still hold the closer peer, and the walk
+    stops as soon as no remaining bucket can beat the current selection
+        @param bucketList: buckets covering the id space in increasing order
+        @type bucketList: list of Kademlia.bucket.Bucket
+        @param bucketIndex: index of the bucket containing num, -1 if none
+        @type bucketIndex: integer
+        @param num: node id for which nearest peers to find
+        @type num: integer representation of 160-bit identifier
+        @param count: number of nearest peers to be returned
+        @type count: integer
+        @param visited: list the scanned buckets are appended to, if given
+        @type visited: list
+        @return: list of nearest peers, closest first
+    """
+    if count <= 0 or not bucketList:
+        return []
+    if bucketIndex < 0:
+        bucketIndex = len(bucketList) - 1 if num >= bucketList[-1].maxValue else 0
+    # max-heap on distance holding the best count peers seen so far
+    selected = []
+    left = bucketIndex
+    right = bucketIndex + 1
+    end = bucketList[-1].maxValue
+    while left >= 0 or right < len(bucketList):
+        # all unvisited buckets on one side form a single contiguous range
+        leftBound = minDistanceInRange(num, bucketList[0].minValue, bucketList[left].maxValue) if left >= 0 else None
+        rightBound = minDistanceInRange(num, bucketList[right].minValue, end) if right < len(bucketList) else None
+        if rightBound is None or (leftBound is not None and leftBound <= rightBound):
+            bound = leftBound
+            bucket = bucketList[left]
+            left -= 1
+        else:
+            bound = rightBound
+            bucket = bucketList[right]
+            right += 1
+        if len(selected) == count and bound >= -selected[0][0]:
+            break
+        if visited is not None:
+            visited.append(bucket)
+        for peer in bucket.peers.values():
+            dist = peer.nodeId ^ num
+            if len(selected) < count:
+                heapq.heappush(selected, (-dist, peer))
+            elif dist < -selected[0][0]:
+                heapq.heapreplace(selected, (-dist, peer))
+    selected.sort(reverse=True)
+    return [peer for dist, peer in selected]
+
+class FindNodesCache:
+    """
+    It represents a bounded least recently used cache of findNodes results,
+    keyed by target and count. Every entry remembers the generation of
+    the buckets its result was computed from, so a change to any other
+    bucket leaves it valid, and a stale entry is dropped when it is hit
+    """
+    def __init__(self, size=FIND_CACHE_SIZE):
+        """ 
+        it represents the constructor for the class,
+        which initializes the object variables  
+        @param size: maximum number of cached results
+        @type size: integer, default to FIND_CACHE_SIZE
+        """  
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        
+    def get(self, key):
+        """ 
+        returns the cached result if none of its buckets changed since
+            @param key: target and count
+            @type key: tuple
+            @return: list of peers, None on a miss
+        """  
+        entry = self.entries.get(key)
+        if entry is not None:
+            peers, buckets = entry
+            for bucket, generation in buckets:
+                if bucket.generation != generation:
+                    del self.entries[key]
+                    self.invalidations += 1
+                    break
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return list(peers)
+        self.misses += 1
+        return None
+    
+    def put(self, key, peers, buckets):
+        """ 
+        caches a result with the current generation of its buckets
+            @param key: target and count
+            @type key: tuple
+            @param peers: result of findNodes
+            @type peers: list of peers
+            @param buckets: buckets the result depends on
+            @type buckets: list of Kademlia.bucket.Bucket
+        """  
+        self.entries[key] = (list(peers), tuple((bucket, bucket.generation) for bucket in buckets))
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            
+    def stats(self):
+        """ 
+        returns the hit, miss and invalidation counts, the hit ratio and the size
+        """  
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hitRatio': self.hits / lookups if lookups else 0.0,
+            'size': len(self.entries),
+        }
 
 class RoutingTable:
     """
     It represents the routing table for the node, 
-    and contains peers information in different buckets
+    and contains peers information in different buckets.
+    By default any full bucket is split at the median of its peers. With
+    digitBits set the table uses the accelerated layout of section 4.2 of
+    the Kademlia paper instead: only the bucket holding the node's own id
+    is split, into 2**digitBits buckets by the next digit of the ids, so
+    every level of the table covers one b-bit digit and a lookup gains b
+    bits per hop
     """
-    def __init__(self, node):
+    def __init__(self, node, digitBits=None):
         """ 
         it represents the constructor for the class,
         which initializes the object variables  
         @param node: the node routing table belongs to
         @type node: Kademlia.node.Node
+        @param digitBits: bits per digit of the accelerated layout
+        @type digitBits: integer, default to None for median splits
         """  
         self.node = node
+        self.digitBits = digitBits
         self.bucketList = [Bucket(0, pow(2,HASH_SIZE))]
+        # sorted minValue of every bucket, kept parallel to bucketList
+        self.bucketBoundaries = [0]
+        # packed ids of all peers for vectorized ranking, rebuilt after membership changes
+        self.packedPeers = None
+        # Kademlia.metrics.RoutingMetrics when instrumented, hooks are skipped while None
+        self.metrics = None
+        # time source of the bucket activity, a virtual clock in simulations
+        self.clock = time.monotonic
+        # Kademlia.routingTable.FindNodesCache once enabled
+        self.findCache = None
+        # Kademlia.health.PeerHealth once enabled, peers are then ranked by responsiveness too
+        self.health = None
+        
+    def enableCache(self, size=FIND_CACHE_SIZE):
+        """ 
+        puts a bounded result cache in front of findNodes
+            @param size: maximum number of cached results
+            @type size: integer, default to FIND_CACHE_SIZE
+        """  
+        self.findCache = FindNodesCache(size)
+        
+    def cacheStats(self):
+        """ 
+        returns the statistics of the findNodes cache, None when disabled
+        """  
+        return self.findCache.stats() if self.findCache is not None else None
+        
+    def enableHealth(self, health=None):
+        """ 
+        tracks round trip times and missed timeouts of peers. Among peers
+        at the same logarithmic distance findNodes then prefers the fast
+        and reliable ones, and replaceDeadNode only drops a peer after
+        FAILURE_LIMIT missed timeouts in a row
+            @param health: statistics to be used, new ones if None
+            @type health: Kademlia.health.PeerHealth
+            @return: Kademlia.health.PeerHealth
+        """  
+        from health import PeerHealth
+        self.health = health if health is not None else PeerHealth()
+        return self.health
+        
+    def instrument(self, registry):
+        """ 
+        records the activity of the routing table in the metrics registry
+            @param registry: registry the metrics are recorded in
+            @type registry: Kademlia.metrics.MetricsRegistry
+        """  
+        from metrics import RoutingMetrics
+        self.metrics = RoutingMetrics(registry, self)
         
     def bucketIndexForInt(self, nodeId):
         """ 
         returns the index of the bucket in the bucket list 
-        that could contain the provided node id
+        that could contain the provided node id, through a binary search
+        over the sorted bucket boundaries
             @param nodeId: node id for which bucket needs to be find 
             @type nodeId: integer representation of 160-bit identifier computed through sha
-            @return: index of suitable bucket in the bucket List
+            @return: index of suitable bucket in the bucket List, -1 if out of range
         """  
-        index = -1
-        for bucket in self.bucketList:
-            if nodeId >= bucket.minValue and nodeId <= bucket.maxValue:
-                index = self.bucketList.index(bucket)
+        index = bisect_right(self.bucketBoundaries, nodeId) - 1
+        if index < 0 or nodeId >= self.bucketList[index].maxValue:
+            return -1
         return index
     
-    #return     
-    def findNodes(self, value):
+    def findNodes(self, value, count=K):
         """ 
         returns K nodes from its routing table 
         closest to the provided node id
             @param value: node id for which K nearest nodes to find 
-            @type value: Kademlia.node.Node or integer, string representation 
+            @type value: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation 
             of 160-bit identifier computed through sha
-            @return: list of K nodes nearest to the provided id
+            @param count: number of nearest nodes to be returned
+            @type count: integer, default to K
+            @return: list of K nodes nearest to the provided id, closest first
             @raise Exception: if value provided is not of suitable type 
         """  
-        #check if nodeId has a valid type
-        if isinstance(value, str):
-            num = computeIntHash(value)
-        elif isinstance(value, Node):
-            num = value.nodeId
-        elif isinstance(value, int):
-            num = value
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        num = self.intValue(value)
+        health = self.health
+        if health is not None:
+            # the cheaper peers at the cut off distance may come from just beyond it
+            wanted = count
+            count = 2 * count
+        cache = self.findCache
+        if cache is not None:
+            peers = cache.get((num, count))
+            if peers is None:
+                packed = self.packed(count)
+                if packed is not None:
+                    peers = packed.closest(num, count)
+                    # a ranking of all peers depends on every bucket
+                    visited = self.bucketList
+                else:
+                    visited = []
+                    peers = closestInBuckets(self.bucketList, self.bucketIndexForInt(num), num, count, visited)
+                cache.put((num, count), peers, visited)
         else:
-            raise Exception("findNodes expects integer, string, or Node argument")
-            
-        nodes = []
-        bucketIndex = self.bucketIndexForInt(num)
-        nodes = nodes + self.bucketList[bucketIndex].peerList
-        
-        if len(nodes) < K:
-            # need more nodes
-            minValue = bucketIndex - 1
-            maxValue = bucketIndex + 1
-            while len(nodes) < K and (minValue >= 0 or maxValue < len(self.bucketList)):
-                if minValue >= 0:
-                    nodes = nodes + self.bucketList[minValue].getPeers(K - len(nodes), self.node.nodeId, True)
-                    minValue = minValue - 1
-                if maxValue < len(self.bucketList):
-                    nodes = nodes + self.bucketList[maxValue].getPeers(K - len(nodes), self.node.nodeId, False)
-                    maxValue = maxValue + 1
-        nodes.sort()           
-        return nodes[0:K]
+            packed = self.packed(count)
+            if packed is not None:
+                peers = packed.closest(num, count)
+            else:
+                peers = closestInBuckets(self.bucketList, self.bucketIndexForInt(num), num, count)
+        if health is not None:
+            peers = health.order(peers, num)[:wanted]
+        if metrics is not None:
+            metrics.findNodes.observe(time.perf_counter() - start)
+        return peers
+    
+    def findNodesMany(self, targets, count=K):
+        """ 
+        returns the K closest nodes for every one of the provided node ids.
+        Targets are visited in sorted order, so the bucket of every target
+        is found in a single sweep over the bucket list
+            @param targets: node ids for which K nearest nodes to find 
+            @type targets: list of Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation 
+            of 160-bit identifier computed through sha
+            @param count: number of nearest nodes to be returned per target
+            @type count: integer, default to K
+            @return: list with the list of nearest nodes for each target, in the order of targets
+            @raise Exception: if any value provided is not of suitable type 
+        """  
+        nums = [self.intValue(value) for value in targets]
+        packed = self.packed(count)
+        if packed is not None:
+            return packed.closestMany(nums, count)
+        results = [None] * len(nums)
+        bucketIndex = 0
+        for position in sorted(range(len(nums)), key=nums.__getitem__):
+            num = nums[position]
+            while bucketIndex < len(self.bucketList) and num >= self.bucketList[bucketIndex].maxValue:
+                bucketIndex += 1
+            if bucketIndex == len(self.bucketList):
+                bucketIndex = -1
+            results[position] = closestInBuckets(self.bucketList, bucketIndex, num, count)
+        return results
+    
+    def packed(self, count):
+        """ 
+        returns the packed ids of all peers when a vectorized ranking of
+        count nodes beats walking the buckets, that is when NumPy is
+        installed, the window is large and the table is large
+            @param count: number of nearest nodes to be returned
+            @type count: integer
+            @return: Kademlia.distanceRank.PackedIds or None
+        """  
+        if numpy is None or count < VECTOR_WINDOW:
+            return None
+        if self.packedPeers is None:
+            peers = self.allPeers()
+            if len(peers) < VECTOR_THRESHOLD:
+                return None
+            self.packedPeers = PackedIds(peers)
+        return self.packedPeers
+    
+    def iterClosest(self, value):
+        """ 
+        yields the peers of the routing table in increasing distance to
+        the provided node id. A heap holds ranked peers and the id ranges
+        not looked at yet, each range keyed by the smallest distance any
+        id in it can have, so a bucket is only ranked when the iterator
+        reaches it. Buckets are looked up again at every step and every
+        range is taken once, so peers may be added or removed while
+        iterating: a peer added to a range already taken is not yielded,
+        and a removed peer already ranked still is
+            @param value: node id for which nearest nodes to find 
+            @type value: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation 
+            of 160-bit identifier computed through sha
+            @return: generator of peers, closest first
+        """  
+        num = self.intValue(value)
+        end = pow(2, HASH_SIZE)
+        # items are (distance, 0, peer) for peers and (bound, 1, minValue, maxValue) for ranges,
+        # distances of distinct peers never tie, and a range never ties with a peer inside it
+        heap = [(minDistanceInRange(num, 0, end), 1, 0, end)]
+        while heap:
+            item = heapq.heappop(heap)
+            if item[1] == 0:
+                yield item[2]
+                continue
+            bound, kind, low, high = item
+            # rank the bucket holding the closest id of the range
+            bucket = self.bucketList[self.bucketIndexForInt(num ^ bound)]
+            start = max(low, bucket.minValue)
+            stop = min(high, bucket.maxValue)
+            for nodeId, peer in list(bucket.peers.items()):
+                if start <= nodeId < stop:
+                    heapq.heappush(heap, (nodeId ^ num, 0, peer))
+            if low < start:
+                heapq.heappush(heap, (minDistanceInRange(num, low, start), 1, low, start))
+            if stop < high:
+                heapq.heappush(heap, (minDistanceInRange(num, stop, high), 1, stop, high))
+    
+    def allPeers(self):
+        """ 
+        returns the list of all peers in the routing table
+        """  
+        return [peer for bucket in self.bucketList for peer in bucket.peers.values()]
+    
+    def intValue(self, value):
+        """ 
+        returns the integer representation of the provided node id
+            @param value: node id to be converted
+            @type value: Kademlia.node.Node, Kademlia.contact.Contact or integer, string representation 
+            of 160-bit identifier computed through sha
+            @return: integer representation of the node id
+            @raise Exception: if value provided is not of suitable type 
+        """  
+        if isinstance(value, int):
+            return value
+        elif isinstance(value, (Node, Contact)):
+            return value.nodeId
+        elif isinstance(value, bytes):
+            return int.from_bytes(value, 'big')
+        elif isinstance(value, str):
+            return computeIntHash(value)
+        raise Exception("findNodes expects integer, string, or Node argument")
         
     def splitBucket(self, bucket):
         """ 
@@ -87,20 +389,58 @@ class RoutingTable:
             @param bucket: Bucket object of the bucket to be split 
             @type bucket: Kademlia.bucket.Bucket  
         """   
-        bucket.peerList.sort()
-        mid = bucket.peerList[int(BUCKET_SIZE/2)].nodeId
+        if self.digitBits is not None:
+            self.splitDigit(bucket)
+            return
+        mid = sorted(bucket.peers)[int(BUCKET_SIZE/2)]
         newBucket = Bucket(mid, bucket.maxValue)
-        bucket.maxValue = mid - 1
-        self.bucketList.insert(self.bucketList.index(bucket) + 1, newBucket)
+        newBucket.lastAccessed = bucket.lastAccessed
+        # ranges are half open, so bucket now covers [minValue, mid)
+        bucket.maxValue = mid
+        index = self.bucketIndexForInt(bucket.minValue) + 1
+        self.bucketList.insert(index, newBucket)
+        self.bucketBoundaries.insert(index, mid)
         
         # transfer nodes from bucket to newBucket
-        for peer in bucket.peerList:
-            if peer.nodeId > bucket.maxValue:
-                newBucket.addPeer(peer)
-                
-        # remove the transferred nodes from the old bucket
-        for peer in newBucket.peerList:
-            bucket.removePeer(peer)
+        bucket.transferPeers(newBucket)
+        if self.metrics is not None:
+            self.metrics.splits.inc()
+        
+    def splitDigit(self, bucket):
+        """ 
+        splits the bucket of the node's own id by the next digit of the
+        ids, into 2**digitBits buckets of equal range, or fewer when less
+        than digitBits bits of the range are left
+            @param bucket: Bucket object of the bucket to be split 
+            @type bucket: Kademlia.bucket.Bucket  
+        """   
+        width = bucket.maxValue - bucket.minValue
+        parts = 1 << min(self.digitBits, width.bit_length() - 1)
+        step = width // parts
+        index = self.bucketIndexForInt(bucket.minValue) + 1
+        newBuckets = [Bucket(bucket.minValue + i * step, bucket.minValue + (i + 1) * step) for i in range(1, parts)]
+        bucket.maxValue = bucket.minValue + step
+        self.bucketList[index:index] = newBuckets
+        self.bucketBoundaries[index:index] = [newBucket.minValue for newBucket in newBuckets]
+        for newBucket in newBuckets:
+            newBucket.lastAccessed = bucket.lastAccessed
+            bucket.transferPeers(newBucket)
+        if self.metrics is not None:
+            self.metrics.splits.inc()
+
+    def canSplit(self, bucket):
+        """ 
+        checks whether a full bucket may be split. Median splits go on
+        until the table has HASH_SIZE buckets, digit splits only apply
+        to the bucket of the node's own id, as long as it covers more
+        than one id
+            @param bucket: full bucket
+            @type bucket: Kademlia.bucket.Bucket
+            @return: boolean value true or false
+        """  
+        if self.digitBits is None:
+            return len(self.bucketList) < HASH_SIZE
+        return bucket.minValue <= self.node.nodeId < bucket.maxValue and bucket.maxValue - bucket.minValue > 1
         
     def addPeer(self, peer):
         """
@@ -109,8 +449,11 @@ class RoutingTable:
         Different Scenarios:
             - If it is the node itself, that routing table belongs to,
               simply return
-            - If while adding to the list, the exception is received because
-              bucket is full, the buckets are split
+            - If the bucket is full, the buckets are split
+            - If the bucket is full and cannot be split, as the table has
+              reached HASH_SIZE buckets or, with digits, the bucket does
+              not hold the node's own id, the peer is kept as a
+              replacement candidate
         @param peer: peer to be added to the bucket's peerList
         @type peer: Kademlia.node.Node
         """
@@ -119,22 +462,98 @@ class RoutingTable:
             return
         
         # get the bucket for this node
-        bucketIndex = self. bucketIndexForInt(peer.nodeId)
-        # check to see if node is in the bucket already
-        try:
-            self.bucketList[bucketIndex].addPeer(peer)
-        except Exception:
-            if(self.bucketList[bucketIndex].minValue <= peer.nodeId < self.bucketList[bucketIndex].maxValue):
-                self.splitBucket(self.bucketList[bucketIndex])
-                self.addPeer(peer)
-            elif len(self.bucketList) >= HASH_SIZE:
-                # our table is FULL, this is really unlikely
-                print("Hash Table is FULL!  Increase K!")
+        bucketIndex = self.bucketIndexForInt(peer.nodeId)
+        metrics = self.metrics
+        if bucketIndex < 0:
+            if metrics is not None:
+                metrics.invalid.inc()
+            return
+        bucket = self.bucketList[bucketIndex]
+        known = bucket.peers.get(peer.nodeId)
+        if known is not peer:
+            # a new peer, or a new contact object of a known one
+            self.packedPeers = None
+        while not bucket.addPeer(peer):
+            if not self.canSplit(bucket):
+                # our table is FULL, this is really unlikely without digits
+                if metrics is not None:
+                    metrics.rejections.inc()
+                    if len(bucket.replacementCache) >= REPLACEMENT_CACHE_SIZE and peer.nodeId not in bucket.replacementCache:
+                        metrics.evictions.inc()
+                bucket.addReplacement(peer)
                 return
+            self.splitBucket(bucket)
+            bucket = self.bucketList[self.bucketIndexForInt(peer.nodeId)]
+        bucket.lastAccessed = self.clock()
+        if metrics is not None:
+            if known is not None:
+                metrics.touches.inc()
             else:
-                print("Invalid peer id, not in hash range "+str(peer.nodeId))
-                return
+                metrics.inserts.inc()
             
+    def bulkLoad(self, peers):
+        """
+        adds many peers at once, such as a crawl dump or a peer exchange
+        response. The peers are sorted once by id and the buckets are laid
+        out directly, giving the table addPeer would build from the peers
+        in increasing id order: every split of a bucket filled in id order
+        leaves its BUCKET_SIZE/2 smallest peers behind, and once the table
+        has HASH_SIZE buckets the rest are replacement candidates of the
+        last one. A table that already has peers, or uses digits, adds
+        them one by one
+            @param peers: peers to be added
+            @type peers: iterable of Kademlia.node.Node or Kademlia.contact.Contact
+        """
+        if self.digitBits is not None or len(self.bucketList) > 1 or self.bucketList[0].peers or self.bucketList[0].replacementCache:
+            for peer in sorted(peers, key=lambda peer: peer.nodeId):
+                self.addPeer(peer)
+            return
+        metrics = self.metrics
+        own = self.node.nodeId
+        limit = self.bucketList[0].maxValue
+        # a peer seen twice keeps its last object, as a touch would
+        byId = {}
+        for peer in peers:
+            nodeId = peer.nodeId
+            assert nodeId != None
+            if 0 <= nodeId < limit:
+                byId[nodeId] = peer
+            elif metrics is not None:
+                metrics.invalid.inc()
+        byId.pop(own, None)
+        if not byId:
+            return
+        ids = sorted(byId)
+        half = int(BUCKET_SIZE/2)
+        now = self.clock()
+        first = self.bucketList[0]
+        buckets = [first]
+        boundaries = [first.minValue]
+        start = 0
+        while len(ids) - start > BUCKET_SIZE and len(buckets) < HASH_SIZE:
+            mid = ids[start + half]
+            bucket = buckets[-1]
+            bucket.maxValue = mid
+            bucket.peers.update((key, byId[key]) for key in ids[start:start + half])
+            buckets.append(Bucket(mid, limit))
+            boundaries.append(mid)
+            start += half
+        last = buckets[-1]
+        last.peers.update((key, byId[key]) for key in ids[start:start + BUCKET_SIZE])
+        overflow = ids[start + BUCKET_SIZE:]
+        last.replacementCache.update((key, byId[key]) for key in overflow[-REPLACEMENT_CACHE_SIZE:])
+        for bucket in buckets:
+            bucket.lastAccessed = now
+            bucket.generation += 1
+        self.bucketList = buckets
+        self.bucketBoundaries = boundaries
+        self.packedPeers = None
+        if metrics is not None:
+            metrics.inserts.inc(len(ids) - len(overflow))
+            metrics.splits.inc(len(buckets) - 1)
+            metrics.rejections.inc(len(overflow))
+            metrics.evictions.inc(max(0, len(overflow) - REPLACEMENT_CACHE_SIZE))
+
     def removePeer(self, peer):
         """
         remove the node from the routing Table
@@ -147,34 +566,50 @@ class RoutingTable:
             return
         
         # get the bucket for this node
-        bucketIndex = self. bucketIndexForInt(peer.nodeId)
-        #print("delete: "+str(bucketIndex))
+        bucketIndex = self.bucketIndexForInt(peer.nodeId)
+        if bucketIndex < 0:
+            return
         # check to see if node is in the bucket already
+        self.packedPeers = None
         try:
             self.bucketList[bucketIndex].removePeer(peer)
         except Exception:
-            #print("Exception - doesn't exist")
             pass       
    
-    def replaceDeadNode(self, dead, new):
+    def replaceDeadNode(self, dead, new=None):
         """
-        replace the dead node with the new node. It is generally required 
-        when the routing table has reached its limit
+        replace the dead node with the new node, or with the most recently
+        seen replacement candidate of its bucket when no new node is given. 
+        It is generally required when the routing table has reached its limit.
+        With peer health enabled every call counts as one missed timeout, and
+        the node is only replaced once it missed FAILURE_LIMIT in a row
         @param dead: node object to be removed
         @type dead: Kademlia.node.Node 
         @param new: node object to be added
-        @type new: Kademlia.node.Node 
+        @type new: Kademlia.node.Node, default to None
         """
         # Replace dead node with new node
         bucketIndex = self.bucketIndexForInt(dead.nodeId)
+        if bucketIndex < 0:
+            return
+        health = self.health
+        if health is not None and not health.failure(dead):
+            return
+        bucket = self.bucketList[bucketIndex]
         try:
-            peer = self.bucketList[bucketIndex].getPeer(dead)
+            bucket.removePeer(dead)
         except ValueError:
             return
-    
-        self.bucketList[bucketIndex].removePeer(peer)
+        if health is not None:
+            health.forget(dead)
+        self.packedPeers = None
+        if self.metrics is not None:
+            self.metrics.replacements.inc()
         if new:
-            self.bucketList[bucketIndex].addPeer(new)
+            # the new node may belong to another bucket, or be our own node
+            self.addPeer(new)
+        else:
+            bucket.promoteReplacement()
             
     def printBucketList(self):
         """
@@ -237,4 +672,201 @@ class TestRoutingTable(unittest.TestCase):
         for node in peerNew:
             print(node.processId)
         temp = routingTable.randomPeer()
-        print("Random: "+str(temp.processId))
\ No newline at end of file
+        print("Random: "+str(temp.processId))
+    def test_closest(self):
+        """
+        tests routing table module to return the closest nodes by XOR distance
+        """
+        routingTable = RoutingTable(Node(7))
+        peers = [Node(i) for i in range(200 + VECTOR_THRESHOLD)]
+        for peer in peers:
+            routingTable.addPeer(peer)
+        known = routingTable.allPeers()
+        targets = [Node(i).nodeId for i in range(50)] + [peer.nodeId for peer in known[:10]]
+        for target in targets:
+            expected = sorted(known, key=lambda peer: peer.nodeId ^ target)
+            self.assertEqual(routingTable.findNodes(target), expected[:K])
+            self.assertEqual(routingTable.findNodes(target, 40), expected[:40])
+            self.assertEqual(routingTable.findNodes(target, VECTOR_THRESHOLD), expected[:VECTOR_THRESHOLD])
+        self.assertEqual(routingTable.findNodesMany(targets), [routingTable.findNodes(target) for target in targets])
+        self.assertEqual(routingTable.findNodesMany(targets, VECTOR_WINDOW), [sorted(known, key=lambda peer: peer.nodeId ^ target)[:VECTOR_WINDOW] for target in targets])
+        removed = known[0]
+        routingTable.removePeer(removed)
+        self.assertFalse(removed in routingTable.findNodes(removed, VECTOR_THRESHOLD))
+        self.assertEqual(RoutingTable(Node(1)).findNodes(targets[0]), [])
+
+    def test_iterClosest(self):
+        """
+        tests routing table module for lazily iterating peers by distance under mutations
+        """
+        routingTable = RoutingTable(Node(0))
+        self.assertEqual(list(routingTable.iterClosest(Node(1))), [])
+        peers = [Node(i) for i in range(1, 300)]
+        for peer in peers:
+            routingTable.addPeer(peer)
+        known = routingTable.allPeers()
+        for i in range(10):
+            target = Node(1000 + i).nodeId
+            self.assertEqual(list(routingTable.iterClosest(target)), sorted(known, key=lambda peer: peer.nodeId ^ target))
+        target = Node(2000).nodeId
+        iterator = routingTable.iterClosest(target)
+        seen = [next(iterator) for i in range(K)]
+        self.assertEqual(seen, routingTable.findNodes(target))
+        # the far buckets were not ranked yet, so peers added there are still found
+        added = [Node(i) for i in range(300, 600)]
+        for peer in added:
+            routingTable.addPeer(peer)
+        for peer in known[::4]:
+            routingTable.removePeer(peer)
+        seen.extend(iterator)
+        distances = [peer.nodeId ^ target for peer in seen]
+        self.assertEqual(distances, sorted(set(distances)))
+        self.assertTrue(any(peer in seen for peer in added))
+
+    def test_replace(self):
+        """
+        tests routing table module to promote replacement candidates for dead nodes
+        """
+        routingTable = RoutingTable(Node(0))
+        for i in range(1, 40):
+            routingTable.addPeer(Node(i))
+        dead = routingTable.randomPeer()
+        bucket = routingTable.bucketList[routingTable.bucketIndexForInt(dead.nodeId)]
+        candidate = Node(100)
+        # bucket bounds are ids of split peers, so skip ids already in the bucket
+        candidate.nodeId = next(i for i in range(bucket.minValue, bucket.maxValue) if i not in bucket)
+        bucket.addReplacement(candidate)
+        routingTable.replaceDeadNode(dead)
+        self.assertFalse(dead in bucket)
+        self.assertTrue(candidate in bucket)
+        self.assertEqual(len(bucket.replacementCache), 0)
+        # a new node outside the dead node's bucket goes to its own bucket
+        dead = next(peer for peer in bucket.peers.values())
+        outside = Node(101)
+        other = next(other for other in routingTable.bucketList if other is not bucket)
+        outside.nodeId = next(i for i in range(other.minValue, other.maxValue) if i not in other)
+        routingTable.replaceDeadNode(dead, outside)
+        self.assertFalse(dead in bucket)
+        self.assertFalse(outside in bucket)
+        other = routingTable.bucketList[routingTable.bucketIndexForInt(outside.nodeId)]
+        self.assertTrue(outside in other or outside.nodeId in other.replacementCache)
+        for bucket in routingTable.bucketList:
+            self.assertTrue(all(bucket.minValue <= peer.nodeId < bucket.maxValue for peer in bucket.peers.values()))
+        dead = routingTable.randomPeer()
+        routingTable.replaceDeadNode(dead, routingTable.node)
+        self.assertFalse(routingTable.node in routingTable.allPeers())
+        
+    def test_cache(self):
+        """
+        tests routing table module for cached results equal to fresh ones under mutations
+        """
+        cached = RoutingTable(Node(0))
+        cached.enableCache(64)
+        plain = RoutingTable(cached.node)
+        peers = [Node(i) for i in range(1, 400)]
+        targets = [Node(1000 + i).nodeId for i in range(20)]
+        for i, peer in enumerate(peers):
+            cached.addPeer(peer)
+            plain.addPeer(peer)
+            if i % 7 == 0:
+                cached.removePeer(peers[i // 2])
+                plain.removePeer(peers[i // 2])
+            if i % 11 == 0:
+                cached.replaceDeadNode(peers[i // 3])
+                plain.replaceDeadNode(peers[i // 3])
+            for target in targets[:i % 20 + 1]:
+                self.assertEqual(cached.findNodes(target), plain.findNodes(target))
+            for count in (K, VECTOR_WINDOW):
+                self.assertEqual(cached.findNodes(targets[0], count), plain.findNodes(targets[0], count))
+        stats = cached.cacheStats()
+        self.assertTrue(stats['hits'] > stats['misses'] > 0)
+        self.assertTrue(stats['invalidations'] > 0)
+        self.assertTrue(stats['size'] <= 64)
+        # a change far from the target keeps its entry valid
+        target = cached.bucketList[0].minValue
+        cached.findNodes(target)
+        hits = cached.cacheStats()['hits']
+        last = cached.bucketList[-1]
+        if last.peers:
+            cached.removePeer(next(iter(last.peers.values())))
+        cached.findNodes(target)
+        self.assertEqual(cached.cacheStats()['hits'], hits + 1)
+        self.assertEqual(plain.cacheStats(), None)
+
+    def test_newContact(self):
+        """
+        tests routing table module for a known peer coming back with a new contact
+        """
+        from contact import Contact
+        from hash import newID
+        for cache in (False, True):
+            routingTable = RoutingTable(Contact(newID(), "127.0.0.1", 4000))
+            if cache:
+                routingTable.enableCache()
+            contacts = [Contact(newID(), "10.0.0.1", 5000) for i in range(VECTOR_THRESHOLD + 50)]
+            for contact in contacts:
+                routingTable.addPeer(contact)
+            target = contacts[7]
+            for count in (K, VECTOR_WINDOW):
+                self.assertTrue(routingTable.findNodes(target, count)[0] is target)
+            moved = Contact(target.id, "10.0.0.2", 6000)
+            routingTable.addPeer(moved)
+            for count in (K, VECTOR_WINDOW):
+                self.assertTrue(routingTable.findNodes(target, count)[0] is moved)
+
+    def test_digits(self):
+        """
+        tests routing table module for the accelerated layout of b-bit digits
+        """
+        for digitBits in (1, 3, 4):
+            node = Node(0)
+            routingTable = RoutingTable(node, digitBits)
+            peers = [Node(i) for i in range(1, 2000)]
+            for peer in peers:
+                routingTable.addPeer(peer)
+            own = routingTable.bucketList[routingTable.bucketIndexForInt(node.nodeId)]
+            self.assertEqual((len(routingTable.bucketList) - 1) % (2 ** digitBits - 1), 0)
+            self.assertEqual(routingTable.bucketBoundaries, [bucket.minValue for bucket in routingTable.bucketList])
+            for bucket in routingTable.bucketList:
+                width = bucket.maxValue - bucket.minValue
+                # every bucket is the range of one digit value at its level
+                self.assertEqual(width & (width - 1), 0)
+                self.assertEqual(bucket.minValue % width, 0)
+                self.assertTrue(len(bucket) <= BUCKET_SIZE)
+                if bucket is not own:
+                    # and shares all higher digits with the node's own id
+                    self.assertTrue((bucket.minValue ^ node.nodeId) >> (width.bit_length() - 1) < 2 ** digitBits)
+            known = routingTable.allPeers()
+            for i in range(20):
+                target = Node(5000 + i).nodeId
+                expected = sorted(known, key=lambda peer: peer.nodeId ^ target)
+                self.assertEqual(routingTable.findNodes(target, 20), expected[:20])
+            removed = known[0]
+            routingTable.removePeer(removed)
+            self.assertFalse(removed in routingTable.allPeers())
+
+    def test_bulkLoad(self):
+        """
+        tests routing table module for bulk loads equal to sequential inserts in id order
+        """
+        for count in (0, 10, 300, 2000):
+            node = Node(0)
+            peers = [Node(i) for i in range(count)] + [Node(i) for i in range(0, count, 3)] + [node]
+            bulk = RoutingTable(node)
+            bulk.bulkLoad(iter(peers))
+            sequential = RoutingTable(node)
+            for peer in sorted(peers, key=lambda peer: peer.nodeId):
+                sequential.addPeer(peer)
+            self.assertEqual(bulk.bucketBoundaries, sequential.bucketBoundaries)
+            for loaded, inserted in zip(bulk.bucketList, sequential.bucketList):
+                self.assertEqual((loaded.minValue, loaded.maxValue), (inserted.minValue, inserted.maxValue))
+                self.assertEqual(list(loaded.peers.items()), list(inserted.peers.items()))
+                self.assertEqual(list(loaded.replacementCache.items()), list(inserted.replacementCache.items()))
+        self.assertEqual(len(bulk.bucketList), HASH_SIZE)
+        self.assertEqual(bulk.findNodes(peers[5], 20), sequential.findNodes(peers[5], 20))
+        # a table with peers takes them one by one
+        extra = Node(count + 1)
+        bulk.bulkLoad([extra])
+        sequential.addPeer(extra)
+        self.assertEqual(bulk.allPeers(), sequential.allPeers())
+        self.assertEqual(list(bulk.bucketList[-1].replacementCache), list(sequential.bucketList[-1].replacementCache))
@@ -0,0 +1,390 @@
+"""
+- Module: It contains the hierarchical timer wheel and the maintenance scheduler of bucket refresh and republishing for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import STABLE, KVUPDATE, WHEEL_RESOLUTION, JITTER
+from hash import newIDInRange
+import asyncio
+import math
+import random
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+LEVELS = 4
+"""
+Every level of the wheel has SLOTS slots, a slot of level i spanning
+SLOTS**i ticks, so four levels cover 2**24 ticks before timers are parked
+in the top level and cascaded again
+"""
+
+class Timer:
+    """
+    It represents a pending callback of the timer wheel
+    """
+    __slots__ = ('wheel', 'tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, wheel, tick, callback, args):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param wheel: wheel the timer is scheduled on
+        @type wheel: Kademlia.scheduler.TimerWheel
+        @param tick: tick at which the callback runs
+        @type tick: integer
+        @param callback: function to be called
+        @type callback: function
+        @param args: arguments of the callback
+        @type args: tuple
+        """
+        self.wheel = wheel
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        keeps the callback from running, the timer is dropped from its
+        slot when the wheel reaches it
+        """
+        if not self.cancelled:
+            self.cancelled = True
+            self.wheel.pending -= 1
+
+class TimerWheel:
+    """
+    It represents a hierarchical timing wheel. Scheduling and cancelling
+    cost O(1), and every tick only touches the slot it reaches, timers of
+    the upper levels being cascaded down once per revolution of the level
+    below. It does not read any clock, the owner advances it to the
+    current time, so the same wheel runs on the event loop and under a
+    virtual clock
+    """
+    def __init__(self, resolution=WHEEL_RESOLUTION, start=0.0):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param resolution: seconds per tick
+        @type resolution: float, default to WHEEL_RESOLUTION
+        @param start: current time
+        @type start: float, default to 0.0
+        """
+        self.resolution = resolution
+        self.tick = int(start / resolution)
+        self.wheels = [[[] for slot in range(SLOTS)] for level in range(LEVELS)]
+        # timers held by every level, cancelled ones included
+        self.sizes = [0] * LEVELS
+        self.pending = 0
+
+    def __len__(self):
+        """
+        returns the number of pending timers
+        """
+        return self.pending
+
+    @property
+    def time(self):
+        """
+        returns the time the wheel has been advanced to
+        """
+        return self.tick * self.resolution
+
+    def schedule(self, when, callback, *args):
+        """
+        runs the callback with the arguments once the wheel reaches the time.
+        A time already reached runs on the next tick
+        @param when: time at which the callback runs
+        @type when: float
+        @param callback: function to be called
+        @type callback: function
+        @return: Kademlia.scheduler.Timer
+        """
+        timer = Timer(self, max(int(math.ceil(when / self.resolution)), self.tick + 1), callback, args)
+        self.pending += 1
+        self.insert(timer)
+        return timer
+
+    def insert(self, timer):
+        """
+        places the timer in the lowest level whose span covers its delay
+        @param timer: timer to be placed
+        @type timer: Kademlia.scheduler.Timer
+        """
+        delay = timer.tick - self.tick
+        level = 0
+        while level < LEVELS - 1 and delay >= 1 << (SLOT_BITS * (level + 1)):
+            level += 1
+        self.wheels[level][(timer.tick >> (SLOT_BITS * level)) & (SLOTS - 1)].append(timer)
+        self.sizes[level] += 1
+
+    def advance(self, now):
+        """
+        runs the callbacks of all timers due up to the time, in order of
+        their ticks. Ticks where no slot can be due are skipped, up to the
+        next cascade of the lowest level holding timers
+        @param now: current time
+        @type now: float
+        @return: number of callbacks run
+        """
+        target = int(now / self.resolution)
+        fired = 0
+        while self.tick < target:
+            if not self.pending:
+                self.tick = target
+                break
+            lowest = 0
+            while not self.sizes[lowest]:
+                lowest += 1
+            if lowest:
+                span = 1 << (SLOT_BITS * lowest)
+                # nothing is due before the next slot of the lowest level cascades
+                self.tick = min(target - 1, (self.tick | (span - 1)))
+            self.tick += 1
+            tick = self.tick
+            level = 1
+            while level < LEVELS and tick & ((1 << (SLOT_BITS * level)) - 1) == 0:
+                level += 1
+            # cascade the upper slots whose span starts now, highest first
+            for upper in range(level - 1, 0, -1):
+                slot = (tick >> (SLOT_BITS * upper)) & (SLOTS - 1)
+                timers = self.wheels[upper][slot]
+                self.wheels[upper][slot] = []
+                self.sizes[upper] -= len(timers)
+                for timer in timers:
+                    if not timer.cancelled:
+                        self.insert(timer)
+            slot = tick & (SLOTS - 1)
+            timers = self.wheels[0][slot]
+            self.wheels[0][slot] = []
+            self.sizes[0] -= len(timers)
+            for timer in timers:
+                if timer.cancelled:
+                    continue
+                if timer.tick > tick:
+                    # parked beyond the span of the top level
+                    self.insert(timer)
+                    continue
+                timer.cancelled = True
+                self.pending -= 1
+                fired += 1
+                timer.callback(*timer.args)
+        return fired
+
+    async def run(self):
+        """
+        advances the wheel on the clock of the running event loop every
+        tick, a virtual loop included, until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.resolution)
+            self.advance(loop.time())
+
+class Maintenance:
+    """
+    It schedules the maintenance of one node on a timer wheel, which many
+    nodes of a host can share. Every bucket has one timer, due when the
+    bucket will have been idle for the refresh interval, and only buckets
+    still idle at that time are refreshed. Republishing runs at its own
+    interval. Every event gets a random jitter, so the nodes of a host
+    and the buckets of a node do not fire together
+    """
+    def __init__(self, routingTable, wheel, refresh, republish=None, interval=STABLE,
+                 republishInterval=KVUPDATE, jitter=JITTER, clock=None, rng=None):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param routingTable: routing table whose buckets are refreshed
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param wheel: timer wheel the events are scheduled on
+        @type wheel: Kademlia.scheduler.TimerWheel
+        @param refresh: function called with a random id of an idle bucket's range
+        @type refresh: function
+        @param republish: function called every republish interval
+        @type republish: function, default to None
+        @param interval: seconds of idleness after which a bucket is refreshed
+        @type interval: float, default to STABLE
+        @param republishInterval: seconds between two republish calls
+        @type republishInterval: float, default to KVUPDATE
+        @param jitter: largest random delay, as a fraction of the interval
+        @type jitter: float, default to JITTER
+        @param clock: function returning the current time
+        @type clock: function, default to the clock of the routing table
+        @param rng: random generator of the jitter and refresh ids
+        @type rng: random.Random
+        """
+        self.routingTable = routingTable
+        self.wheel = wheel
+        self.refresh = refresh
+        self.republish = republish
+        self.interval = interval
+        self.republishInterval = republishInterval
+        self.jitter = jitter
+        self.clock = clock if clock is not None else routingTable.clock
+        self.rng = rng if rng is not None else random.Random()
+        self.timers = {}
+        self.refreshed = 0
+
+    def delay(self, interval):
+        """
+        returns the interval stretched by a random jitter
+        """
+        return interval * (1 + self.rng.uniform(0, self.jitter))
+
+    def start(self):
+        """
+        schedules the timers of all buckets and of republishing
+        """
+        self.track()
+        if self.republish is not None:
+            self.wheel.schedule(self.clock() + self.delay(self.republishInterval), self.republishDue)
+
+    def stop(self):
+        """
+        cancels all timers of the node
+        """
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        self.republish = None
+
+    def track(self):
+        """
+        schedules a timer for every bucket that has none, which covers the
+        buckets created by splits since the last call
+        """
+        for bucket in self.routingTable.bucketList:
+            if id(bucket) not in self.timers:
+                self.scheduleBucket(bucket)
+
+    def scheduleBucket(self, bucket):
+        """
+        schedules the bucket's timer at the end of its idle interval
+        """
+        due = bucket.lastAccessed + self.delay(self.interval)
+        self.timers[id(bucket)] = self.wheel.schedule(due, self.bucketDue, bucket)
+
+    def bucketDue(self, bucket):
+        """
+        refreshes the bucket if it stayed idle, then schedules it again
+        """
+        now = self.clock()
+        if now - bucket.lastAccessed >= self.interval:
+            bucket.lastAccessed = now
+            self.refreshed += 1
+            self.refresh(newIDInRange(bucket.minValue, bucket.maxValue))
+        self.scheduleBucket(bucket)
+        self.track()
+
+    def republishDue(self):
+        """
+        runs republishing and schedules its next run
+        """
+        if self.republish is None:
+            return
+        self.republish()
+        self.wheel.schedule(self.clock() + self.delay(self.republishInterval), self.republishDue)
+
+def maintainEngine(engine, wheel, storage=None, **options):
+    """
+    returns the started maintenance of a lookup engine's node on the
+    running event loop, refreshing buckets through lookups and
+    republishing the values of the storage
+    @param engine: lookup engine of the node
+    @type engine: Kademlia.lookup.LookupEngine
+    @param wheel: timer wheel the events are scheduled on
+    @type wheel: Kademlia.scheduler.TimerWheel
+    @param storage: values republished by the node
+    @type storage: Kademlia.storage.Storage, default to None
+    @return: Kademlia.scheduler.Maintenance
+    """
+    loop = asyncio.get_running_loop()
+    refresh = lambda target: loop.create_task(engine.findNode(target))
+    republish = None
+    if storage is not None:
+        republish = lambda: loop.create_task(storage.republish(engine.routingTable, engine.transport))
+    maintenance = Maintenance(engine.routingTable, wheel, refresh, republish, clock=loop.time, **options)
+    maintenance.start()
+    return maintenance
+
+### Test Scenarios ###
+import unittest
+import time
+from node import Node
+from routingTable import RoutingTable
+
+class TestScheduler(unittest.TestCase):
+    """
+    It represents the test class to test the scheduler module
+    for timer order and idle bucket refresh
+    """
+    def test_wheel(self):
+        """
+        tests the timer wheel for firing every timer at its tick across all levels
+        """
+        wheel = TimerWheel(1.0)
+        rng = random.Random(3)
+        fired = []
+        expected = []
+        timers = []
+        for i in range(3000):
+            when = rng.choice([rng.randrange(1, 64), rng.randrange(64, 5000), rng.randrange(5000, 300000), 2 ** 25 + i])
+            timers.append(wheel.schedule(when, lambda when: fired.append((wheel.time, when)), when))
+            expected.append(when)
+        for timer in timers[::7]:
+            timer.cancel()
+        cancelled = set(id(timer) for timer in timers[::7])
+        expected = sorted(when for timer, when in zip(timers, expected) if id(timer) not in cancelled)
+        self.assertEqual(len(wheel), len(expected))
+        wheel.advance(2 ** 26)
+        self.assertEqual([when for now, when in fired], expected)
+        self.assertTrue(all(now == when for now, when in fired))
+        self.assertEqual(len(wheel), 0)
+
+    def test_scale(self):
+        """
+        tests the timer wheel for a large number of pending timers
+        """
+        wheel = TimerWheel(1.0)
+        count = [0]
+        def callback():
+            count[0] += 1
+        start = time.perf_counter()
+        for i in range(200000):
+            wheel.schedule(1 + i % 3600, callback)
+        wheel.advance(3600)
+        self.assertEqual(count[0], 200000)
+        self.assertTrue(time.perf_counter() - start < 10)
+
+    def test_maintenance(self):
+        """
+        tests that only buckets idle for the refresh interval are refreshed
+        """
+        clock = [0.0]
+        routingTable = RoutingTable(Node(0))
+        routingTable.clock = lambda: clock[0]
+        for i in range(1, 60):
+            routingTable.addPeer(Node(i))
+        refreshed = []
+        wheel = TimerWheel(0.5)
+        maintenance = Maintenance(routingTable, wheel, refreshed.append, interval=30, clock=routingTable.clock, rng=random.Random(1))
+        maintenance.start()
+        active = routingTable.bucketList[0]
+        for second in range(1, 100):
+            clock[0] = float(second)
+            active.lastAccessed = clock[0]
+            wheel.advance(clock[0])
+        idle = [bucket for bucket in routingTable.bucketList if bucket is not active]
+        self.assertTrue(refreshed)
+        self.assertFalse(any(active.hashInRange(target) for target in refreshed))
+        for bucket in idle:
+            self.assertTrue(any(bucket.hashInRange(target) for target in refreshed))
+        # every idle bucket refreshed about every interval, at jittered times
+        self.assertTrue(len(idle) * 2 <= len(refreshed) <= len(idle) * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,634 @@
+"""
+- Module: It contains the discrete-event network simulator running virtual nodes on a virtual clock for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import HASH_SIZE, K, BUCKET_SIZE, TIMEOUT, HOT_READS
+from node import Node
+from routingTable import RoutingTable
+from lookup import LoopbackNetwork, LoopbackTransport, LookupEngine
+from storage import Storage
+from bisect import bisect_left, insort
+import asyncio
+import math
+import random
+import selectors
+
+class VirtualClockSelector:
+    """
+    It wraps the selector of an event loop. Sockets are only polled,
+    and instead of blocking until the next timer is due, the virtual
+    clock jumps straight to it
+    """
+    def __init__(self, loop):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param loop: event loop whose clock is advanced
+        @type loop: Kademlia.simulator.VirtualEventLoop
+        """
+        self.loop = loop
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        """
+        registers a file to be polled, see selectors.BaseSelector.register
+        """
+        return self.selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        """
+        stops polling a file, see selectors.BaseSelector.unregister
+        """
+        return self.selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        """
+        changes the events or data of a registered file, see selectors.BaseSelector.modify
+        """
+        return self.selector.modify(fileobj, events, data)
+
+    def get_key(self, fileobj):
+        """
+        returns the key of a registered file, see selectors.BaseSelector.get_key
+        """
+        return self.selector.get_key(fileobj)
+
+    def get_map(self):
+        """
+        returns the mapping of the registered files to their keys
+        """
+        return self.selector.get_map()
+
+    def close(self):
+        """
+        closes the wrapped selector
+        """
+        self.selector.close()
+
+    def select(self, timeout=None):
+        """
+        polls the registered files and advances the clock by timeout
+        when nothing is ready
+        @raise RuntimeError: if nothing is ready and no timer is scheduled
+        """
+        events = self.selector.select(0)
+        if not events:
+            if timeout is None:
+                raise RuntimeError("simulation deadlocked, no event is scheduled")
+            self.loop.now += timeout
+        return events
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    """
+    It represents an event loop whose time is virtual. Timers fire in
+    order without any wall clock sleep, so hours of simulated network
+    time pass in the time needed to process the events
+    """
+    def __init__(self):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        """
+        self.now = 0.0
+        super().__init__(VirtualClockSelector(self))
+
+    def time(self):
+        """
+        returns the virtual time in seconds
+        """
+        return self.now
+
+def constantLatency(delay):
+    """
+    returns a latency model where every message takes the same time
+    @param delay: one way delay in seconds
+    @type delay: float
+    @return: function of a random generator returning a delay
+    """
+    return lambda rng: delay
+
+def uniformLatency(low, high):
+    """
+    returns a latency model with delays uniform between two bounds
+    @param low: smallest one way delay in seconds
+    @type low: float
+    @param high: largest one way delay in seconds
+    @type high: float
+    @return: function of a random generator returning a delay
+    """
+    return lambda rng: rng.uniform(low, high)
+
+def lognormalLatency(median, sigma):
+    """
+    returns a latency model with log-normal delays, which have the long
+    tail seen on wide area networks
+    @param median: median one way delay in seconds
+    @type median: float
+    @param sigma: standard deviation of the logarithm of the delay
+    @type sigma: float
+    @return: function of a random generator returning a delay
+    """
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+def percentile(values, p):
+    """
+    returns the nearest-rank percentile of the values
+    @param values: sorted values
+    @type values: list of numbers
+    @param p: percentile from 0 to 100
+    @type p: float
+    @return: number, None for no values
+    """
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def zipfSampler(count, exponent, rng):
+    """
+    returns a function drawing ranks from 0 to count - 1, rank i with a
+    probability proportional to 1 / (i + 1) ** exponent
+    @param count: number of ranks
+    @type count: integer
+    @param exponent: skew of the distribution, 0 for uniform
+    @type exponent: float
+    @param rng: random generator
+    @type rng: random.Random
+    @return: function without arguments
+    """
+    cumulative = []
+    total = 0.0
+    for rank in range(count):
+        total += 1.0 / (rank + 1) ** exponent
+        cumulative.append(total)
+    return lambda: min(bisect_left(cumulative, rng.random() * total), count - 1)
+
+def closestId(ids, target):
+    """
+    returns the id closest to the target by XOR distance from a sorted
+    list. The ids sharing each further prefix bit with the target form a
+    contiguous slice, so the search narrows the slice one bit at a time
+    @param ids: sorted node ids
+    @type ids: list of integers
+    @param target: node id for which nearest id to find
+    @type target: integer
+    @return: integer, None for no ids
+    """
+    low, high = 0, len(ids)
+    if low == high:
+        return None
+    prefix = 0
+    for bit in range(HASH_SIZE - 1, -1, -1):
+        wanted = prefix | (target & (1 << bit))
+        other = wanted ^ (1 << bit)
+        start = bisect_left(ids, wanted, low, high)
+        end = bisect_left(ids, wanted + (1 << bit), low, high)
+        if start < end:
+            low, high, prefix = start, end, wanted
+        else:
+            prefix = other
+        if high - low == 1:
+            return ids[low]
+    return ids[low]
+
+class SimulatedNetwork(LoopbackNetwork):
+    """
+    It represents a simulated network, messages are delayed by a latency
+    model and dropped with a loss probability
+    """
+    def __init__(self, latency, loss=0.0, rng=None):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param latency: function of a random generator returning a one way delay
+        @type latency: function
+        @param loss: probability that a message is dropped
+        @type loss: float, default to 0.0
+        @param rng: random generator of the simulation
+        @type rng: random.Random
+        """
+        LoopbackNetwork.__init__(self)
+        self.latency = latency
+        self.loss = loss
+        self.rng = rng if rng is not None else random.Random()
+        self.messages = 0
+
+class SimulatedTransport(LoopbackTransport):
+    """
+    It represents the transport of one virtual node. A request and its
+    response each travel with a delay of the latency model, and either
+    may be lost, leaving the request to the lookup timeout
+    """
+    def __init__(self, network, routingTable):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param network: network the node joins
+        @type network: Kademlia.simulator.SimulatedNetwork
+        @param routingTable: routing table of the node
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        """
+        LoopbackTransport.__init__(self, network, routingTable)
+        self.values = Storage(clock=asyncio.get_running_loop().time)
+
+    async def remote(self, peer):
+        """
+        returns the transport of the peer after a round trip of the
+        latency model, a lost message or offline peer never answers
+        """
+        network = self.network
+        rng = network.rng
+        network.messages += 2
+        endpoint = network.endpoints.get(peer.nodeId)
+        await asyncio.sleep(network.latency(rng) + network.latency(rng))
+        if endpoint is None or not endpoint.online or (network.loss and rng.random() < 1 - (1 - network.loss) ** 2):
+            await asyncio.get_running_loop().create_future()
+        endpoint.routingTable.addPeer(self.routingTable.node)
+        return endpoint
+
+class SimulationStats:
+    """
+    It collects the outcome of the lookups of a simulation
+    """
+    def __init__(self):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        """
+        self.hops = []
+        self.latencies = []
+        self.successes = 0
+        self.queried = 0
+        self.failed = 0
+        self.messages = 0
+        self.events = []
+
+    def record(self, result, latency, success):
+        """
+        records one finished lookup
+        @param result: outcome of the lookup
+        @type result: Kademlia.lookup.LookupResult
+        @param latency: virtual seconds the lookup took
+        @type latency: float
+        @param success: whether the lookup found the closest online node
+        @type success: boolean
+        """
+        self.hops.append(result.hops)
+        self.latencies.append(latency)
+        self.successes += success
+        self.queried += result.queried
+        self.failed += result.failed
+
+    def summary(self):
+        """
+        returns the lookup count, success rate, hop counts and latency percentiles
+        @return: dictionary
+        """
+        lookups = len(self.latencies)
+        hops = sorted(self.hops)
+        latencies = sorted(self.latencies)
+        return {
+            'lookups': lookups,
+            'successRate': self.successes / lookups if lookups else None,
+            'meanHops': sum(hops) / lookups if lookups else None,
+            'maxHops': hops[-1] if hops else None,
+            'latencyP50': percentile(latencies, 50),
+            'latencyP90': percentile(latencies, 90),
+            'latencyP99': percentile(latencies, 99),
+            'requestsPerLookup': self.queried / lookups if lookups else None,
+            'timeouts': self.failed,
+            'messages': self.messages,
+        }
+
+class Simulator:
+    """
+    It represents a discrete-event simulation of a Kademlia network. All
+    virtual nodes, each with its own routing table and lookup engine, run
+    in one process on a virtual event loop. A churn script of joins,
+    crashes and rejoins and a random lookup workload are played on it
+    """
+    def __init__(self, size, latency=constantLatency(0.05), loss=0.0, seed=None, sample=64, timeout=TIMEOUT, alpha=K, cachePath=False):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param size: number of nodes at the start
+        @type size: integer
+        @param latency: function of a random generator returning a one way delay
+        @type latency: function, default to 50ms
+        @param loss: probability that a message is dropped
+        @type loss: float, default to 0.0
+        @param seed: seed of all random choices, ids included
+        @type seed: integer, default to None
+        @param sample: random peers every initial node knows besides its neighbours
+        @type sample: integer, default to 64
+        @param timeout: seconds after which a lookup request fails
+        @type timeout: float, default to TIMEOUT
+        @param alpha: maximum number of requests in flight per lookup
+        @type alpha: integer, default to K
+        @param cachePath: whether value lookups cache what they find along their path
+        @type cachePath: boolean, default to False
+        """
+        self.size = size
+        self.cachePath = cachePath
+        self.sample = sample
+        self.timeout = timeout
+        self.alpha = alpha
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.loss = loss
+        self.network = None
+        self.engines = {}
+        self.onlineIds = []
+        self.crashed = []
+        self.stats = None
+        self.tasks = set()
+        self.processIds = 0
+
+    def newEngine(self):
+        """
+        creates a virtual node with an empty routing table
+        @return: Kademlia.lookup.LookupEngine
+        """
+        node = Node(self.processIds)
+        self.processIds += 1
+        node.nodeId = self.rng.getrandbits(HASH_SIZE)
+        routingTable = RoutingTable(node)
+        engine = LookupEngine(routingTable, SimulatedTransport(self.network, routingTable), self.alpha, K, self.timeout, self.cachePath)
+        self.engines[node.nodeId] = engine
+        return engine
+
+    def populate(self):
+        """
+        creates the initial nodes and fills their routing tables directly,
+        every node learning its closest neighbours in id order and a
+        random sample of the network, instead of running size joins
+        """
+        engines = [self.newEngine() for i in range(self.size)]
+        engines.sort(key=lambda engine: engine.routingTable.node.nodeId)
+        nodes = [engine.routingTable.node for engine in engines]
+        for index, engine in enumerate(engines):
+            routingTable = engine.routingTable
+            for peer in nodes[max(0, index - BUCKET_SIZE):index + BUCKET_SIZE + 1]:
+                routingTable.addPeer(peer)
+            for peer in self.rng.sample(nodes, min(self.sample, len(nodes))):
+                routingTable.addPeer(peer)
+        self.onlineIds = [node.nodeId for node in nodes]
+
+    def spawn(self, coroutine):
+        """
+        runs the coroutine as a task of the simulation
+        """
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def join(self, count):
+        """
+        adds count new nodes, each bootstrapping from a random online node
+        through a lookup of its own id
+        """
+        for i in range(count):
+            if not self.onlineIds:
+                return
+            bootstrap = self.engines[self.rng.choice(self.onlineIds)].routingTable.node
+            engine = self.newEngine()
+            engine.routingTable.addPeer(bootstrap)
+            insort(self.onlineIds, engine.routingTable.node.nodeId)
+            self.spawn(engine.findNode(engine.routingTable.node))
+
+    def crash(self, count):
+        """
+        takes count random online nodes offline, keeping their state
+        """
+        for nodeId in self.rng.sample(self.onlineIds, min(count, len(self.onlineIds))):
+            self.engines[nodeId].transport.online = False
+            self.onlineIds.pop(bisect_left(self.onlineIds, nodeId))
+            self.crashed.append(nodeId)
+
+    def rejoin(self, count):
+        """
+        brings count crashed nodes back with the routing table they had,
+        each refreshing it through a lookup of its own id
+        """
+        self.rng.shuffle(self.crashed)
+        for i in range(min(count, len(self.crashed))):
+            nodeId = self.crashed.pop()
+            engine = self.engines[nodeId]
+            engine.transport.online = True
+            insort(self.onlineIds, nodeId)
+            self.spawn(engine.findNode(engine.routingTable.node))
+
+    async def lookup(self):
+        """
+        looks a random id up from a random online node and records whether
+        the closest node found is the closest online node of the network
+        """
+        engine = self.engines[self.rng.choice(self.onlineIds)]
+        target = self.rng.getrandbits(HASH_SIZE)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await engine.lookup(target)
+        ownId = engine.routingTable.node.nodeId
+        expected = closestId(self.onlineIds, target)
+        if expected == ownId:
+            # a lookup only returns other nodes
+            index = bisect_left(self.onlineIds, ownId)
+            expected = closestId(self.onlineIds[:index] + self.onlineIds[index + 1:], target)
+        success = bool(result.peers) and result.peers[0].nodeId == expected
+        self.stats.record(result, loop.time() - start, success)
+
+    async def workload(self, duration, rate):
+        """
+        starts lookups at random times, on average rate per second, until the duration passed
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if loop.time() >= duration:
+                return
+            if self.onlineIds:
+                self.spawn(self.lookup())
+
+    async def main(self, duration, script, rate):
+        """
+        plays the churn script and the workload, then waits for the
+        lookups still running
+        """
+        loop = asyncio.get_running_loop()
+        self.network = SimulatedNetwork(self.latency, self.loss, self.rng)
+        self.populate()
+        actions = {'join': self.join, 'crash': self.crash, 'rejoin': self.rejoin}
+        for when, action, count in script:
+            loop.call_at(when, actions[action], count)
+            self.stats.events.append((when, action, count))
+        if rate:
+            await self.workload(duration, rate)
+        else:
+            await asyncio.sleep(duration)
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+        self.stats.messages = self.network.messages
+
+    def run(self, duration, script=(), rate=1.0):
+        """
+        runs the simulation on a fresh virtual event loop
+        @param duration: virtual seconds to be simulated
+        @type duration: float
+        @param script: churn events, each a (time, action, count) tuple
+        with action 'join', 'crash' or 'rejoin'
+        @type script: list of tuples
+        @param rate: lookups started per virtual second
+        @type rate: float, default to 1.0
+        @return: Kademlia.simulator.SimulationStats
+        """
+        self.stats = SimulationStats()
+        loop = VirtualEventLoop()
+        try:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.main(duration, script, rate))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        return self.stats
+
+    async def hotKeys(self, keys, reads, exponent, rate, hotReads):
+        """
+        stores keys at their K closest nodes and reads them from random
+        nodes, the keys drawn from a Zipf distribution
+        """
+        self.network = SimulatedNetwork(self.latency, self.loss, self.rng)
+        self.populate()
+        values = []
+        for i in range(keys):
+            key = self.rng.getrandbits(HASH_SIZE)
+            closest = sorted(self.onlineIds, key=lambda nodeId: nodeId ^ key)[:K]
+            for nodeId in closest:
+                storage = self.engines[nodeId].transport.values
+                storage.hotReads = hotReads
+                storage.store(key, b"value %d" % i)
+            values.append(key)
+        for engine in self.engines.values():
+            engine.transport.values.hotReads = hotReads
+        draw = zipfSampler(keys, exponent, self.rng)
+        async def read(key):
+            loop = asyncio.get_running_loop()
+            engine = self.engines[self.rng.choice(self.onlineIds)]
+            start = loop.time()
+            result = await engine.lookup(key, True)
+            self.stats.record(result, loop.time() - start, result.value is not None)
+        for i in range(reads):
+            await asyncio.sleep(self.rng.expovariate(rate))
+            self.spawn(read(values[draw()]))
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+        # let the cached copies and replicas in flight land
+        await asyncio.sleep(2 * self.timeout)
+        self.stats.messages = self.network.messages
+
+    def runHotKeys(self, keys=100, reads=2000, exponent=1.0, rate=20.0, hotReads=HOT_READS):
+        """
+        runs a skewed read workload on a fresh virtual event loop and
+        measures the hops of the reads and the load they put on the nodes
+        @param keys: number of stored keys
+        @type keys: integer
+        @param reads: number of value lookups
+        @type reads: integer
+        @param exponent: exponent of the Zipf distribution of the keys read
+        @type exponent: float, default to 1.0
+        @param rate: reads started per virtual second
+        @type rate: float, default to 20.0
+        @param hotReads: reads after which a node replicates a key, None to never replicate
+        @type hotReads: integer, default to HOT_READS
+        @return: dictionary of the lookup summary with the mean and
+        largest number of FIND_VALUE requests served by a node
+        """
+        self.stats = SimulationStats()
+        loop = VirtualEventLoop()
+        try:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.hotKeys(keys, reads, exponent, rate, hotReads))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        loads = [engine.transport.served for engine in self.engines.values()]
+        summary = self.stats.summary()
+        summary['meanLoad'] = sum(loads) / len(loads)
+        summary['maxLoad'] = max(loads)
+        return summary
+
+### Test Scenarios ###
+import unittest
+import time
+
+class TestSimulator(unittest.TestCase):
+    """
+    It represents the test class to test the simulator module
+    for virtual time and lookup statistics
+    """
+    def test_virtualClock(self):
+        """
+        tests that virtual time passes without wall clock sleeps
+        """
+        loop = VirtualEventLoop()
+        try:
+            start = time.monotonic()
+            loop.run_until_complete(asyncio.sleep(3600))
+            self.assertTrue(loop.time() >= 3600)
+            self.assertTrue(time.monotonic() - start < 1)
+        finally:
+            loop.close()
+
+    def test_closestId(self):
+        """
+        tests the closest id search against a full scan
+        """
+        rng = random.Random(1)
+        ids = sorted(rng.getrandbits(HASH_SIZE) for i in range(300))
+        for i in range(100):
+            target = rng.getrandbits(HASH_SIZE)
+            self.assertEqual(closestId(ids, target), min(ids, key=lambda nodeId: nodeId ^ target))
+        self.assertEqual(closestId(ids, ids[7]), ids[7])
+
+    def test_simulation(self):
+        """
+        tests an hour of a network with churn and lossy links
+        """
+        simulator = Simulator(300, uniformLatency(0.01, 0.1), loss=0.01, seed=7)
+        script = [(600, 'crash', 60), (1200, 'join', 30), (1800, 'rejoin', 40)]
+        stats = simulator.run(3600, script, rate=0.1)
+        summary = stats.summary()
+        self.assertTrue(summary['lookups'] > 250)
+        self.assertTrue(summary['successRate'] > 0.8)
+        self.assertTrue(1 <= summary['meanHops'] <= 6)
+        self.assertTrue(summary['latencyP50'] <= summary['latencyP90'] <= summary['latencyP99'])
+        self.assertEqual(len(simulator.onlineIds), 300 - 60 + 30 + 40)
+
+    def test_hotKeys(self):
+        """
+        tests that path caching and hot key replication spread a skewed read load
+        """
+        draw = zipfSampler(10, 1.0, random.Random(1))
+        counts = [0] * 10
+        for i in range(5000):
+            counts[draw()] += 1
+        self.assertTrue(counts[0] > counts[1] > counts[9])
+        self.assertTrue(counts[0] > 5 * counts[9])
+        plain = Simulator(400, seed=5, sample=8, alpha=3).runHotKeys(40, 800, hotReads=None)
+        cached = Simulator(400, seed=5, sample=8, alpha=3, cachePath=True).runHotKeys(40, 800, hotReads=16)
+        self.assertTrue(cached['meanHops'] < plain['meanHops'])
+        self.assertTrue(cached['maxLoad'] < 0.75 * plain['maxLoad'])
+
+if __name__ == '__main__':
+    import sys
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    if len(sys.argv) > 2 and sys.argv[2] == 'hotkeys':
+        for cachePath, hotReads in ((False, None), (True, None), (True, HOT_READS)):
+            summary = Simulator(size, seed=1, sample=8, alpha=3, cachePath=cachePath).runHotKeys(100, 4000, 1.0, 20.0, hotReads)
+            print("cachePath=%s hotReads=%s  meanHops %.2f  meanLoad %.1f  maxLoad %d" % (cachePath, hotReads, summary['meanHops'], summary['meanLoad'], summary['maxLoad']))
+    else:
+        print(Simulator(size, seed=1).run(3600, [(900, 'crash', size // 10), (1800, 'rejoin', size // 20)], rate=1.0).summary())
@@ -0,0 +1,384 @@
+"""
+- Module: It contains the binary snapshot of the routing table used for warm restarts of Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import HASH_SIZE, K, TIMEOUT, SNAPSHOT_INTERVAL
+from bucket import Bucket
+from contact import ContactPool
+from distanceRank import idBytes
+from routingTable import RoutingTable
+import asyncio
+import mmap
+import os
+import socket
+import struct
+import time
+
+MAGIC = b'KADS'
+VERSION = 2
+"""
+Magic bytes and format version opening every snapshot
+"""
+
+HEADER = struct.Struct('!4sBBH20sI')
+"""
+Snapshot header - magic, version, bits per digit (0 without digits), bucket count, node id and contact count
+"""
+
+BUCKET = struct.Struct('!20sH')
+"""
+Packed bucket record - lower bound of its range and number of its contacts
+"""
+
+CONTACT = struct.Struct('!20s4sHd')
+"""
+Packed contact record - node id, IPv4 address, port and last seen time
+"""
+
+def dumps(routingTable):
+    """
+    packs the routing table into a snapshot. Buckets are written in
+    order, so the upper bound of every bucket is the lower bound of the
+    next one, and contacts follow bucket by bucket, least recently seen
+    first, so their order survives the restart
+    @param routingTable: routing table whose node and peers are contacts
+    @type routingTable: Kademlia.routingTable.RoutingTable
+    @return: byte string
+    """
+    buckets = routingTable.bucketList
+    parts = [HEADER.pack(MAGIC, VERSION, routingTable.digitBits or 0, len(buckets), idBytes(routingTable.node),
+                         sum(len(bucket) for bucket in buckets))]
+    for bucket in buckets:
+        parts.append(BUCKET.pack(bucket.minValue.to_bytes(20, 'big'), len(bucket)))
+    for bucket in buckets:
+        for peer in bucket.peers.values():
+            parts.append(CONTACT.pack(peer.id, socket.inet_aton(peer.address), peer.port, peer.lastSeen))
+    return b''.join(parts)
+
+def loads(data, node, pool=None, digitBits=None):
+    """
+    rebuilds a routing table from a snapshot in a single pass, the buckets
+    and their boundaries are set directly instead of being split again.
+    The boundaries have to start at 0 and strictly increase, and every
+    contact has to lie within the range of its bucket. Every bucket was
+    last accessed when its most recently seen contact was, so bucket
+    refreshes stay spread out after a restart instead of all being due
+    @param data: snapshot
+    @type data: bytes, memoryview or mmap
+    @param node: node the snapshot was taken for
+    @type node: Kademlia.contact.Contact
+    @param pool: pool the contacts are interned in
+    @type pool: Kademlia.contact.ContactPool
+    @param digitBits: bits per digit of the table's layout, see RoutingTable
+    @type digitBits: integer, default to None
+    @return: Kademlia.routingTable.RoutingTable
+    @raise ValueError: if the snapshot is malformed, belongs to another node or another digit layout
+    """
+    if pool is None:
+        pool = ContactPool()
+    view = memoryview(data)
+    try:
+        if len(view) < HEADER.size:
+            raise ValueError("snapshot is truncated")
+        magic, version, bits, bucketCount, nodeId, contactCount = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a routing table snapshot")
+        if nodeId != idBytes(node):
+            raise ValueError("snapshot belongs to another node")
+        if bits != (digitBits or 0):
+            raise ValueError("snapshot has another digit layout")
+        contactStart = HEADER.size + bucketCount * BUCKET.size
+        if bucketCount == 0 or len(view) != contactStart + contactCount * CONTACT.size:
+            raise ValueError("snapshot is truncated")
+        routingTable = RoutingTable(node, digitBits)
+        bucketList = []
+        sizes = []
+        for minValue, size in BUCKET.iter_unpack(view[HEADER.size:contactStart]):
+            minValue = int.from_bytes(minValue, 'big')
+            # the bisect over the boundaries needs them to tile the whole id space
+            if not bucketList and minValue != 0:
+                raise ValueError("first bucket does not start at 0")
+            if bucketList:
+                if minValue <= bucketList[-1].minValue:
+                    raise ValueError("bucket boundaries do not increase")
+                bucketList[-1].maxValue = minValue
+            bucketList.append(Bucket(minValue, pow(2, HASH_SIZE)))
+            sizes.append(size)
+        if sum(sizes) != contactCount:
+            raise ValueError("snapshot is truncated")
+        contacts = CONTACT.iter_unpack(view[contactStart:])
+        now = routingTable.clock()
+        wallNow = time.time()
+        for bucket, size in zip(bucketList, sizes):
+            newest = None
+            for i in range(size):
+                id, address, port, lastSeen = next(contacts)
+                nodeId = int.from_bytes(id, 'big')
+                if not bucket.minValue <= nodeId < bucket.maxValue:
+                    raise ValueError("contact lies outside of its bucket")
+                if nodeId in bucket.peers:
+                    raise ValueError("contact appears twice")
+                contact = pool.intern(id, socket.inet_ntoa(address), port)
+                contact.lastSeen = max(contact.lastSeen, lastSeen)
+                bucket.peers[nodeId] = contact
+                newest = lastSeen if newest is None else max(newest, lastSeen)
+            # lastSeen is wall time, the bucket activity runs on the table's clock
+            bucket.lastAccessed = now if newest is None else now - max(0.0, wallNow - newest)
+        routingTable.bucketList = bucketList
+        routingTable.bucketBoundaries = [bucket.minValue for bucket in bucketList]
+        return routingTable
+    finally:
+        view.release()
+
+def save(routingTable, path):
+    """
+    writes the snapshot of the routing table to the file. It is written
+    next to the file and renamed over it, so a crash never leaves a
+    partial snapshot behind
+    @param routingTable: routing table whose node and peers are contacts
+    @type routingTable: Kademlia.routingTable.RoutingTable
+    @param path: snapshot file
+    @type path: string
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(dumps(routingTable))
+    os.replace(temporary, path)
+
+def load(path, node, pool=None, digitBits=None):
+    """
+    rebuilds the routing table from the snapshot file, read through a
+    memory map instead of being copied into memory first
+    @param path: snapshot file
+    @type path: string
+    @param node: node the snapshot was taken for
+    @type node: Kademlia.contact.Contact
+    @param pool: pool the contacts are interned in
+    @type pool: Kademlia.contact.ContactPool
+    @param digitBits: bits per digit of the table's layout, see RoutingTable
+    @type digitBits: integer, default to None
+    @return: Kademlia.routingTable.RoutingTable
+    @raise ValueError: if the snapshot is malformed, belongs to another node or another digit layout
+    @raise OSError: if the file cannot be read
+    """
+    with open(path, 'rb') as snapshot:
+        if os.fstat(snapshot.fileno()).st_size == 0:
+            raise ValueError("snapshot is truncated")
+        with mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data, node, pool, digitBits)
+
+async def verify(routingTable, transport, peers=None, concurrency=K, timeout=TIMEOUT):
+    """
+    pings the contacts loaded from a snapshot, a few at a time, and
+    replaces the ones that no longer answer. It is meant to run in the
+    background while the node already serves from the loaded table
+    @param routingTable: routing table the contacts were loaded into
+    @type routingTable: Kademlia.routingTable.RoutingTable
+    @param transport: transport used to reach peers
+    @type transport: Kademlia.lookup.Transport
+    @param peers: contacts to be checked
+    @type peers: list of Kademlia.contact.Contact, default to all peers
+    @param concurrency: maximum number of pings in flight
+    @type concurrency: integer, default to K
+    @param timeout: seconds after which a contact is considered dead
+    @type timeout: float, default to TIMEOUT
+    @return: list of contacts removed
+    """
+    if peers is None:
+        peers = routingTable.allPeers()
+    semaphore = asyncio.Semaphore(concurrency)
+    dead = []
+
+    async def check(peer):
+        async with semaphore:
+            try:
+                await asyncio.wait_for(transport.ping(peer), timeout)
+            except (asyncio.TimeoutError, OSError):
+                dead.append(peer)
+                routingTable.replaceDeadNode(peer)
+
+    await asyncio.gather(*[check(peer) for peer in peers])
+    return dead
+
+class SnapshotSaver:
+    """
+    It saves the snapshot of a routing table at a fixed interval while the
+    node runs, and once more when the node shuts down
+    """
+    def __init__(self, routingTable, path, interval=SNAPSHOT_INTERVAL):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param routingTable: routing table to be saved
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param path: snapshot file
+        @type path: string
+        @param interval: seconds between two snapshots
+        @type interval: float, default to SNAPSHOT_INTERVAL
+        """
+        self.routingTable = routingTable
+        self.path = path
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        """
+        starts saving in the background of the running event loop
+        """
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        """
+        saves the snapshot every interval until cancelled
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            save(self.routingTable, self.path)
+
+    async def close(self):
+        """
+        stops the timer and saves the final snapshot
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        save(self.routingTable, self.path)
+
+### Test Scenarios ###
+import unittest
+import tempfile
+from contact import Contact
+from lookup import LoopbackNetwork, LoopbackTransport
+from hash import newID
+
+class TestSnapshot(unittest.TestCase):
+    """
+    It represents the test class to test the snapshot module
+    for identical routing tables after a restart
+    """
+    def buildTable(self, size):
+        """
+        returns a routing table of contacts filled with size peers
+        """
+        routingTable = RoutingTable(Contact(newID(), "127.0.0.1", 4000))
+        for i in range(size):
+            routingTable.addPeer(Contact(newID(), "10.0.%d.%d" % (i // 250, i % 250), 5000 + i, float(i)))
+        return routingTable
+
+    def test_restore(self):
+        """
+        tests snapshot module for equal buckets, contacts and order after a reload
+        """
+        routingTable = self.buildTable(500)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "table.snapshot")
+            save(routingTable, path)
+            restored = load(path, routingTable.node)
+            with self.assertRaises(ValueError):
+                load(path, Contact(newID(), "127.0.0.1", 4000))
+        self.assertEqual(restored.bucketBoundaries, routingTable.bucketBoundaries)
+        self.assertEqual([(bucket.minValue, bucket.maxValue) for bucket in restored.bucketList],
+                         [(bucket.minValue, bucket.maxValue) for bucket in routingTable.bucketList])
+        for old, new in zip(routingTable.bucketList, restored.bucketList):
+            self.assertEqual(new.peerList, old.peerList)
+            self.assertEqual([(peer.processId, peer.lastSeen) for peer in new.peerList],
+                             [(peer.processId, peer.lastSeen) for peer in old.peerList])
+        target = newID()
+        self.assertEqual(restored.findNodes(target), routingTable.findNodes(target))
+        restored.addPeer(Contact(newID(), "10.1.0.1", 6000))
+        with self.assertRaises(ValueError):
+            loads(dumps(routingTable)[:-1], routingTable.node)
+
+    def test_tampered(self):
+        """
+        tests snapshot module for rejecting complete snapshots with broken boundaries or contacts
+        """
+        routingTable = self.buildTable(200)
+        data = dumps(routingTable)
+        def tamper(index, minValue):
+            offset = HEADER.size + index * BUCKET.size
+            return data[:offset] + minValue.to_bytes(20, 'big') + data[offset + 20:]
+        boundaries = routingTable.bucketBoundaries
+        self.assertTrue(len(boundaries) > 3)
+        with self.assertRaises(ValueError):
+            loads(tamper(0, 1), routingTable.node)
+        with self.assertRaises(ValueError):
+            loads(tamper(2, boundaries[1]), routingTable.node)
+        # a boundary moved inside its range leaves contacts outside of their bucket
+        with self.assertRaises(ValueError):
+            loads(tamper(2, boundaries[3] - 1), routingTable.node)
+        first = HEADER.size + len(boundaries) * BUCKET.size
+        last = len(data) - CONTACT.size
+        with self.assertRaises(ValueError):
+            loads(data[:first] + data[last:last + 20] + data[first + 20:], routingTable.node)
+        self.assertEqual(len(loads(data, routingTable.node).allPeers()), 200)
+
+    def test_layout(self):
+        """
+        tests snapshot module for bucket activity taken from the contacts and a recorded digit layout
+        """
+        routingTable = RoutingTable(Contact(newID(), "127.0.0.1", 4000), 2)
+        wallNow = time.time()
+        for i in range(300):
+            routingTable.addPeer(Contact(newID(), "10.0.%d.%d" % (i // 250, i % 250), 5000 + i, wallNow - 60 * (i % 7)))
+        data = dumps(routingTable)
+        with self.assertRaises(ValueError):
+            loads(data, routingTable.node)
+        with self.assertRaises(ValueError):
+            loads(dumps(self.buildTable(20)), Contact(newID(), "127.0.0.1", 4000), digitBits=2)
+        restored = loads(data, routingTable.node, digitBits=2)
+        self.assertEqual(restored.bucketBoundaries, routingTable.bucketBoundaries)
+        now = restored.clock()
+        for bucket in restored.bucketList:
+            if bucket.peers:
+                newest = max(peer.lastSeen for peer in bucket.peers.values())
+                self.assertAlmostEqual(now - bucket.lastAccessed, time.time() - newest, delta=1.0)
+            else:
+                self.assertTrue(bucket.lastAccessed <= now)
+
+    def test_saver(self):
+        """
+        tests snapshot module for saving on the timer and on close
+        """
+        routingTable = self.buildTable(20)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "table.snapshot")
+            async def run():
+                saver = SnapshotSaver(routingTable, path, 0.01)
+                saver.start()
+                await asyncio.sleep(0.05)
+                self.assertTrue(os.path.exists(path))
+                routingTable.addPeer(Contact(newID(), "10.1.0.1", 6000))
+                await saver.close()
+            asyncio.run(run())
+            self.assertEqual(len(load(path, routingTable.node).allPeers()), 21)
+
+    def test_verify(self):
+        """
+        tests snapshot module for removal of loaded contacts that no longer answer
+        """
+        network = LoopbackNetwork()
+        routingTable = RoutingTable(Contact(newID(), "127.0.0.1", 4000))
+        transport = LoopbackTransport(network, routingTable)
+        peers = []
+        for i in range(30):
+            peer = Contact(newID(), "127.0.0.1", 5000 + i)
+            LoopbackTransport(network, RoutingTable(peer)).online = i % 3 != 0
+            routingTable.addPeer(peer)
+            peers.append(peer)
+        restored = loads(dumps(routingTable), routingTable.node)
+        transport.routingTable = restored
+        dead = asyncio.run(verify(restored, transport, timeout=0.05))
+        self.assertEqual(sorted(dead), sorted(peers[::3]))
+        self.assertEqual(sorted(restored.allPeers()), sorted(set(peers) - set(peers[::3])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,510 @@
+"""
+- Module: It contains the key-value storage engine of a node for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import K, KVUPDATE, EXPIRE, STORE_CAPACITY, HOT_READS, HOT_REPLICAS
+from hash import logDistance
+from collections import OrderedDict
+import asyncio
+import heapq
+import itertools
+import time
+
+def cacheTTL(expire, closest, farther):
+    """
+    computes the lifetime of a value cached away from the node holding
+    it, halved for every bit the cache is farther from the key, so that
+    caches far from the key, which few lookups pass, go away quickly
+    @param expire: lifetime of the value at the holding node
+    @type expire: float
+    @param closest: log distance of the holding node to the key
+    @type closest: integer
+    @param farther: log distance of the caching node to the key
+    @type farther: integer
+    @return: seconds
+    """
+    return expire / 2 ** max(0, farther - closest)
+
+class StoreEntry:
+    """
+    It holds one stored value with its publishing times and the number
+    of reads since it was last replicated for popularity
+    """
+    __slots__ = ('value', 'publisherTime', 'republishTime', 'expireTime', 'size', 'reads')
+
+    def __init__(self, value, publisherTime, republishTime, expireTime, size):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param value: the stored value
+        @type value: bytes
+        @param publisherTime: time the original publisher stored the value
+        @type publisherTime: float
+        @param republishTime: time the value was last stored or republished by any node
+        @type republishTime: float
+        @param expireTime: time after which the value is dropped
+        @type expireTime: float
+        @param size: bytes accounted for the entry
+        @type size: integer
+        """
+        self.value = value
+        self.publisherTime = publisherTime
+        self.republishTime = republishTime
+        self.expireTime = expireTime
+        self.size = size
+        self.reads = 0
+
+class Storage:
+    """
+    It represents the key-value store of a node. Entries are kept least
+    recently used first within a byte budget, and two heaps of due times
+    index expiry and republishing, so neither needs a scan of all keys.
+    Heap items are not removed when an entry changes, a stale item is
+    recognised and skipped when it reaches the top, and both heaps are
+    rebuilt once stale items outnumber the entries. Every read counts
+    towards the popularity of a key, a key read hotReads times is queued
+    to be replicated further out than its closest nodes
+    """
+    def __init__(self, capacity=STORE_CAPACITY, expire=EXPIRE, interval=KVUPDATE, clock=time.monotonic, hotReads=HOT_READS):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param capacity: maximum bytes of keys and values held
+        @type capacity: integer, default to STORE_CAPACITY
+        @param expire: seconds a value lives unless republished
+        @type expire: float, default to EXPIRE
+        @param interval: seconds between republishing of a value
+        @type interval: float, default to KVUPDATE
+        @param clock: function returning the current time
+        @type clock: function, default to time.monotonic
+        @param hotReads: reads after which a key is replicated, None to never replicate
+        @type hotReads: integer, default to HOT_READS
+        """
+        self.capacity = capacity
+        self.hotReads = hotReads
+        # keys that became popular, in the order they did
+        self.hot = OrderedDict()
+        self.expire = expire
+        self.interval = interval
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.size = 0
+        self.expiryIndex = []
+        self.republishIndex = []
+
+    def __len__(self):
+        """
+        returns the number of stored keys
+        """
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """
+        checks whether a value that has not expired is stored for the key
+        """
+        return self.get(key, False) is not None
+
+    def store(self, key, value, publisherTime=None, ttl=None):
+        """
+        stores the value for the key. Storing a value the node already
+        holds counts as a republish by another node, so the node skips
+        its own republishing of the key for the next interval. Peers pass
+        the remaining lifetime as ttl, the value then still expires when
+        it would have at the original publisher
+        @param key: key to be stored
+        @type key: bytes or integer
+        @param value: value to be stored
+        @type value: bytes
+        @param publisherTime: time the original publisher stored the value
+        @type publisherTime: float, default to now
+        @param ttl: seconds the value lives, at most the default expiry
+        @type ttl: float, default to the expiry of the store
+        """
+        now = self.clock()
+        self.expireEntries(now)
+        if publisherTime is None:
+            publisherTime = now
+        expireTime = publisherTime + self.expire
+        if ttl is not None and now + ttl < expireTime:
+            # a lifetime stands for a value published that much less than expire ago
+            expireTime = now + ttl
+            publisherTime = expireTime - self.expire
+        if expireTime <= now:
+            self.remove(key)
+            return
+        size = (len(key) if isinstance(key, bytes) else 20) + len(value)
+        entry = self.entries.pop(key, None)
+        reads = 0
+        if entry is not None:
+            self.size -= entry.size
+            publisherTime = max(publisherTime, entry.publisherTime)
+            expireTime = max(expireTime, entry.expireTime)
+            reads = entry.reads
+        entry = self.entries[key] = StoreEntry(value, publisherTime, now, expireTime, size)
+        entry.reads = reads
+        self.size += size
+        heapq.heappush(self.expiryIndex, (expireTime, key))
+        heapq.heappush(self.republishIndex, (now + self.interval, key))
+        while self.size > self.capacity:
+            evicted, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+        if len(self.expiryIndex) > 2 * len(self.entries) + 64:
+            self.compact()
+
+    def compact(self):
+        """
+        rebuilds both heaps from the stored entries, dropping the stale
+        items left by stores of the same key, removals and evictions.
+        Called once stale items outnumber the live ones, which keeps the
+        heaps within a constant factor of the number of keys
+        """
+        self.expiryIndex = [(entry.expireTime, key) for key, entry in self.entries.items()]
+        heapq.heapify(self.expiryIndex)
+        self.republishIndex = [(entry.republishTime + self.interval, key) for key, entry in self.entries.items()]
+        heapq.heapify(self.republishIndex)
+
+    def get(self, key, touch=True):
+        """
+        returns the value stored for the key
+        @param key: key whose value to find
+        @type key: bytes or integer
+        @param touch: whether the key counts as recently used and read
+        @type touch: boolean, default to True
+        @return: value, None if not stored or expired
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expireTime <= self.clock():
+            self.remove(key)
+            return None
+        if touch:
+            self.entries.move_to_end(key)
+            entry.reads += 1
+            if entry.reads == self.hotReads:
+                self.hot[key] = None
+        return entry.value
+
+    def remove(self, key):
+        """
+        removes the key and its value, if stored
+        @param key: key to be removed
+        @type key: bytes or integer
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def expireEntries(self, now=None):
+        """
+        removes all values whose expiry time has passed
+        @param now: current time
+        @type now: float, default to the clock
+        @return: number of removed values
+        """
+        if now is None:
+            now = self.clock()
+        index = self.expiryIndex
+        removed = 0
+        while index and index[0][0] <= now:
+            expireTime, key = heapq.heappop(index)
+            entry = self.entries.get(key)
+            if entry is not None and entry.expireTime <= now:
+                self.remove(key)
+                removed += 1
+        return removed
+
+    def dueKeys(self, now=None):
+        """
+        returns the keys not stored or republished by any node during the
+        last interval, and schedules their next republishing
+        @param now: current time
+        @type now: float, default to the clock
+        @return: list of keys
+        """
+        if now is None:
+            now = self.clock()
+        self.expireEntries(now)
+        index = self.republishIndex
+        due = []
+        while index and index[0][0] <= now:
+            dueTime, key = heapq.heappop(index)
+            entry = self.entries.get(key)
+            if entry is None or entry.republishTime + self.interval > now:
+                # removed, or stored again since this item was pushed
+                continue
+            entry.republishTime = now
+            heapq.heappush(index, (now + self.interval, key))
+            due.append(key)
+        return due
+
+    def republishBatches(self, routingTable, now=None):
+        """
+        groups the keys due for republishing by the closest peers they
+        are bound for, so every peer receives all its keys in one burst
+        @param routingTable: routing table used to find the closest peers
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param now: current time
+        @type now: float, default to the clock
+        @return: list of (list of peers, list of (key, value, publisherTime))
+        """
+        keys = self.dueKeys(now)
+        batches = OrderedDict()
+        for key, peers in zip(keys, routingTable.findNodesMany(keys)):
+            group = tuple(peer.nodeId for peer in peers)
+            if group not in batches:
+                batches[group] = (peers, [])
+            entry = self.entries[key]
+            batches[group][1].append((key, entry.value, entry.publisherTime))
+        return list(batches.values())
+
+    def hotBatches(self, routingTable, count=HOT_REPLICAS):
+        """
+        takes the keys that became popular and returns where to replicate
+        them, the count peers of the routing table next closest to the key
+        after the K closest, which hold it already. A key has to be read
+        hotReads times again before it is replicated again
+        @param routingTable: routing table used to find the peers
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param count: number of peers beyond the K closest
+        @type count: integer, default to HOT_REPLICAS
+        @return: list of (key, value, list of (peer, ttl))
+        """
+        now = self.clock()
+        ownId = routingTable.node.nodeId
+        batches = []
+        while self.hot:
+            key = self.hot.popitem(last=False)[0]
+            entry = self.entries.get(key)
+            if entry is None or entry.expireTime <= now:
+                continue
+            entry.reads = 0
+            num = routingTable.intValue(key)
+            closest = logDistance(ownId, num)
+            remaining = entry.expireTime - now
+            peers = list(itertools.islice(routingTable.iterClosest(num), K, K + count))
+            batches.append((key, entry.value, [(peer, cacheTTL(remaining, closest, logDistance(peer.nodeId, num))) for peer in peers]))
+        return batches
+
+    async def replicateHot(self, routingTable, transport, count=HOT_REPLICAS):
+        """
+        stores the popular keys at count peers beyond their K closest,
+        with a lifetime shrinking with the distance of each peer to the key
+        @param routingTable: routing table used to find the peers
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param transport: transport used to reach peers
+        @type transport: Kademlia.lookup.Transport
+        @param count: number of peers beyond the K closest
+        @type count: integer, default to HOT_REPLICAS
+        @return: number of STORE requests sent
+        """
+        requests = []
+        for key, value, targets in self.hotBatches(routingTable, count):
+            for peer, ttl in targets:
+                requests.append(transport.store(peer, key, value, ttl))
+        await asyncio.gather(*requests, return_exceptions=True)
+        return len(requests)
+
+    async def republish(self, routingTable, transport, now=None):
+        """
+        sends the keys due for republishing to their closest peers, every
+        batch going out as one burst of concurrent STORE requests. Each
+        value is sent with its remaining lifetime, so republishing never
+        extends it past the original publisher time and expire
+        @param routingTable: routing table used to find the closest peers
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param transport: transport used to reach peers
+        @type transport: Kademlia.lookup.Transport
+        @param now: current time
+        @type now: float, default to the clock
+        @return: number of STORE requests sent
+        """
+        if now is None:
+            now = self.clock()
+        requests = []
+        for peers, pairs in self.republishBatches(routingTable, now):
+            for peer in peers:
+                for key, value, publisherTime in pairs:
+                    requests.append(transport.store(peer, key, value, publisherTime + self.expire - now))
+        await asyncio.gather(*requests, return_exceptions=True)
+        return len(requests)
+
+### Test Scenarios ###
+import unittest
+from node import Node
+from routingTable import RoutingTable
+
+class Clock:
+    """
+    It represents a manually advanced clock for the tests
+    """
+    def __init__(self):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        """
+        self.now = 0.0
+
+    def __call__(self):
+        """
+        returns the current time
+        """
+        return self.now
+
+class StoreForwarder:
+    """
+    It represents a transport storing every value in one storage, as if
+    all peers shared it
+    """
+    def __init__(self, storage):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param storage: storage receiving the values
+        @type storage: Kademlia.storage.Storage
+        """
+        self.storage = storage
+
+    async def store(self, peer, key, value, ttl=None):
+        """
+        stores the key value pair with its lifetime
+        """
+        self.storage.store(key, value, ttl=ttl)
+        return True
+
+class TestStorage(unittest.TestCase):
+    """
+    It represents the test class to test the storage module
+    for different functionalities
+    """
+    def test_expiry(self):
+        """
+        tests storage module for expiry of values
+        """
+        clock = Clock()
+        storage = Storage(expire=100, clock=clock)
+        storage.store(b"a" * 20, b"1")
+        storage.store(b"b" * 20, b"2", ttl=10)
+        clock.now = 50
+        self.assertEqual(storage.get(b"b" * 20), None)
+        self.assertEqual(storage.get(b"a" * 20), b"1")
+        storage.store(b"a" * 20, b"1", publisherTime=40)
+        clock.now = 120
+        self.assertEqual(storage.expireEntries(), 0)
+        clock.now = 140
+        self.assertEqual(storage.expireEntries(), 1)
+        self.assertEqual(len(storage), 0)
+        self.assertEqual(storage.size, 0)
+
+    def test_eviction(self):
+        """
+        tests storage module for least recently used eviction within the byte budget
+        """
+        storage = Storage(capacity=100)
+        for i in range(4):
+            storage.store(bytes([i]) * 20, b"x" * 5)
+        storage.get(bytes([0]) * 20)
+        storage.store(bytes([9]) * 20, b"x" * 5)
+        self.assertTrue(bytes([0]) * 20 in storage)
+        self.assertFalse(bytes([1]) * 20 in storage)
+        self.assertEqual(storage.size, 100)
+
+    def test_republish(self):
+        """
+        tests storage module for batched republishing skipping recently republished keys
+        """
+        clock = Clock()
+        storage = Storage(interval=10, clock=clock)
+        routingTable = RoutingTable(Node(0))
+        for i in range(1, 40):
+            routingTable.addPeer(Node(i))
+        keys = [Node(100 + i).nodeId for i in range(30)]
+        for key in keys:
+            storage.store(key, b"value")
+        clock.now = 5
+        storage.store(keys[0], b"value")
+        self.assertEqual(storage.republishBatches(routingTable), [])
+        clock.now = 11
+        batches = storage.republishBatches(routingTable)
+        self.assertEqual(sorted(key for peers, pairs in batches for key, value, publisherTime in pairs), sorted(keys[1:]))
+        for peers, pairs in batches:
+            for key, value, publisherTime in pairs:
+                self.assertEqual(routingTable.findNodes(key), peers)
+        self.assertTrue(len(batches) < len(keys) - 1)
+        self.assertEqual(storage.republishBatches(routingTable), [])
+        clock.now = 16
+        self.assertEqual([pairs[0][0] for peers, pairs in storage.republishBatches(routingTable)], [keys[0]])
+
+    def test_republishExpiry(self):
+        """
+        tests storage module for republished values expiring at the original publisher time
+        """
+        clock = Clock()
+        routingTable = RoutingTable(Node(0))
+        peer = Node(1)
+        routingTable.addPeer(peer)
+        publisher = Storage(expire=100, interval=10, clock=clock)
+        holder = Storage(expire=100, interval=10, clock=clock)
+        key = Node(50).nodeId
+        publisher.store(key, b"value", publisherTime=-20)
+        clock.now = 11
+        self.assertEqual(asyncio.run(publisher.republish(routingTable, StoreForwarder(holder))), 1)
+        self.assertEqual(holder.entries[key].expireTime, 80)
+        # the holder republishing it on and on never extends its life
+        mirror = Storage(expire=100, interval=10, clock=clock)
+        while clock.now < 79:
+            clock.now += 11
+            asyncio.run(holder.republish(routingTable, StoreForwarder(mirror)))
+            self.assertEqual(mirror.entries[key].expireTime, 80)
+        clock.now = 80
+        self.assertFalse(key in holder)
+        self.assertFalse(key in mirror)
+
+    def test_compact(self):
+        """
+        tests storage module for heaps bounded by the number of keys under repeated stores
+        """
+        storage = Storage(capacity=30 * 25)
+        for i in range(5000):
+            storage.store(bytes([i % 50]) * 20, b"x" * 5)
+        self.assertEqual(len(storage), 30)
+        self.assertTrue(len(storage.expiryIndex) <= 2 * len(storage) + 65)
+        self.assertTrue(len(storage.republishIndex) <= 2 * len(storage) + 65)
+        storage.clock = lambda: time.monotonic() + EXPIRE
+        self.assertEqual(storage.expireEntries(), 30)
+
+    def test_hot(self):
+        """
+        tests storage module for popular keys replicated beyond their closest peers
+        """
+        clock = Clock()
+        storage = Storage(expire=1000, clock=clock, hotReads=3)
+        routingTable = RoutingTable(Node(0))
+        for i in range(1, 40):
+            routingTable.addPeer(Node(i))
+        key, cold = Node(100).nodeId, Node(101).nodeId
+        storage.store(key, b"hot")
+        storage.store(cold, b"cold")
+        for i in range(5):
+            storage.get(key)
+        storage.get(cold)
+        self.assertTrue(key in storage)
+        self.assertEqual(list(storage.hot), [key])
+        clock.now = 200
+        batches = storage.hotBatches(routingTable)
+        self.assertEqual([hotKey for hotKey, value, targets in batches], [key])
+        peers = [peer for peer, ttl in batches[0][2]]
+        self.assertEqual(peers, routingTable.findNodes(key, K + HOT_REPLICAS)[K:])
+        for peer, ttl in batches[0][2]:
+            self.assertEqual(ttl, cacheTTL(800, logDistance(routingTable.node.nodeId, key), logDistance(peer.nodeId, key)))
+            self.assertTrue(ttl <= 800)
+        self.assertEqual(storage.hotBatches(routingTable), [])
+        self.assertEqual(cacheTTL(800, 150, 152), 200)
+        self.assertEqual(cacheTTL(800, 150, 140), 800)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,468 @@
+"""
+- Module: It contains the recording of routing table workloads to binary traces and their replay for Kademlia Implementation
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import K
+from node import Node
+from contact import Contact, ContactPool
+from routingTable import RoutingTable
+from trieRoutingTable import TrieRoutingTable
+from hash import ID_BYTES, seedIDs, newIntID
+from simulator import percentile
+from hashlib import sha1
+import argparse
+import random
+import struct
+import sys
+import time
+
+# A trace is a header followed by records, every record an operation code
+# and its fixed size arguments. Node ids are stored as their 20 raw bytes,
+# an addPeer takes 21 bytes and a findNodes 23
+MAGIC = b'KADT'
+VERSION = 1
+HEADER = struct.Struct('!4sB%ds' % ID_BYTES)
+ADD = 1
+REMOVE = 2
+REPLACE = 3
+REPLACE_WITH = 4
+FIND = 5
+BULK = 6
+PEER = struct.Struct('!B%ds' % ID_BYTES)
+PEERS = struct.Struct('!B%ds%ds' % (ID_BYTES, ID_BYTES))
+TARGET = struct.Struct('!B%dsH' % ID_BYTES)
+COUNT = struct.Struct('!BI')
+NAMES = {ADD: 'addPeer', REMOVE: 'removePeer', REPLACE: 'replaceDeadNode',
+         REPLACE_WITH: 'replaceDeadNode', FIND: 'findNodes', BULK: 'bulkLoad'}
+
+# routing tables the replay tool can drive, each built from the node of the trace
+TABLES = {
+    'routing': RoutingTable,
+    'trie': TrieRoutingTable,
+    'relaxed': lambda node: TrieRoutingTable(node, relaxed=True),
+}
+
+def idBytes(peer):
+    """
+    returns the 20 raw bytes of the node id of the peer
+    @param peer: peer or node id
+    @type peer: Kademlia.node.Node, Kademlia.contact.Contact or integer
+    @return: 20 byte string
+    """
+    if isinstance(peer, Contact):
+        return peer.id
+    if isinstance(peer, int):
+        return peer.to_bytes(ID_BYTES, 'big')
+    return peer.nodeId.to_bytes(ID_BYTES, 'big')
+
+class TraceRecorder:
+    """
+    It represents a routing table that appends every call of addPeer,
+    removePeer, replaceDeadNode, findNodes and bulkLoad to a trace file
+    before passing it on. Only the calls made through the recorder are
+    written, a table calling its own methods is not recorded twice.
+    Everything else is read from the wrapped table, so the recorder can
+    stand in for it wherever the table is used
+    """
+    intValue = RoutingTable.intValue
+
+    def __init__(self, routingTable, path):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param routingTable: routing table to be recorded
+        @type routingTable: Kademlia.routingTable.RoutingTable
+        @param path: trace file, appended to if it exists
+        @type path: string
+        @raise ValueError: if the existing trace belongs to another node
+        """
+        self.routingTable = routingTable
+        self.path = path
+        nodeId = idBytes(routingTable.node)
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, nodeId))
+        else:
+            with open(path, 'rb') as trace:
+                header = trace.read(HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION, nodeId):
+                self.file.close()
+                raise ValueError("%s is not a trace of this node" % path)
+        self.write = self.file.write
+
+    def __getattr__(self, name):
+        """
+        returns the attributes of the recorded table
+        """
+        return getattr(self.routingTable, name)
+
+    def __enter__(self):
+        """
+        returns the recorder, which is closed at the end of the block
+        """
+        return self
+
+    def __exit__(self, *exception):
+        """
+        closes the trace file at the end of the block
+        """
+        self.close()
+
+    def addPeer(self, peer):
+        """
+        records and adds the peer, see RoutingTable.addPeer
+        """
+        self.write(PEER.pack(ADD, idBytes(peer)))
+        return self.routingTable.addPeer(peer)
+
+    def removePeer(self, peer):
+        """
+        records and removes the peer, see RoutingTable.removePeer
+        """
+        self.write(PEER.pack(REMOVE, idBytes(peer)))
+        return self.routingTable.removePeer(peer)
+
+    def replaceDeadNode(self, dead, new=None):
+        """
+        records and replaces the dead node, see RoutingTable.replaceDeadNode
+        """
+        if new:
+            self.write(PEERS.pack(REPLACE_WITH, idBytes(dead), idBytes(new)))
+        else:
+            self.write(PEER.pack(REPLACE, idBytes(dead)))
+        return self.routingTable.replaceDeadNode(dead, new)
+
+    def findNodes(self, value, count=K):
+        """
+        records the target and returns its closest peers, see RoutingTable.findNodes
+        """
+        self.write(TARGET.pack(FIND, idBytes(self.intValue(value)), count))
+        return self.routingTable.findNodes(value, count)
+
+    def findNodesMany(self, targets, count=K):
+        """
+        records one findNodes per target, the answers are the same
+        """
+        for value in targets:
+            self.write(TARGET.pack(FIND, idBytes(self.intValue(value)), count))
+        return self.routingTable.findNodesMany(targets, count)
+
+    def bulkLoad(self, peers):
+        """
+        records all peers in one record and adds them, see RoutingTable.bulkLoad
+        """
+        peers = list(peers)
+        self.write(COUNT.pack(BULK, len(peers)))
+        self.write(b''.join(idBytes(peer) for peer in peers))
+        return self.routingTable.bulkLoad(peers)
+
+    def flush(self):
+        """
+        writes the buffered records to the trace file
+        """
+        self.file.flush()
+
+    def close(self):
+        """
+        writes the buffered records and closes the trace file
+        """
+        self.file.close()
+
+def readTrace(path):
+    """
+    reads a trace file. A record cut short, as left by a node stopped in
+    the middle of writing it, ends the trace
+    @param path: trace file
+    @type path: string
+    @return: node id of the trace and the list of records, each an
+    operation code followed by its arguments
+    @raise ValueError: if the file is not a trace or has an unknown record
+    """
+    with open(path, 'rb') as trace:
+        data = trace.read()
+    if len(data) < HEADER.size:
+        raise ValueError("%s is not a trace" % path)
+    magic, version, nodeId = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a trace of version %d" % (path, VERSION))
+    records = []
+    offset = HEADER.size
+    end = len(data)
+    while offset < end:
+        op = data[offset]
+        if op in (ADD, REMOVE, REPLACE):
+            if offset + PEER.size > end:
+                break
+            records.append(PEER.unpack_from(data, offset))
+            offset += PEER.size
+        elif op == FIND:
+            if offset + TARGET.size > end:
+                break
+            records.append(TARGET.unpack_from(data, offset))
+            offset += TARGET.size
+        elif op == REPLACE_WITH:
+            if offset + PEERS.size > end:
+                break
+            records.append(PEERS.unpack_from(data, offset))
+            offset += PEERS.size
+        elif op == BULK:
+            if offset + COUNT.size > end:
+                break
+            count = COUNT.unpack_from(data, offset)[1]
+            start = offset + COUNT.size
+            offset = start + count * ID_BYTES
+            if offset > end:
+                break
+            records.append((BULK, [data[i:i + ID_BYTES] for i in range(start, offset, ID_BYTES)]))
+        else:
+            raise ValueError("unknown record %d at byte %d of %s" % (op, offset, path))
+    return nodeId, records
+
+def replay(path, factory=RoutingTable):
+    """
+    drives a fresh routing table through the operations of a trace as
+    fast as possible. The records are decoded and the peers created
+    before the clock starts, so only the table's own work is timed.
+    The answers of all findNodes calls are summed up in a digest, equal
+    digests of two tables mean they answered every lookup the same
+    @param path: trace file
+    @type path: string
+    @param factory: builds the routing table from the node of the trace
+    @type factory: callable, default to Kademlia.routingTable.RoutingTable
+    @return: the final routing table and the report, with the number of
+    operations, seconds taken, final peers and buckets, answer digest and
+    per operation count, total, mean, p50, p99 and max seconds
+    """
+    nodeId, records = readTrace(path)
+    pool = ContactPool()
+    def contact(id):
+        return pool.intern(id, '0.0.0.0', 0)
+    table = factory(Contact(nodeId, '0.0.0.0', 0))
+    bulkLoad = getattr(table, 'bulkLoad', None)
+    if bulkLoad is None:
+        def bulkLoad(peers):
+            for peer in peers:
+                table.addPeer(peer)
+    methods = {ADD: table.addPeer, REMOVE: table.removePeer, REPLACE: table.replaceDeadNode,
+               REPLACE_WITH: table.replaceDeadNode, FIND: table.findNodes, BULK: bulkLoad}
+    calls = []
+    for record in records:
+        op = record[0]
+        if op == FIND:
+            args = (int.from_bytes(record[1], 'big'), record[2])
+        elif op == BULK:
+            args = ([contact(id) for id in record[1]],)
+        else:
+            args = tuple(contact(id) for id in record[1:])
+        calls.append((op, methods[op], args))
+    timings = dict((name, []) for name in set(NAMES.values()))
+    digest = sha1()
+    clock = time.perf_counter
+    begin = clock()
+    for op, method, args in calls:
+        start = clock()
+        result = method(*args)
+        elapsed = clock() - start
+        timings[NAMES[op]].append(elapsed)
+        if op == FIND:
+            digest.update(b''.join(idBytes(peer) for peer in result))
+    seconds = clock() - begin
+    operations = {}
+    for name, values in timings.items():
+        if not values:
+            continue
+        values.sort()
+        total = sum(values)
+        operations[name] = {'count': len(values), 'total': total, 'mean': total / len(values),
+                            'p50': percentile(values, 50), 'p99': percentile(values, 99),
+                            'max': values[-1]}
+    buckets = table.bucketList
+    report = {
+        'operations': len(calls),
+        'seconds': seconds,
+        'peers': sum(len(bucket) for bucket in buckets),
+        'buckets': len(buckets),
+        'digest': digest.hexdigest(),
+        'timings': operations,
+    }
+    return table, report
+
+def compare(path, factories):
+    """
+    replays one trace on several routing tables
+    @param path: trace file
+    @type path: string
+    @param factories: routing table factories by name
+    @type factories: dictionary
+    @return: dictionary of the reports by name
+    """
+    return dict((name, replay(path, factory)[1]) for name, factory in factories.items())
+
+def recordWorkload(path, size=2000, operations=10000, seed=1):
+    """
+    records a synthetic workload of a node learning about, losing and
+    looking up peers. Ids are drawn from a seeded source, so the same
+    seed always records the same trace
+    @param path: trace file to be written
+    @type path: string
+    @param size: number of peers taking part
+    @type size: integer
+    @param operations: number of operations after the first peers joined
+    @type operations: integer
+    @param seed: seed of the ids and of the operations
+    @type seed: integer
+    @return: the recorded routing table and the digest of its findNodes answers
+    """
+    rng = random.Random(seed)
+    seedIDs(seed)
+    try:
+        routingTable = RoutingTable(Node(0))
+        peers = [Node(i) for i in range(1, size + 1)]
+        digest = sha1()
+        with TraceRecorder(routingTable, path) as recorder:
+            for peer in peers[:size // 10]:
+                recorder.addPeer(peer)
+            for i in range(operations):
+                choice = rng.random()
+                if choice < 0.6:
+                    recorder.addPeer(rng.choice(peers))
+                elif choice < 0.7:
+                    recorder.removePeer(rng.choice(peers))
+                elif choice < 0.75:
+                    recorder.replaceDeadNode(rng.choice(peers))
+                else:
+                    result = recorder.findNodes(newIntID())
+                    digest.update(b''.join(idBytes(peer) for peer in result))
+    finally:
+        seedIDs()
+    return routingTable, digest.hexdigest()
+
+def printReport(name, report):
+    """
+    prints the report of one replay
+    """
+    print("%s: %d operations in %.3f s, %d peers in %d buckets, digest %s" % (
+        name, report['operations'], report['seconds'], report['peers'], report['buckets'], report['digest'][:12]))
+    print("Operation  Count  Mean us  P50 us  P99 us  Max us")
+    for operation, timing in sorted(report['timings'].items()):
+        print("%s  %d  %.2f  %.2f  %.2f  %.2f" % (operation, timing['count'], timing['mean'] * 1e6,
+              timing['p50'] * 1e6, timing['p99'] * 1e6, timing['max'] * 1e6))
+
+### Test Scenarios ###
+import unittest
+import os
+import tempfile
+
+class TestTracing(unittest.TestCase):
+    """
+    It represents the test class to test the tracing module
+    for recording and replaying routing table workloads
+    """
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.trace')
+        os.close(handle)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def layout(self, table):
+        return [(bucket.minValue, bucket.maxValue, list(bucket.peers), list(bucket.replacementCache))
+                for bucket in table.bucketList]
+
+    def test_replay(self):
+        """
+        tests that a replayed trace rebuilds the recorded table and answers
+        """
+        recorded, digest = recordWorkload(self.path, size=600, operations=3000, seed=3)
+        table, report = replay(self.path)
+        self.assertEqual(self.layout(table), self.layout(recorded))
+        self.assertEqual(report['digest'], digest)
+        self.assertEqual(report['operations'], 60 + 3000)
+        self.assertEqual(sum(timing['count'] for timing in report['timings'].values()), report['operations'])
+        self.assertTrue(report['timings']['findNodes']['p50'] <= report['timings']['findNodes']['p99'])
+        # the same seed records the same trace
+        with open(self.path, 'rb') as trace:
+            first = trace.read()
+        os.remove(self.path)
+        recordWorkload(self.path, size=600, operations=3000, seed=3)
+        with open(self.path, 'rb') as trace:
+            self.assertEqual(trace.read(), first)
+
+    def test_records(self):
+        """
+        tests every record type, appending and a trace cut short
+        """
+        node = Node(0)
+        peers = [Node(i) for i in range(1, 40)]
+        with TraceRecorder(RoutingTable(node), self.path) as recorder:
+            recorder.bulkLoad(peers[:30])
+            recorder.replaceDeadNode(peers[0], peers[35])
+            self.assertEqual(len(recorder.findNodesMany([peers[1], peers[2].nodeId])), 2)
+            self.assertEqual(recorder.node, node)
+        with TraceRecorder(RoutingTable(node), self.path) as recorder:
+            recorder.removePeer(peers[3])
+        self.assertRaises(ValueError, TraceRecorder, RoutingTable(Node(0)), self.path)
+        nodeId, records = readTrace(self.path)
+        self.assertEqual(nodeId, idBytes(node))
+        self.assertEqual([record[0] for record in records], [BULK, REPLACE_WITH, FIND, FIND, REMOVE])
+        self.assertEqual(records[0][1], [idBytes(peer) for peer in peers[:30]])
+        with open(self.path, 'ab') as trace:
+            trace.write(PEER.pack(ADD, idBytes(peers[4]))[:-1])
+        self.assertEqual(len(readTrace(self.path)[1]), 5)
+        table, report = replay(self.path)
+        self.assertEqual(report['peers'], 29)
+        self.assertEqual(report['timings']['findNodes']['count'], 2)
+
+    def test_compare(self):
+        """
+        tests replaying one trace on several routing tables
+        """
+        recordWorkload(self.path, size=300, operations=1000, seed=5)
+        reports = compare(self.path, TABLES)
+        self.assertEqual(sorted(reports), sorted(TABLES))
+        for report in reports.values():
+            self.assertEqual(report['operations'], 1030)
+        self.assertEqual(replay(self.path)[1]['digest'], reports['routing']['digest'])
+        self.assertTrue(reports['relaxed']['peers'] >= reports['trie']['peers'])
+
+def main(arguments):
+    """
+    records a synthetic workload or replays a trace on one or more
+    routing tables and prints their reports
+    @param arguments: command line arguments
+    @type arguments: list of strings
+    @return: exit status
+    """
+    parser = argparse.ArgumentParser(description="Kademlia routing table traces")
+    commands = parser.add_subparsers(dest='command')
+    record = commands.add_parser('record', help="record a synthetic seeded workload")
+    record.add_argument('trace')
+    record.add_argument('--peers', type=int, default=2000)
+    record.add_argument('--operations', type=int, default=10000)
+    record.add_argument('--seed', type=int, default=1)
+    run = commands.add_parser('replay', help="replay a trace and report the timings")
+    run.add_argument('trace')
+    run.add_argument('--table', nargs='+', choices=sorted(TABLES), default=['routing'])
+    run.add_argument('--dump', action='store_true', help="print the final table")
+    options = parser.parse_args(arguments)
+    if options.command == 'record':
+        recordWorkload(options.trace, options.peers, options.operations, options.seed)
+        return 0
+    if options.command == 'replay':
+        for name in options.table:
+            table, report = replay(options.trace, TABLES[name])
+            printReport(name, report)
+            if options.dump:
+                table.printBucketList()
+        return 0
+    parser.print_help()
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,313 @@
+"""
+- Module: It contains the binary trie routing table data structure with all the operations implemented as different functions
+- CSE690 Concurrent and Distributed Algorithms
+- Nitin Aggarwal (SBU ID: 108266663)
+- Kademlia - A peer-to-peer network DHT
+"""
+
+# Import the required modules
+from constants import HASH_SIZE, K, BUCKET_SIZE
+from bucket import Bucket
+from node import Node
+from hash import minDistanceInRange
+from routingTable import RoutingTable
+import random
+
+class TrieRoutingTable:
+    """
+    It represents the routing table for the node as a binary trie over
+    the id space. Every leaf is a bucket covering all the ids with a given
+    prefix, and an inner branch is a list holding the subtrees for the
+    next prefix bit being 0 and 1
+    """
+    def __init__(self, node, relaxed=False):
+        """
+        it represents the constructor for the class,
+        which initializes the object variables
+        @param node: the node routing table belongs to
+        @type node: Kademlia.node.Node
+        @param relaxed: also split full buckets that could hold one of the
+        BUCKET_SIZE contacts closest to the node, not only the node's own bucket
+        @type relaxed: boolean, default to False
+        """
+        self.node = node
+        self.relaxed = relaxed
+        self.root = Bucket(0, pow(2,HASH_SIZE))
+
+    # metrics of the table, set by whoever records them, see RoutingTable.instrument
+    metrics = None
+    intValue = RoutingTable.intValue
+    printBucketList = RoutingTable.printBucketList
+
+    @property
+    def bucketList(self):
+        """
+        returns the leaf buckets of the trie in increasing order of range
+        """
+        buckets = []
+        stack = [self.root]
+        while stack:
+            tree = stack.pop()
+            if isinstance(tree, Bucket):
+                buckets.append(tree)
+            else:
+                stack.append(tree[1])
+                stack.append(tree[0])
+        return buckets
+
+    def locate(self, nodeId):
+        """
+        walks the trie down to the bucket that covers the provided node id
+            @param nodeId: node id for which bucket needs to be find
+            @type nodeId: integer representation of 160-bit identifier computed through sha
+            @return: tuple of parent branch, slot in the parent, bucket and its depth
+        """
+        parent, slot, tree, depth = None, 0, self.root, 0
+        while not isinstance(tree, Bucket):
+            parent = tree
+            slot = (nodeId >> (HASH_SIZE - 1 - depth)) & 1
+            tree = tree[slot]
+            depth += 1
+        return parent, slot, tree, depth
+
+    def canSplit(self, bucket, depth):
+        """
+        checks whether a full bucket should be split. The bucket covering
+        the node's own id is always split, in relaxed mode also any bucket
+        that could still hold one of the BUCKET_SIZE contacts closest to the node
+            @param bucket: Bucket object which is full
+            @type bucket: Kademlia.bucket.Bucket
+            @param depth: prefix length of the bucket
+            @type depth: integer
+            @return: boolean value true or false
+        """
+        if depth >= HASH_SIZE:
+            return False
+        if bucket.hashInRange(self.node.nodeId):
+            return True
+        if not self.relaxed:
+            return False
+        closest = self.findNodes(self.node.nodeId, BUCKET_SIZE)
+        if len(closest) < BUCKET_SIZE:
+            return True
+        bound = minDistanceInRange(self.node.nodeId, bucket.minValue, bucket.maxValue)
+        return bound < (closest[-1].nodeId ^ self.node.nodeId)
+
+    def splitBucket(self, parent, slot, bucket):
+        """
+        splits the bucket on its next prefix bit, replacing it in the trie
+        by a branch with two buckets of half the range each
+            @param parent: branch holding the bucket, None for the root
+            @type parent: list
+            @param slot: position of the bucket in the parent
+            @type slot: integer
+            @param bucket: Bucket object of the bucket to be split
+            @type bucket: Kademlia.bucket.Bucket
+            @return: the branch that replaced the bucket
+        """
+        mid = (bucket.minValue + bucket.maxValue) // 2
+        branch = [Bucket(bucket.minValue, mid), Bucket(mid, bucket.maxValue)]
+        for half in branch:
+            bucket.transferPeers(half)
+        if parent is None:
+            self.root = branch
+        else:
+            parent[slot] = branch
+        return branch
+
+    def addPeer(self, peer):
+        """
+        add the peer object in the routing table
+        to the suitable bucket.
+        Different Scenarios:
+            - If it is the node itself, that routing table belongs to,
+              simply return
+            - If the bucket is full and may be split, it is split on its
+              next prefix bit and the peer is added again
+            - If the bucket is full and may not be split, the peer is kept
+              as a replacement candidate
+        @param peer: peer to be added to the bucket's peerList
+        @type peer: Kademlia.node.Node
+        """
+        assert peer.nodeId != None
+        if peer.nodeId == self.node.nodeId:
+            return
+        if not 0 <= peer.nodeId < pow(2,HASH_SIZE):
+            if self.metrics is not None:
+                self.metrics.invalid.inc()
+            return
+        parent, slot, bucket, depth = self.locate(peer.nodeId)
+        while not bucket.addPeer(peer):
+            if not self.canSplit(bucket, depth):
+                bucket.addReplacement(peer)
+                return
+            parent = self.splitBucket(parent, slot, bucket)
+            slot = (peer.nodeId >> (HASH_SIZE - 1 - depth)) & 1
+            bucket = parent[slot]
+            depth += 1
+
+    def removePeer(self, peer):
+        """
+        remove the node from the routing Table
+            @param peer: node object to be removed
+            @type peer: Kademlia.node.Node
+        """
+        assert peer.nodeId != None
+        bucket = self.locate(peer.nodeId)[2]
+        try:
+            bucket.removePeer(peer)
+        except ValueError:
+            pass
+
+    def replaceDeadNode(self, dead, new=None):
+        """
+        replace the dead node with the new node, or with the most recently
+        seen replacement candidate of its bucket when no new node is given
+        @param dead: node object to be removed
+        @type dead: Kademlia.node.Node
+        @param new: node object to be added
+        @type new: Kademlia.node.Node, default to None
+        """
+        bucket = self.locate(dead.nodeId)[2]
+        try:
+            bucket.removePeer(dead)
+        except ValueError:
+            return
+        if new:
+            # the new node may belong to another bucket, or be our own node
+            self.addPeer(new)
+        else:
+            bucket.promoteReplacement()
+
+    def findNodes(self, value, count=K):
+        """
+        returns K nodes from its routing table closest to the provided
+        node id. Subtrees are visited nearest prefix first, so every bucket
+        is further than the ones before it and the walk stops as soon as
+        enough nodes are collected
+            @param value: node id for which K nearest nodes to find
+            @type value: Kademlia.node.Node or integer, string representation
+            of 160-bit identifier computed through sha
+            @param count: number of nearest nodes to be returned
+            @type count: integer, default to K
+            @return: list of K nodes nearest to the provided id, closest first
+            @raise Exception: if value provided is not of suitable type
+        """
+        num = self.intValue(value)
+        nodes = []
+        stack = [(self.root, 0)]
+        while stack and len(nodes) < count:
+            tree, depth = stack.pop()
+            if isinstance(tree, Bucket):
+                nodes.extend(sorted(tree.peers.values(), key=lambda peer: peer.nodeId ^ num))
+            else:
+                near = (num >> (HASH_SIZE - 1 - depth)) & 1
+                stack.append((tree[1 - near], depth + 1))
+                stack.append((tree[near], depth + 1))
+        return nodes[0:count]
+
+    def findNodesMany(self, targets, count=K):
+        """
+        returns the K closest nodes for every one of the provided node ids
+            @param targets: node ids for which K nearest nodes to find
+            @type targets: list of Kademlia.node.Node or integer, string representation
+            of 160-bit identifier computed through sha
+            @param count: number of nearest nodes to be returned per target
+            @type count: integer, default to K
+            @return: list with the list of nearest nodes for each target, in the order of targets
+        """
+        return [self.findNodes(value, count) for value in targets]
+
+    def randomPeer(self):
+        """
+        returns randomly any peer from the routing table
+        """
+        buckets = [bucket for bucket in self.bucketList if len(bucket) > 0]
+        return random.choice(random.choice(buckets).peerList)
+
+### Test Scenarios ###
+import unittest
+
+class TestTrieRoutingTable(unittest.TestCase):
+    """
+    It represents the test class to test the trieRoutingTable module
+    for different functionalities
+    """
+    def test_split(self):
+        """
+        tests that only the bucket covering the node's own id is split
+        """
+        node = Node(0)
+        routingTable = TrieRoutingTable(node)
+        for i in range(1, 500):
+            routingTable.addPeer(Node(i))
+        buckets = routingTable.bucketList
+        depth = routingTable.locate(node.nodeId)[3]
+        self.assertEqual(len(buckets), depth + 1)
+        for bucket in buckets:
+            size = bucket.maxValue - bucket.minValue
+            self.assertEqual(size & (size - 1), 0)
+            self.assertEqual(bucket.minValue % size, 0)
+            self.assertTrue(len(bucket) <= BUCKET_SIZE)
+        self.assertEqual(buckets[0].minValue, 0)
+        self.assertEqual(buckets[-1].maxValue, 2**HASH_SIZE)
+
+    def test_relaxed(self):
+        """
+        tests that relaxed splitting keeps more contacts close to the node
+        """
+        node = Node(0)
+        strict = TrieRoutingTable(node)
+        relaxed = TrieRoutingTable(node, True)
+        for i in range(1, 2000):
+            peer = Node(i)
+            strict.addPeer(peer)
+            relaxed.addPeer(peer)
+        self.assertTrue(len(relaxed.bucketList) >= len(strict.bucketList))
+        closestRelaxed = relaxed.findNodes(node.nodeId, BUCKET_SIZE)
+        closestStrict = strict.findNodes(node.nodeId, BUCKET_SIZE)
+        for a, b in zip(closestRelaxed, closestStrict):
+            self.assertTrue(a.nodeId ^ node.nodeId <= b.nodeId ^ node.nodeId)
+
+    def test_find(self):
+        """
+        tests the trie walk against a full scan of the known peers
+        """
+        routingTable = TrieRoutingTable(Node(0), True)
+        peers = [Node(i) for i in range(1, 300)]
+        for peer in peers:
+            routingTable.addPeer(peer)
+        known = [peer for bucket in routingTable.bucketList for peer in bucket.peerList]
+        for i in range(50):
+            target = Node(i).nodeId
+            expected = sorted(known, key=lambda peer: peer.nodeId ^ target)
+            self.assertEqual(routingTable.findNodes(target), expected[:K])
+            self.assertEqual(routingTable.findNodes(target, 30), expected[:30])
+        peer = routingTable.randomPeer()
+        routingTable.removePeer(peer)
+        self.assertFalse(peer in routingTable.findNodes(peer.nodeId))
+
+    def test_replace(self):
+        """
+        tests that a new node replacing a dead one goes to the bucket covering its id
+        """
+        node = Node(0)
+        routingTable = TrieRoutingTable(node)
+        for i in range(1, 300):
+            routingTable.addPeer(Node(i))
+        dead = routingTable.randomPeer()
+        bucket = routingTable.locate(dead.nodeId)[2]
+        other = next(other for other in routingTable.bucketList if other is not bucket)
+        new = Node(1000)
+        new.nodeId = next(i for i in range(other.minValue, other.maxValue) if i not in other)
+        routingTable.replaceDeadNode(dead, new)
+        self.assertFalse(dead in bucket or new in bucket)
+        other = routingTable.locate(new.nodeId)[2]
+        self.assertTrue(new in other or new.nodeId in other.replacementCache)
+        routingTable.replaceDeadNode(routingTable.randomPeer(), node)
+        for bucket in routingTable.bucketList:
+            self.assertTrue(all(bucket.minValue <= peer.nodeId < bucket.maxValue for peer in bucket.peerList))
+            self.assertFalse(node in bucket)
+
+if __name__ == '__main__':
+    unittest.main()